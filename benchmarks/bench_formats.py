@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Compare decoding and unpacking of Waterfox-like tarball in each format"""
+import os
+import io
+import sys
+import bz2
+import lzma
+import time
+import shutil
+import tarfile
+import argparse
+import tempfile
+import subprocess
+
+pj = os.path.join
+pn = os.path.normpath
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, pn(pj(script_path, "..", "src")))
+import install_waterfox_common as installcommon
+import install_waterfox_bz2
+import install_waterfox_zstd
+import bench_install
+
+BLOCK_SIZE = 8 * 1048576
+
+
+def makeTar(workDir, scale):
+    """Return uncompressed tarball of synthetic Waterfox tree"""
+    treePath = pj(workDir, "tree")
+    bench_install.makeTree(pj(treePath, "waterfox"), scale)
+    tarData = io.BytesIO()
+    with tarfile.open(fileobj=tarData, mode="w") as tar:
+        tar.add(pj(treePath, "waterfox"), arcname="waterfox")
+    shutil.rmtree(treePath)
+    return tarData.getvalue()
+
+
+def xzBlocks(tarData, path):
+    """Write xz file of more blocks, like multithreaded xz does"""
+    if shutil.which("xz"):
+        with open(path, "wb") as xzFile:
+            subprocess.run(["xz", "-T0", "--block-size={}".format(BLOCK_SIZE), "-c"],
+                           input=tarData, stdout=xzFile, check=True)
+        return
+    # Concatenated single-block streams are decoded in parallel too
+    with open(path, "wb") as xzFile:
+        for start in range(0, len(tarData), BLOCK_SIZE):
+            xzFile.write(lzma.compress(tarData[start:start + BLOCK_SIZE]))
+
+
+def zstdFrames(tarData, path):
+    """Write zstd file the same way as recompression cache does"""
+    writer = install_waterfox_zstd.zstdWriter(open(path, "wb"))
+    for start in range(0, len(tarData), 1048576):
+        writer.write(tarData[start:start + 1048576])
+    if not writer.finish():
+        raise writer.error
+
+
+def makePackages(workDir, tarData):
+    """Return list of (format name, path) of compressed tarballs"""
+    packages = [("tar.bz2", pj(workDir, "waterfox-G5.1.tar.bz2")),
+                ("tar.xz", pj(workDir, "waterfox-G5.2.tar.xz")),
+                ("tar.xz blocks", pj(workDir, "waterfox-G5.3.tar.xz"))]
+    with open(packages[0][1], "wb") as bz2File:
+        bz2File.write(bz2.compress(tarData, 9))
+    with open(packages[1][1], "wb") as xzFile:
+        xzFile.write(lzma.compress(tarData))
+    xzBlocks(tarData, packages[2][1])
+    if install_waterfox_zstd.available():
+        packages.append(("tar.zst", pj(workDir, "waterfox-G5.4.tar.zst")))
+        with open(packages[-1][1], "wb") as zstdFile:
+            zstdFile.write(install_waterfox_zstd.compressFrame(tarData, 19))
+        packages.append(("tar.zst frames", pj(workDir, "waterfox-G5.5.tar.zst")))
+        zstdFrames(tarData, packages[-1][1])
+    else:
+        print("zstd skipped, Python 3.14+ or zstd program is needed")
+    return packages
+
+
+def decode(path, _workDir):
+    fileobj, _position, rawFile = installcommon.openTarball(path)
+    try:
+        while fileobj.read(1048576):
+            pass
+    finally:
+        fileobj.close()
+        if rawFile is not None:
+            rawFile.close()
+
+
+def unpack(path, workDir):
+    destPath = pj(workDir, "unpacked")
+    os.makedirs(destPath)
+    try:
+        installcommon.unpackTarball(path, destPath)
+    finally:
+        shutil.rmtree(destPath)
+
+
+def bestTime(func, path, workDir, repeat):
+    times = []
+    for _i in range(repeat):
+        start = time.perf_counter()
+        func(path, workDir)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare decoding and unpacking of tarball in each format")
+    parser.add_argument("--scale", type=float, default=0.25,
+                        help="size of synthetic package relative to real Waterfox")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs, shortest is reported")
+    args = parser.parse_args()
+
+    workDir = tempfile.mkdtemp()
+    try:
+        tarData = makeTar(workDir, args.scale)
+        packages = makePackages(workDir, tarData)
+        print("Tarball: {:.1f} MiB, CPUs: {}".format(
+            len(tarData) / 1048576, install_waterfox_bz2.cpuCount()))
+        print("{:<16} {:>10} {:>7} {:>10} {:>10} {:>10}".format(
+            "format", "size MiB", "ratio", "decode s", "MiB/s", "unpack s"))
+        for name, path in packages:
+            size = os.path.getsize(path)
+            decodeTime = bestTime(decode, path, workDir, args.repeat)
+            unpackTime = bestTime(unpack, path, workDir, args.repeat)
+            print("{:<16} {:>10.1f} {:>7.2f} {:>10.3f} {:>10.1f} {:>10.3f}".format(
+                name, size / 1048576, len(tarData) / size, decodeTime,
+                len(tarData) / 1048576 / decodeTime, unpackTime))
+    finally:
+        shutil.rmtree(workDir)
+
+
+if __name__ == "__main__":
+    main()
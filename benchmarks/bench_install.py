@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Measure install/uninstall phases and compare them with saved baseline"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import tarfile
+import argparse
+import resource
+import statistics
+import tempfile
+
+pj = os.path.join
+pn = os.path.normpath
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, pn(pj(script_path, "..", "src")))
+import install_waterfox_common as installcommon
+import fake_appimage
+
+baseline_path = pj(script_path, "baseline.json")
+
+# Sizes (in MiB) of largest files in Waterfox G tarball
+BIG_FILES = {
+    "libxul.so": 140,
+    "omni.ja": 32,
+    "browser/omni.ja": 26,
+    "libmozavcodec.so": 3,
+    "libnss3.so": 1.5,
+    "libfreeblpriv3.so": 0.8,
+    "waterfox-bin": 0.7,
+    "libmozsqlite3.so": 1.6,
+    "libgkcodecs.so": 0.8,
+    "fonts/TwemojiMozilla.ttf": 1.3,
+}
+SMALL_DIRS = ("browser/features", "defaults/pref", "dictionaries", "distribution",
+              "gmp-clearkey/0.1", "browser/chrome/icons/default", "gtk2", "fonts")
+ICON_SIZES = ("16", "22", "24", "32", "48", "128", "256")
+METRICS = ("wall", "cpu", "peakRss", "readBytes", "writeBytes")
+
+
+def writeFile(path, size, rnd):
+    """Write file that compresses about as well as shared libraries do"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        while size > 0:
+            chunk = min(size, 65536)
+            f.write(rnd.randbytes(chunk // 2) + bytes(chunk - chunk // 2))
+            size -= chunk
+
+
+def makeTree(rootPath, scale, seed=116477):
+    """Create tree similar to unpacked Waterfox, scale shrinks big files"""
+    rnd = random.Random(seed)
+    for name, size in BIG_FILES.items():
+        writeFile(pj(rootPath, name), int(size * 1048576 * scale), rnd)
+    for i in range(int(400 * min(scale * 10, 1)) or 1):
+        subDir = SMALL_DIRS[i % len(SMALL_DIRS)]
+        writeFile(pj(rootPath, subDir, "file{}".format(i)),
+                  int(rnd.paretovariate(1.2) * 1024), rnd)
+    for size in ICON_SIZES:
+        writeFile(pj(rootPath, "browser/chrome/icons/default/default{}.png".format(size)),
+                  int(size) * int(size), rnd)
+    with open(pj(rootPath, "waterfox"), "w", encoding='utf-8') as stub:
+        stub.write("#!/bin/sh\nexec \"$(dirname \"$0\")/waterfox-bin\" \"$@\"\n")
+    os.chmod(pj(rootPath, "waterfox"), 0o755)
+
+
+def makePackages(workDir, scale):
+    """Return paths of synthetic tarball (with checksum file) and AppImage"""
+    treePath = pj(workDir, "tree")
+    makeTree(pj(treePath, "waterfox"), scale)
+    tarballPath = pj(workDir, "waterfox-G5.1.tar.bz2")
+    with tarfile.open(tarballPath, "w:bz2") as tar:
+        tar.add(pj(treePath, "waterfox"), arcname="waterfox")
+    digest = hashlib.sha256()
+    installcommon.hashFile(tarballPath, digest)
+    with open(tarballPath + ".sha256", "w", encoding='utf-8') as checksumFile:
+        checksumFile.write(digest.hexdigest() + " " + os.path.basename(tarballPath) + "\n")
+
+    appImageTreePath = pj(workDir, "appimage")
+    shutil.move(pj(treePath, "waterfox"), pj(appImageTreePath, "usr", "bin"))
+    os.rename(pj(appImageTreePath, "usr", "bin", "waterfox"),
+              pj(appImageTreePath, "usr", "bin", "waterfox-g"))
+    appImagePath = pj(workDir, "waterfox-G5.1.AppImage")
+    fake_appimage.makeAppImage(appImageTreePath, appImagePath)
+    shutil.rmtree(treePath)
+    shutil.rmtree(appImageTreePath)
+    return tarballPath, appImagePath
+
+
+def makeHome(workDir):
+    """Point HOME and XDG_* at temporary directories and stub desktop tools"""
+    homePath = pj(workDir, "home")
+    stubsPath = pj(workDir, "stubs")
+    for path in (pj(homePath, "Desktop"), stubsPath):
+        os.makedirs(path)
+    stubs = {"xdg-user-dir": "echo \"$HOME/Desktop\""}
+    for name, body in stubs.items():
+        with open(pj(stubsPath, name), "w", encoding='utf-8') as stub:
+            stub.write("#!/bin/sh\n" + body + "\n")
+        os.chmod(pj(stubsPath, name), 0o755)
+    os.environ["HOME"] = homePath
+    os.environ["XDG_CONFIG_HOME"] = pj(homePath, ".config")
+    os.environ["XDG_CACHE_HOME"] = pj(homePath, ".cache")
+    os.environ["XDG_DATA_HOME"] = pj(homePath, ".local", "share")
+    os.environ["PATH"] = stubsPath + os.pathsep + os.environ.get("PATH", "")
+    return homePath
+
+
+def readIo():
+    """Return (read_bytes, write_bytes) of this process from /proc/self/io"""
+    counters = {}
+    try:
+        with open("/proc/self/io", "r", encoding='utf-8') as io:
+            for line in io:
+                name, value = line.split(":")
+                counters[name] = int(value)
+    except OSError:
+        pass
+    return counters.get("read_bytes", 0), counters.get("write_bytes", 0)
+
+
+def resetPeakRss():
+    # Writing 5 to clear_refs resets VmHWM (Linux 4.0+)
+    try:
+        with open("/proc/self/clear_refs", "w", encoding='utf-8') as clearRefs:
+            clearRefs.write("5")
+    except OSError:
+        pass
+
+
+def peakRss():
+    """Return peak resident set size in bytes since last resetPeakRss()"""
+    try:
+        with open("/proc/self/status", "r", encoding='utf-8') as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class phaseRecorder:
+    """Collect resource usage of each phase reported through progressDef"""
+
+    def __init__(self):
+        self.phases = {}
+        self.start = None
+
+    def snapshot(self):
+        selfUsage = resource.getrusage(resource.RUSAGE_SELF)
+        childUsage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (selfUsage.ru_utime + selfUsage.ru_stime +
+               childUsage.ru_utime + childUsage.ru_stime)
+        return (time.perf_counter(), cpu) + readIo()
+
+    def begin(self):
+        resetPeakRss()
+        self.start = self.snapshot()
+
+    def end(self, phase):
+        wall, cpu, readBytes, writeBytes = (
+            b - a for a, b in zip(self.start, self.snapshot()))
+        self.phases[phase] = {"wall": wall, "cpu": cpu, "peakRss": peakRss(),
+                              "readBytes": readBytes, "writeBytes": writeBytes}
+
+    def progressDef(self, event):
+        if event.type == "phaseStart":
+            self.begin()
+        elif event.type == "phaseEnd":
+            self.end(event.phase)
+
+
+def waitForChildren():
+    """Wait for detached trash removal started by install/uninstall,
+    it would otherwise remove files under hands of next scenario"""
+    while True:
+        try:
+            os.waitpid(-1, 0)
+        except ChildProcessError:
+            break
+
+
+def runScenario(name, func, recorder):
+    recorder.begin()
+    whole = phaseRecorder()
+    whole.begin()
+    func(recorder.progressDef)
+    whole.end(name)
+    results = {"{}.{}".format(name, phase): values
+               for phase, values in recorder.phases.items()}
+    results[name] = whole.phases[name]
+    recorder.phases.clear()
+    return results
+
+
+def runOnce(tarballPath, appImagePath, workDir):
+    homePath = makeHome(pj(workDir, "run"))
+    installPath = pj(homePath, ".local", "lib")
+    configFilePath = pj(os.environ["XDG_CONFIG_HOME"], "install_waterfox", "settings.conf")
+
+    def quiet(_msg):
+        pass
+
+    def installPackage(sourcePath):
+        return lambda progressDef: installcommon.install(
+            sourcePath, installPath, "G", "yes", "no", "no", configFilePath, quiet,
+            progressDef=progressDef)
+
+    def uninstallPackage(progressDef):
+        installcommon.uninstall(installPath, "G", configFilePath, "yes", quiet,
+                                progressDef=progressDef)
+
+    scenarios = (("installTarball", installPackage(tarballPath)),
+                 ("upgradeTarball", installPackage(tarballPath)),
+                 ("uninstallTarball", uninstallPackage),
+                 ("installAppImage", installPackage(appImagePath)),
+                 ("uninstallAppImage", uninstallPackage))
+    recorder = phaseRecorder()
+    results = {}
+    for name, func in scenarios:
+        results.update(runScenario(name, func, recorder))
+        # Don't let detached trash removal disturb next scenario
+        waitForChildren()
+    shutil.rmtree(pj(workDir, "run"), ignore_errors=True)
+    return results
+
+
+def median(runs):
+    """Merge results of repeated runs into their medians"""
+    return {key: {metric: statistics.median(run[key][metric] for run in runs)
+                  for metric in METRICS}
+            for key in runs[0]}
+
+
+def findRegressions(results, baseline, tolerance, minWall):
+    """Return list of messages about metrics worse than baseline"""
+    regressions = []
+    for key, values in results.items():
+        if key not in baseline:
+            continue
+        for metric in METRICS:
+            old, new = baseline[key].get(metric), values[metric]
+            if old is None or new <= old * (1 + tolerance):
+                continue
+            # Short phases are dominated by noise
+            if metric in ("wall", "cpu") and new - old < minWall:
+                continue
+            regressions.append("{} {}: {:.4g} -> {:.4g} (+{:.0%})".format(
+                key, metric, old, new, new / old - 1 if old else float("inf")))
+    return regressions
+
+
+def printResults(results):
+    print("{:<32} {:>9} {:>9} {:>10} {:>10} {:>10}".format(
+        "phase", "wall [s]", "cpu [s]", "rss [MiB]", "read [MiB]", "write [MiB]"))
+    for key, values in results.items():
+        print("{:<32} {:>9.3f} {:>9.3f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            key, values["wall"], values["cpu"], values["peakRss"] / 1048576,
+            values["readBytes"] / 1048576, values["writeBytes"] / 1048576))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure install/uninstall phases and compare them with baseline")
+    parser.add_argument("--scale", type=float, default=0.1,
+                        help="size of synthetic packages relative to real Waterfox")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs, medians are reported")
+    parser.add_argument("--baseline", default=baseline_path,
+                        help="JSON file with baseline results")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store results as new baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown before failing")
+    parser.add_argument("--min-wall", type=float, default=0.05,
+                        help="ignore time differences shorter than this (seconds)")
+    parser.add_argument("--output", help="also write results into this JSON file")
+    args = parser.parse_args()
+
+    workDir = tempfile.mkdtemp()
+    environ = dict(os.environ)
+    try:
+        tarballPath, appImagePath = makePackages(workDir, args.scale)
+        print("Packages: {} ({} bytes), {} ({} bytes)".format(
+            os.path.basename(tarballPath), os.path.getsize(tarballPath),
+            os.path.basename(appImagePath), os.path.getsize(appImagePath)))
+        results = median([runOnce(tarballPath, appImagePath, workDir)
+                          for _i in range(args.repeat)])
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        waitForChildren()
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    printResults(results)
+    document = {"scale": args.scale, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding='utf-8') as outputFile:
+            json.dump(document, outputFile, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding='utf-8') as baselineFile:
+            json.dump(document, baselineFile, indent=2)
+        print("Baseline saved to {}".format(args.baseline))
+        return
+    if not os.path.isfile(args.baseline):
+        print("No baseline in {}, run with --save-baseline first".format(args.baseline))
+        return
+    with open(args.baseline, "r", encoding='utf-8') as baselineFile:
+        baseline = json.load(baselineFile)
+    if baseline.get("scale") != args.scale:
+        sys.exit("Baseline was recorded with --scale {}".format(baseline.get("scale")))
+    regressions = findRegressions(results, baseline["results"], args.tolerance, args.min_wall)
+    if regressions:
+        print("REGRESSIONS against {}:".format(args.baseline), file=sys.stderr)
+        for message in regressions:
+            print("  " + message, file=sys.stderr)
+        sys.exit(1)
+    print("No regressions against {}".format(args.baseline))
+
+
+if __name__ == "__main__":
+    main()
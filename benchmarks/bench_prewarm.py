@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Measure first launch latency of stub Waterfox with and without prewarming"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+import shutil
+
+pj = os.path.join
+pn = os.path.normpath
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, pn(pj(script_path, "..", "src")))
+import install_waterfox_prewarm
+import bench_install
+
+# Maps libraries and omni.ja like real Waterfox does and touches random
+# pages of them, so cold start is made of page faults with random I/O
+STUB = """#!{python}
+import os, sys, mmap, random, time
+root = os.path.dirname(os.path.realpath(__file__))
+names = sorted(name for name in os.listdir(root) if name.endswith(".so"))
+names += ["omni.ja", "browser/omni.ja"]
+rnd = random.Random(116477)
+maps = []
+for name in names:
+    f = open(os.path.join(root, name), "rb")
+    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    maps.append((f, m))
+    pages = len(m) // 4096
+    for _i in range(int(pages * {touched}) or 1):
+        m[rnd.randrange(pages) * 4096]
+if "--hold" in sys.argv:
+    time.sleep(3600)
+"""
+
+
+def makeInstalledTree(workDir, scale, touched):
+    """Create installed tree with stub binary, return its path"""
+    treePath = pj(workDir, "waterfox-g")
+    bench_install.makeTree(treePath, scale)
+    with open(pj(treePath, "waterfox-bin"), "w", encoding='utf-8') as stub:
+        stub.write(STUB.format(python=sys.executable, touched=touched))
+    os.chmod(pj(treePath, "waterfox-bin"), 0o755)
+    return treePath
+
+
+def evictTree(treePath):
+    """Drop files of tree from page cache"""
+    if os.geteuid() == 0:
+        os.sync()
+        try:
+            with open("/proc/sys/vm/drop_caches", "w", encoding='utf-8') as dropCaches:
+                dropCaches.write("1")
+            return
+        except OSError:
+            pass
+    for root, _dirs, files in os.walk(treePath):
+        for name in files:
+            with open(pj(root, name), "rb") as f:
+                os.fsync(f.fileno())
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def launch(treePath):
+    """Return wall time (s) of stub launch"""
+    start = time.perf_counter()
+    subprocess.run([pj(treePath, "waterfox")], check=True)
+    return time.perf_counter() - start
+
+
+def scenarioCold(treePath, _hotFiles):
+    evictTree(treePath)
+    return launch(treePath), None
+
+
+def scenarioPrewarmed(treePath, hotFiles):
+    evictTree(treePath)
+    warmer = install_waterfox_prewarm.prewarmer(
+        install_waterfox_prewarm.planPrewarm(treePath, hotFiles, 1 << 40))
+    warmer.wait()
+    return launch(treePath), warmer.elapsed()
+
+
+def scenarioConcurrent(treePath, hotFiles):
+    # User starts Waterfox right after installer finished
+    evictTree(treePath)
+    warmer = install_waterfox_prewarm.prewarmer(
+        install_waterfox_prewarm.planPrewarm(treePath, hotFiles, 1 << 40))
+    elapsed = launch(treePath)
+    warmer.wait()
+    return elapsed, warmer.elapsed()
+
+
+SCENARIOS = [("cold", scenarioCold), ("prewarmed", scenarioPrewarmed),
+             ("launch at once", scenarioConcurrent)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure first launch latency with and without prewarming")
+    parser.add_argument("--scale", type=float, default=0.5,
+                        help="size of synthetic tree relative to real Waterfox")
+    parser.add_argument("--touched", type=float, default=0.1,
+                        help="part of pages touched by stub launch")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs, median is reported")
+    args = parser.parse_args()
+
+    workDir = tempfile.mkdtemp()
+    try:
+        treePath = makeInstalledTree(workDir, args.scale, args.touched)
+        hotFiles = install_waterfox_prewarm.recordLaunch(
+            treePath, seconds=3, command=[pj(treePath, "waterfox"), "--hold"])
+        missing = [name for name in ("libxul.so", "omni.ja", "browser/omni.ja")
+                   if name not in hotFiles]
+        if missing:
+            print("Recorded hot list misses {}".format(", ".join(missing)), file=sys.stderr)
+            sys.exit(1)
+        hotSize = sum(size for _path, size in install_waterfox_prewarm.planPrewarm(
+            treePath, hotFiles, 1 << 40))
+        print("Recorded {} hot files, {:.1f} MiB".format(len(hotFiles), hotSize / 1048576))
+        if os.geteuid() != 0:
+            print("Not root, files are evicted with posix_fadvise(DONTNEED)")
+        print("{:<16} {:>10} {:>12}".format("scenario", "launch s", "prewarm s"))
+        results = {}
+        for name, scenario in SCENARIOS:
+            runs = [scenario(treePath, hotFiles) for _i in range(args.repeat)]
+            results[name] = statistics.median(run[0] for run in runs)
+            prewarmTimes = [run[1] for run in runs if run[1] is not None]
+            print("{:<16} {:>10.3f} {:>12}".format(
+                name, results[name], "{:.3f}".format(statistics.median(prewarmTimes))
+                if prewarmTimes else "-"))
+        print("First launch is {:.1f}x faster after prewarming".format(
+            results["cold"] / results["prewarmed"]))
+    finally:
+        shutil.rmtree(workDir)
+
+
+if __name__ == "__main__":
+    main()
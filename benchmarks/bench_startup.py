@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Check startup time of entry points against budget"""
+import os
+import sys
+import argparse
+import subprocess
+import time
+
+pj = os.path.join
+pn = os.path.normpath
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+src_path = pn(pj(script_path, "..", "src"))
+
+# (name, arguments of python, budget in ms above bare interpreter,
+#  modules which mustn't be imported)
+CASES = [
+    ("CLI -v", [pj(src_path, "install_waterfox_CLI.py"), "-v"], 25,
+     ["argparse", "install_waterfox_common"]),
+    ("CLI -h", [pj(src_path, "install_waterfox_CLI.py"), "-h"], 60,
+     ["install_waterfox_common", "tarfile"]),
+    ("import common", ["-c", "import install_waterfox_common"], 120,
+     ["install_waterfox_bz2", "install_waterfox_xz", "install_waterfox_zstd",
+      "install_waterfox_squashfs", "install_waterfox_iconcache",
+      "install_waterfox_prewarm", "multiprocessing"]),
+    ("import GUI", ["-c", "import install_waterfox_GUI"], 400,
+     ["install_waterfox_common"]),
+]
+
+
+def bestTime(pythonArgs, repeat):
+    """Return shortest wall time (ms) of running python with pythonArgs"""
+    times = []
+    for _i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + pythonArgs, cwd=src_path, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+
+def importedModules(pythonArgs):
+    """Return names of modules imported by python with pythonArgs"""
+    result = subprocess.run([sys.executable, "-X", "importtime"] + pythonArgs,
+                            cwd=src_path, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=False)
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check startup time of entry points against budget")
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="number of runs, shortest is reported")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiply budgets, e.g. for slow machines")
+    args = parser.parse_args()
+
+    bare = bestTime(["-c", "pass"], args.repeat)
+    print("{:<16} {:>9.1f} ms".format("bare python", bare))
+    failures = []
+    for name, pythonArgs, budget, forbidden in CASES:
+        if name == "import GUI" and subprocess.run(
+                [sys.executable, "-c", "import gi"], check=False,
+                stderr=subprocess.DEVNULL).returncode != 0:
+            print("{:<16} skipped, PyGObject isn't installed".format(name))
+            continue
+        elapsed = bestTime(pythonArgs, args.repeat) - bare
+        print("{:<16} {:>9.1f} ms (budget {:.0f} ms)".format(name, elapsed, budget * args.scale))
+        if elapsed > budget * args.scale:
+            failures.append("{} takes {:.1f} ms, budget is {:.0f} ms".format(
+                name, elapsed, budget * args.scale))
+        loaded = sorted(importedModules(pythonArgs) & set(forbidden))
+        if loaded:
+            failures.append("{} imports {}".format(name, ", ".join(loaded)))
+    if failures:
+        print("OVER BUDGET:", file=sys.stderr)
+        for message in failures:
+            print("  " + message, file=sys.stderr)
+        sys.exit(1)
+    print("All entry points are within budget")
+
+
+if __name__ == "__main__":
+    main()
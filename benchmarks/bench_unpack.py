@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Compare ways of unpacking Waterfox-like tarball"""
+import os
+import sys
+import bz2
+import time
+import shutil
+import tarfile
+import tempfile
+
+pj = os.path.join
+pn = os.path.normpath
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, pn(pj(script_path, "..", "src")))
+import install_waterfox_common as installcommon
+import install_waterfox_bz2
+
+
+class countingReader:
+    """Count bytes read from decompressed stream"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.bytesRead = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.bytesRead += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        return self.fileobj.seek(offset, whence)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def close(self):
+        self.fileobj.close()
+
+
+def makeTarball(path, filesCount=2000, seed=116477):
+    """Create tarball with similar layout to Waterfox one"""
+    rnd = __import__("random").Random(seed)
+    with tempfile.TemporaryDirectory() as srcDir:
+        root = pj(srcDir, "waterfox")
+        for i in range(filesCount):
+            subDir = pj(root, "dir{}".format(i % 40), "sub{}".format(i % 7))
+            os.makedirs(subDir, exist_ok=True)
+            size = int(rnd.paretovariate(1.2) * 2048)
+            with open(pj(subDir, "file{}".format(i)), "wb") as f:
+                f.write(rnd.randbytes(size // 2) + bytes(size // 2))
+        with tarfile.open(path, "w:bz2") as tar:
+            tar.add(root, arcname="waterfox")
+
+
+def randomAccess(tarballPath, destPath):
+    reader = countingReader(bz2.BZ2File(tarballPath))
+    with tarfile.open(fileobj=reader, mode="r:") as tar:
+        tar.extractall(destPath)
+    reader.close()
+    return reader.bytesRead
+
+
+def streaming(tarballPath, destPath):
+    reader = countingReader(bz2.BZ2File(tarballPath))
+    installcommon.unpackTarball(tarballPath, destPath, fileobj=reader)
+    reader.close()
+    return reader.bytesRead
+
+
+def parallel(tarballPath, destPath):
+    reader = countingReader(install_waterfox_bz2.openBz2(tarballPath))
+    installcommon.unpackTarball(tarballPath, destPath, fileobj=reader)
+    reader.close()
+    return reader.bytesRead
+
+
+def main():
+    workDir = tempfile.mkdtemp()
+    try:
+        tarballPath = pj(workDir, "waterfox-g3.tar.bz2")
+        if len(sys.argv) > 1:
+            tarballPath = sys.argv[1]
+        else:
+            makeTarball(tarballPath)
+        print("Archive: {} ({} bytes)".format(
+            tarballPath, os.path.getsize(tarballPath)))
+        for name, func in (("random access", randomAccess), ("streaming", streaming),
+                           ("parallel", parallel)):
+            destPath = pj(workDir, name.replace(" ", "_"))
+            os.makedirs(destPath)
+            start = time.perf_counter()
+            bytesRead = func(tarballPath, destPath)
+            elapsed = time.perf_counter() - start
+            print("{:<14} {:8.3f} s {:>14} bytes decompressed".format(
+                name, elapsed, bytesRead))
+            shutil.rmtree(destPath)
+    finally:
+        shutil.rmtree(workDir)
+
+
+if __name__ == "__main__":
+    main()
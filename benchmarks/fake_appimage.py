@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Write minimal AppImage-like file (ELF header + gzip SquashFS 4.0 image)"""
+import os
+import sys
+import struct
+import zlib
+
+BLOCK_SIZE = 131072
+METADATA_SIZE = 8192
+NO_FRAGMENT = 0xFFFFFFFF
+SUPERBLOCK_SIZE = 96
+
+
+def elfHeader(size=4096):
+    """ELF64 header whose section headers end where SquashFS image starts"""
+    header = bytearray(size)
+    header[0:6] = b"\x7fELF\x02\x01"
+    shentsize, shnum = 64, 4
+    struct.pack_into("<Q", header, 0x28, size - shentsize * shnum)
+    struct.pack_into("<HH", header, 0x3A, shentsize, shnum)
+    return bytes(header)
+
+
+def scanTree(path):
+    """Return list of (name, kind, payload, path), sorted like mksquashfs does"""
+    children = []
+    for name in sorted(os.listdir(path)):
+        fullPath = os.path.join(path, name)
+        if os.path.islink(fullPath):
+            children.append((name, "symlink", os.readlink(fullPath), fullPath))
+        elif os.path.isdir(fullPath):
+            children.append((name, "dir", scanTree(fullPath), fullPath))
+        else:
+            children.append((name, "file", None, fullPath))
+    return children
+
+
+def makeAppImage(rootPath, outPath):
+    data = bytearray()
+    fragmentData = bytearray()
+    fragments = []
+    files = {}
+
+    def flushFragment():
+        if fragmentData:
+            compressed = zlib.compress(bytes(fragmentData))
+            fragments.append((SUPERBLOCK_SIZE + len(data), len(compressed)))
+            data.extend(compressed)
+            del fragmentData[:]
+
+    def addFile(path):
+        with open(path, "rb") as f:
+            content = f.read()
+        start = SUPERBLOCK_SIZE + len(data)
+        sizes = []
+        fullBlocks = len(content) // BLOCK_SIZE
+        for i in range(fullBlocks):
+            compressed = zlib.compress(content[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE])
+            data.extend(compressed)
+            sizes.append(len(compressed))
+        tail = content[fullBlocks * BLOCK_SIZE:]
+        fragment, fragmentOffset = NO_FRAGMENT, 0
+        if tail:
+            if len(fragmentData) + len(tail) > BLOCK_SIZE:
+                flushFragment()
+            fragment, fragmentOffset = len(fragments), len(fragmentData)
+            fragmentData.extend(tail)
+        files[path] = (start, sizes, fragment, fragmentOffset, len(content))
+
+    def addFiles(children):
+        for _name, kind, payload, path in children:
+            if kind == "file":
+                addFile(path)
+            elif kind == "dir":
+                addFiles(payload)
+
+    tree = scanTree(rootPath)
+    addFiles(tree)
+    flushFragment()
+
+    # Directory table is stored uncompressed, so positions are known upfront
+    def listingSize(children):
+        return sum(20 + len(name.encode()) for name, *_rest in children)
+
+    dirPositions = {}
+    dirTableSize = [0]
+
+    def placeDirectories(children, path):
+        for _name, kind, payload, childPath in children:
+            if kind == "dir":
+                placeDirectories(payload, childPath)
+        dirPositions[path] = dirTableSize[0]
+        dirTableSize[0] += listingSize(children)
+
+    placeDirectories(tree, rootPath)
+
+    inodes = bytearray()
+    inodePositions = {}
+    inodeNumber = [1]
+
+    def inodeHeader(inodeType, path, mode=None):
+        if mode is None:
+            mode = os.lstat(path).st_mode & 0o777
+        header = struct.pack("<HHHHII", inodeType, mode, 0, 0,
+                             int(os.lstat(path).st_mtime), inodeNumber[0])
+        inodeNumber[0] += 1
+        return header
+
+    def writeInodes(children, path):
+        for _name, kind, payload, childPath in children:
+            if kind == "dir":
+                writeInodes(payload, childPath)
+        for _name, kind, payload, childPath in children:
+            if kind != "dir":
+                inodePositions[childPath] = len(inodes)
+            if kind == "file":
+                start, sizes, fragment, fragmentOffset, size = files[childPath]
+                inodes.extend(inodeHeader(2, childPath))
+                inodes.extend(struct.pack("<IIII", start, fragment, fragmentOffset, size))
+                inodes.extend(struct.pack("<{}I".format(len(sizes)), *sizes))
+            elif kind == "symlink":
+                target = payload.encode()
+                inodes.extend(inodeHeader(3, childPath, 0o777))
+                inodes.extend(struct.pack("<II", 1, len(target)) + target)
+        position = dirPositions[path]
+        block = position // METADATA_SIZE * (METADATA_SIZE + 2)
+        inodePositions[path] = len(inodes)
+        inodes.extend(inodeHeader(1, path))
+        inodes.extend(struct.pack("<IIHHI", block, 2, listingSize(children) + 3,
+                                  position % METADATA_SIZE, 0))
+
+    writeInodes(tree, rootPath)
+
+    inodeTable = bytearray()
+    inodeBlocks = []
+    for i in range(0, len(inodes), METADATA_SIZE):
+        inodeBlocks.append(len(inodeTable))
+        compressed = zlib.compress(bytes(inodes[i:i + METADATA_SIZE]))
+        inodeTable.extend(struct.pack("<H", len(compressed)) + compressed)
+
+    def inodeReference(path):
+        position = inodePositions[path]
+        return inodeBlocks[position // METADATA_SIZE], position % METADATA_SIZE
+
+    listings = bytearray(dirTableSize[0])
+
+    def writeListings(children, path):
+        for _name, kind, payload, childPath in children:
+            if kind == "dir":
+                writeListings(payload, childPath)
+        position = dirPositions[path]
+        for name, kind, _payload, childPath in children:
+            block, offset = inodeReference(childPath)
+            encodedName = name.encode()
+            inodeType = {"dir": 1, "file": 2, "symlink": 3}[kind]
+            record = struct.pack("<III", 0, block, 1) + struct.pack(
+                "<HhHH", offset, 0, inodeType, len(encodedName) - 1) + encodedName
+            listings[position:position + len(record)] = record
+            position += len(record)
+
+    writeListings(tree, rootPath)
+    directoryTable = bytearray()
+    for i in range(0, len(listings), METADATA_SIZE):
+        chunk = bytes(listings[i:i + METADATA_SIZE])
+        directoryTable.extend(struct.pack("<H", len(chunk) | 0x8000) + chunk)
+
+    inodeTableStart = SUPERBLOCK_SIZE + len(data)
+    directoryTableStart = inodeTableStart + len(inodeTable)
+    fragmentEntries = b"".join(struct.pack("<QII", start, size, 0)
+                               for start, size in fragments)
+    fragmentBlocks = bytearray()
+    fragmentLocations = []
+    fragmentMetadataStart = directoryTableStart + len(directoryTable)
+    for i in range(0, len(fragmentEntries), METADATA_SIZE):
+        fragmentLocations.append(fragmentMetadataStart + len(fragmentBlocks))
+        chunk = fragmentEntries[i:i + METADATA_SIZE]
+        fragmentBlocks.extend(struct.pack("<H", len(chunk) | 0x8000) + chunk)
+    fragmentTableStart = fragmentMetadataStart + len(fragmentBlocks)
+    fragmentTable = struct.pack("<{}Q".format(len(fragmentLocations)), *fragmentLocations)
+    bytesUsed = fragmentTableStart + len(fragmentTable)
+    rootBlock, rootOffset = inodeReference(rootPath)
+    superblock = struct.pack("<IIIIIHHHHHHQQQQQQQQ", 0x73717368, inodeNumber[0] - 1, 0,
+                             BLOCK_SIZE, len(fragments), 1, 17, 0, 1, 4, 0,
+                             rootBlock << 16 | rootOffset, bytesUsed,
+                             0xFFFFFFFFFFFFFFFF, 0xFFFFFFFFFFFFFFFF, inodeTableStart,
+                             directoryTableStart, fragmentTableStart, 0xFFFFFFFFFFFFFFFF)
+    with open(outPath, "wb") as out:
+        out.write(elfHeader())
+        out.write(superblock)
+        out.write(data)
+        out.write(inodeTable)
+        out.write(directoryTable)
+        out.write(fragmentBlocks)
+        out.write(fragmentTable)
+
+
+if __name__ == "__main__":
+    makeAppImage(sys.argv[1], sys.argv[2])
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 # pylint: disable=C0103
-"""Create checksum file"""
+# pylint: disable=consider-using-f-string
+"""Create or verify checksum files"""
 import os
 import sys
+import argparse
 import hashlib
+import concurrent.futures
 
 pj = os.path.join
 pn = os.path.normpath
@@ -12,17 +15,129 @@ script_path = os.path.dirname(os.path.realpath(__file__))
 main_path = pn(script_path+"/..")
 artifacts_path = pj(main_path, "artifacts")
 
-zipFile = sys.argv[1]
+ALGORITHMS = ("sha256", "sha512", "blake2b")
+CHUNK_SIZE = 1024 * 1024
 
-checksum_file_path = pj(
-    artifacts_path, os.path.basename(zipFile).replace(".zip", ".sha256"))
 
-if os.path.exists(checksum_file_path):
-    os.remove(checksum_file_path)
+def hash_file(path, algorithms):
+    """Compute all digests of file in single pass with constant memory"""
+    hashers = [hashlib.new(algorithm) for algorithm in algorithms]
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as file_to_check:
+        size = file_to_check.readinto(buffer)
+        while size:
+            for hasher in hashers:
+                hasher.update(view[:size])
+            size = file_to_check.readinto(buffer)
+    return {algorithm: hasher.hexdigest() for algorithm, hasher in zip(algorithms, hashers)}
 
-if os.path.exists(zipFile):
-    with open(zipFile, 'rb') as file_to_check:
-        data = file_to_check.read()
-    checksum = hashlib.sha256(data).hexdigest()
-    with open(checksum_file_path, "a", encoding='utf-8') as checksum_file:
-        checksum_file.write(checksum+" "+os.path.basename(zipFile)+"\n")
+
+def checksum_file_name(path, algorithm):
+    name = os.path.basename(path)
+    if name.endswith(".zip"):
+        name = name[:-len(".zip")]
+    return name + "." + algorithm
+
+
+def write_checksums(path, digests, output_path):
+    for algorithm, checksum in digests.items():
+        checksum_file_path = pj(output_path, checksum_file_name(path, algorithm))
+        with open(checksum_file_path, "w", encoding='utf-8') as checksum_file:
+            checksum_file.write(checksum+" "+os.path.basename(path)+"\n")
+
+
+def read_checksums(checksum_file_path):
+    """Return list of (algorithm, digest, path) from checksum file and list
+    of numbers of improperly formatted lines"""
+    algorithm = os.path.splitext(checksum_file_path)[1][1:]
+    if algorithm not in ALGORITHMS:
+        algorithm = None
+    entries = []
+    malformed = []
+    with open(checksum_file_path, "r", encoding='utf-8') as checksum_file:
+        for line_number, line in enumerate(checksum_file, 1):
+            if not line.strip():
+                continue
+            fields = line.rstrip("\n").split(None, 1)
+            if len(fields) != 2:
+                malformed.append(line_number)
+                continue
+            checksum, name = fields
+            # Binary mode marker of sha256sum and similar tools
+            name = name.lstrip("*")
+            line_algorithm = algorithm
+            if line_algorithm is None:
+                line_algorithm = {64: "sha256", 128: "sha512"}.get(len(checksum), "sha256")
+            entries.append((line_algorithm, checksum.lower(),
+                            pj(os.path.dirname(checksum_file_path), name)))
+    return entries, malformed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or verify checksum files")
+    parser.add_argument("files", nargs="+",
+                        help="files to hash, or checksum files with --check")
+    parser.add_argument("-a", "--algorithms", default="sha256",
+                        help="comma separated list of: " + ", ".join(ALGORITHMS))
+    parser.add_argument("-o", "--output", default=artifacts_path,
+                        help="directory for checksum files")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of files hashed concurrently")
+    parser.add_argument("-c", "--check", action="store_true",
+                        help="verify files listed in checksum files")
+    args = parser.parse_args()
+
+    algorithms = args.algorithms.split(",")
+    for algorithm in algorithms:
+        if algorithm not in ALGORITHMS:
+            parser.error("unsupported algorithm: " + algorithm)
+
+    # hashlib releases GIL while hashing, so threads are enough
+    with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+        if args.check:
+            entries = []
+            failed = 0
+            for checksum_file_path in args.files:
+                try:
+                    file_entries, malformed = read_checksums(checksum_file_path)
+                except (OSError, UnicodeDecodeError) as error:
+                    print("{}: FAILED open or read ({})".format(checksum_file_path, error))
+                    failed += 1
+                    continue
+                entries += file_entries
+                for line_number in malformed:
+                    print("{}:{}: FAILED improperly formatted line".format(
+                        checksum_file_path, line_number))
+                failed += len(malformed)
+            # File listed in more checksum files is read only once
+            file_algorithms = {}
+            for algorithm, _checksum, path in entries:
+                file_algorithms.setdefault(pn(path), set()).add(algorithm)
+            futures = {path: executor.submit(hash_file, path, sorted(file_algorithms[path]))
+                       for path in file_algorithms}
+            for algorithm, checksum, path in entries:
+                try:
+                    digests = futures[pn(path)].result()
+                    result = "OK" if digests[algorithm] == checksum else "FAILED"
+                except OSError:
+                    result = "FAILED open or read"
+                if result != "OK":
+                    failed += 1
+                print("{}: {}".format(path, result))
+            if failed:
+                print("WARNING: {} computed checksum(s) did NOT match".format(failed),
+                      file=sys.stderr)
+                sys.exit(1)
+            return
+
+        if not os.path.exists(args.output):
+            os.makedirs(args.output)
+        files = [path for path in args.files if os.path.exists(path)]
+        futures = [executor.submit(hash_file, path, algorithms) for path in files]
+        for path, future in zip(files, futures):
+            write_checksums(path, future.result(), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,7 @@ fi
 
 mkdir -p "$TEMP_PATH"
 cd "$MAIN_PATH/src" || exit
-cp ./{install_waterfox_"$1".py,install_waterfox_common.py,install_waterfox_desktop_entry} "$TEMP_PATH"
+cp ./{install_waterfox_"$1".py,install_waterfox_common.py,install_waterfox_bz2.py,install_waterfox_xz.py,install_waterfox_zstd.py,install_waterfox_squashfs.py,install_waterfox_profile.py,install_waterfox_fleet.py,install_waterfox_iconcache.py,install_waterfox_prewarm.py,install_waterfox_desktop_entry} "$TEMP_PATH"
 if [ "$1" == "GUI" ]; then
     cp ./GUI.glade "$TEMP_PATH"
 fi
@@ -45,7 +45,7 @@ fi
 if [ "$1" == "GUI" ]; then
     VERSION=$(grep -hr "appVersion" ./src/install_waterfox_GUI.py | head -1 | cut -d "=" -f2 | awk '{print $1}' | tr -d '"')
 else
-    VERSION=$(./src/install_waterfox_CLI.py -v | sed 's/CLI installer of Waterfox for Linux //')
+    VERSION=$(grep -hr "appVersion" ./src/install_waterfox_CLI.py | head -1 | cut -d "=" -f2 | awk '{print $1}' | tr -d '"')
 fi
 
 zipFile="./artifacts/install_waterfox_$1-$VERSION.zip"
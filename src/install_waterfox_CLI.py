@@ -30,10 +30,8 @@ SOFTWARE.
 """
 import os
 import sys
-import argparse
 import gettext
 import re
-import install_waterfox_common as installcommon
 
 appName = "CLI installer of Waterfox for Linux"
 appVersion = "1.5.2"
@@ -76,167 +74,311 @@ def menu(message, options, exitName):
         return option
 
 
-# Parse arguments
-parser = argparse.ArgumentParser(
-    description=_('Installation and uninstallation script for Waterfox'))
-parser.add_argument("-v", "--version",
-                    help=_("display script version"),
-                    action='version', version=appName + ' ' + appVersion)
-parser.add_argument("-sp", "--spath",
-                    help=_("set path to directory of installable package(s)"),
-                    default=os.path.dirname(os.path.realpath(__file__)))
-parser.add_argument("-ip", "--ipath",
-                    help=_("set installation path (folder with package name will be here)"))
-parser.add_argument("-s", "--silent",
-                    help=_("enable unattended installation mode" +
-                           " (valid configuration file and full source path is required)"),
-                    action='store_true')
-args = parser.parse_args()
-
-sourcePath = args.spath
-
-conf = installcommon.settings()
-
-if args.ipath is not None:
-    installPath = args.ipath
-else:
-    installPath = conf.installPath
-
-silent = bool(False)
-if args.silent:
-    silent = bool(True)
-
-
-confPath = pj(os.getenv('XDG_CONFIG_HOME',
-                        os.path.expanduser("~/.config")), "install_waterfox")
-confFile = pj(confPath, "settings.conf")
-
-
-# Create menu with actions
-if not silent:
-    actions = [_("Install"), _("Uninstall")]
-    chosenAction = menu(
-        _("What do you want to do with Waterfox?"), actions, _("Quit"))
-else:
-    chosenAction = _("Install")
-
-if chosenAction == _("Install"):
-    if os.geteuid() == 0:
-        repoLink = "https://github.com/hawkeye116477/waterfox-deb-rpm-arch-AppImage"
-        print(_("This program was created for installing Waterfox only for one user, "
-              "because updater of this package doesn't work correctly for root user. "
-                "If you wanted to install it for all users, "
-                "then go to {URL} for more information, "
-                "otherwise run this program again as normal user.").format(
-            URL=repoLink))
-        sys.exit(0)
-
-    # Detect installable packages
-    packages = []
-    if not os.path.exists(sourcePath):
-        print(_("The specified path does not exist!"))
-        sys.exit(0)
-    if os.path.isfile(sourcePath):
-        packages.append(sourcePath)
+def parseArgs():
+    import argparse  # pylint: disable=import-outside-toplevel
+    parser = argparse.ArgumentParser(
+        description=_('Installation and uninstallation script for Waterfox'))
+    parser.add_argument("-v", "--version",
+                        help=_("display script version"),
+                        action='version', version=appName + ' ' + appVersion)
+    parser.add_argument("-sp", "--spath",
+                        help=_("set path to directory of installable package(s)"),
+                        default=os.path.dirname(os.path.realpath(__file__)))
+    parser.add_argument("-ip", "--ipath",
+                        help=_("set installation path (folder with package name will be here)"))
+    parser.add_argument("-s", "--silent",
+                        help=_("enable unattended installation mode" +
+                               " (valid configuration file and full source path is required)"),
+                        action='store_true')
+    parser.add_argument("--progress",
+                        help=_("set progress output format (json prints one event per line)"),
+                        choices=["text", "json"], default="text")
+    parser.add_argument("--profile", metavar="FILE", nargs="?",
+                        const="install_waterfox_profile.txt",
+                        help=_("write report with timings of installation steps into file"))
+    parser.add_argument("--profile-capture",
+                        help=_("also capture CPU profile or memory allocations into report"),
+                        choices=["cprofile", "tracemalloc"], action="append", default=[])
+    parser.add_argument("--from-cache",
+                        help=_("offer packages from cache of unpacked packages"
+                               " (also those which were already removed)"),
+                        action='store_true')
+    parser.add_argument("--cache-stats",
+                        help=_("display size and hit rate of cache of unpacked packages"),
+                        action='store_true')
+    parser.add_argument("--exclude", metavar="FILTERS",
+                        help=_("skip files matching comma separated patterns or components"
+                               " (dictionaries, langpacks, crashreporter, updater)"
+                               " during installation"))
+    parser.add_argument("--include", metavar="FILTERS",
+                        help=_("install files matching comma separated patterns or components"
+                               " even if they are excluded"))
+    parser.add_argument("--prewarm",
+                        help=_("read files needed by first launch into memory after installation"),
+                        action='store_true')
+    parser.add_argument("--record-prewarm", metavar="EDITION",
+                        help=_("launch installed edition once to record files"
+                               " which are read into memory by --prewarm"))
+    parser.add_argument("--fleet", metavar="FILE",
+                        help=_("install package for every user or home directory listed in file"
+                               " (one per line), installation path may start with ~"))
+    parser.add_argument("--fleet-mode",
+                        help=_("set how files are put into home directories in fleet mode"),
+                        choices=["reflink", "hardlink", "copy"], default="reflink")
+    parser.add_argument("--fleet-jobs", type=int,
+                        help=_("set number of users provisioned at once in fleet mode"))
+    parser.add_argument("--fleet-staging", metavar="DIR",
+                        help=_("set directory for shared unpacked package in fleet mode"
+                               " (it should be on the same filesystem as homes for hardlink mode)"))
+    return parser.parse_args()
+
+
+def main():
+    args = parseArgs()
+    # pylint: disable=import-outside-toplevel
+    import json
+    import install_waterfox_common as installcommon
+
+    sourcePath = args.spath
+
+    conf = installcommon.settings()
+
+    if args.ipath is not None:
+        installPath = args.ipath
     else:
-        print(_("Detecting installable packages..."))
-        for root, dirs, files in os.walk(sourcePath):
-            for file in files:
-                if re.match(r"waterfox-*.*(tar\.bz2|AppImage)$", file):
-                    packages.append(pj(root, file))
-
-    packageTypes = []
-    if packages:
-        for package in packages:
-            package = os.path.basename(package)
-            if re.match(r"^waterfox-", package):
-                packageTypes.append(str(os.path.splitext(package)[0]).replace("waterfox-", "").capitalize().split(".", 1)[0].split("-", 1)[0])
-
-    if packageTypes:
-        packageTypes = list(sorted(set(packageTypes)))
-
-    if len(packageTypes) < 1:
-        print(_("No installable packages found."))
-        print(_("Please launch this script again with flag -sp=<path>."))
-        sys.exit(0)
-
-    # Create menu with package types
-    if len(packageTypes) > 2:
-        chosenPackageType = menu(_("Which package are you interested in?"),
-                                 packageTypes, _("None"))
+        installPath = conf.installPath
+    if args.exclude is not None:
+        conf.extractExclude = args.exclude
+    if args.include is not None:
+        conf.extractInclude = args.include
+    if args.prewarm:
+        conf.prewarmFiles = "yes"
+
+    silent = bool(False)
+    if args.silent:
+        silent = bool(True)
+
+    if args.progress == "json":
+        def printDef(text):
+            print(json.dumps({"type": "message", "text": text}), flush=True)
+
+        def progressDef(event):
+            print(json.dumps(event._asdict()), flush=True)
     else:
-        chosenPackageType = packageTypes[0]
+        printDef = print
+        progressDef = None
+
+    profiler = None
+    if args.profile is not None:
+        import install_waterfox_profile
+        profiler = install_waterfox_profile.profiler(
+            captureCProfile="cprofile" in args.profile_capture,
+            captureMemory="tracemalloc" in args.profile_capture)
+        profiler.info["Installer"] = appName + " " + appVersion
+
+    def runProfiled(func, *funcArgs, **funcKwargs):
+        """Run install/uninstall and write profile report even if it fails"""
+        if profiler is None:
+            func(*funcArgs, **funcKwargs)
+            return
+        profiler.start()
+        try:
+            func(*funcArgs, profiler=profiler, **funcKwargs)
+        finally:
+            profiler.stop()
+            profiler.writeReport(args.profile)
+            printDef(_("Profile report has been written to {path}").format(
+                path=os.path.abspath(args.profile)))
+
+    confPath = pj(os.getenv('XDG_CONFIG_HOME',
+                            os.path.expanduser("~/.config")), "install_waterfox")
+    confFile = pj(confPath, "settings.conf")
+
+    if args.cache_stats:
+        cacheStats = installcommon.treeCache(conf.treeCacheSize).stats()
+        print(_("Cache: {path}").format(path=installcommon.treeCachePath()))
+        print(_("Size: {size:.1f} MiB of {maxSize:.1f} MiB").format(
+            size=cacheStats["size"] / 1048576, maxSize=cacheStats["maxSize"] / 1048576))
+        print(_("Hits: {hits}, misses: {misses}, hit rate: {hitRate:.0%}").format(**cacheStats))
+        for entry in cacheStats["entries"]:
+            print("  {} ({:.1f} MiB, {} hits)".format(
+                entry["name"], entry["size"] / 1048576, entry["hits"]))
+        sys.exit(0)
 
-    chosenPackages = []
-    if packages and chosenPackageType != "None":
-        for package in packages:
-            if re.match(r"^waterfox\-" + chosenPackageType, os.path.basename(package), re.IGNORECASE):
-                chosenPackages.append(package)
+    if args.record_prewarm is not None:
+        import install_waterfox_prewarm
+        recordPath = pj(installPath, "waterfox-" + args.record_prewarm.lower())
+        if not os.path.isdir(recordPath):
+            print(_("Waterfox {chosenPackageType} isn't installed in {installPath}!").format(
+                chosenPackageType=args.record_prewarm.capitalize(), installPath=installPath))
+            sys.exit(1)
+        install_waterfox_prewarm.recordHotList(recordPath, args.record_prewarm.capitalize(),
+                                               printDef)
+        sys.exit(0)
 
-    if len(chosenPackages) > 1:
-        chosenPackage = menu(
-            _("Which package do you want to install?"), chosenPackages, _("None"))
+    if args.fleet is not None:
+        import install_waterfox_fleet
+        if os.path.isfile(sourcePath):
+            fleetPackages = [(sourcePath,) + installcommon.parsePackageName(
+                os.path.basename(sourcePath))]
+        else:
+            fleetPackages = installcommon.findPackages(sourcePath)
+        if len(fleetPackages) != 1:
+            print(_("Fleet mode needs exactly one package, set it with flag -sp=<path>."))
+            sys.exit(1)
+        fleetPackage, fleetPackageType, _version = fleetPackages[0]
+        targets, skipped = install_waterfox_fleet.readTargets(args.fleet)
+        results = install_waterfox_fleet.provision(
+            fleetPackage, fleetPackageType, targets, printDef, mode=args.fleet_mode,
+            installPathTemplate=args.ipath if args.ipath is not None else "~/.local/lib",
+            installDesktopShortcut=getattr(conf, "installDesktopShortcut", None) or "yes",
+            useSystemDictionaries=getattr(conf, "useSystemDictionaries", None) or "no",
+            workers=args.fleet_jobs, stagingDir=args.fleet_staging)
+        printDef(install_waterfox_fleet.summary(results, skipped))
+        sys.exit(0 if all(result.ok for result in results) and not skipped else 1)
+
+    # Create menu with actions
+    if not silent:
+        actions = [_("Install"), _("Uninstall")]
+        chosenAction = menu(
+            _("What do you want to do with Waterfox?"), actions, _("Quit"))
     else:
-        chosenPackage = chosenPackages[0]
-
-    if silent:
-        if conf.installDesktopShortcut is not None:
-            installDesktopShortcut = conf.installDesktopShortcut
-        if conf.useSystemDictionaries is not None:
-            useSystemDictionaries = conf.useSystemDictionaries
-        if conf.removeArchive is not None:
-            removeArchive = conf.removeArchive
-
-    if not 'installDesktopShortcut' in vars():
-        installDesktopShortcut = menu(_("Do you want to add a desktop shortcut?"),
-                                      [_("Yes"), _("No")], "")
-    if not 'useSystemDictionaries' in vars():
-        useSystemDictionaries = menu(_("Do you want to use system's dictionaries?"),
-                                     [_("Yes"), _("No")], "")
-    if not 'removeArchive' in vars():
-        removeArchive = menu(_("Do you want to remove tarball/AppImage package "
-                               "after completing the installation?"),
-                             [_("Yes"), _("No")], "")
-
-    installcommon.install(chosenPackage, installPath, chosenPackageType,
-                          installDesktopShortcut, useSystemDictionaries,
-                          removeArchive, confFile, print)
-elif chosenAction == _("Uninstall"):
-    # Detect installed packages
-    packages = []
-    if not os.path.exists(installPath):
-        print(_("The specified path does not exist!"))
-        sys.exit(0)
-    print(_("Detecting installed packages..."))
-    packageTypes = []
-    for entry in os.scandir(installPath):
-        if entry.is_dir() and re.match(r"^waterfox-", entry.name):
-            packageTypes.append(entry.name.replace("waterfox-", "").title())
-    if packageTypes:
-        packageTypes = list(sorted(set(packageTypes)))
-
-    if len(packageTypes) < 1:
-        print(_("No installed packages found."))
-        print(_("Please launch this script again with flag -ip=<path>."))
+        chosenAction = _("Install")
+
+    if chosenAction == _("Install"):
+        if os.geteuid() == 0:
+            repoLink = "https://github.com/hawkeye116477/waterfox-deb-rpm-arch-AppImage"
+            print(_("This program was created for installing Waterfox only for one user, "
+                  "because updater of this package doesn't work correctly for root user. "
+                    "If you wanted to install it for all users, "
+                    "then go to {URL} for more information, "
+                    "otherwise run this program again as normal user.").format(
+                URL=repoLink))
+            sys.exit(0)
+
+        # Detect installable packages
+        packages = []
+        if args.from_cache:
+            packages = sorted(set(
+                (entry["path"],) + installcommon.parsePackageName(entry["name"])
+                for entry in installcommon.treeCache(conf.treeCacheSize).entries()))
+        elif not os.path.exists(sourcePath):
+            print(_("The specified path does not exist!"))
+            sys.exit(0)
+        elif os.path.isfile(sourcePath):
+            packages.append((sourcePath,) + installcommon.parsePackageName(
+                os.path.basename(sourcePath)))
+        else:
+            print(_("Detecting installable packages..."))
+            packages = installcommon.findPackages(sourcePath)
+
+        packageTypes = []
+        for package, packageType, _version in packages:
+            if re.match(r"^waterfox-", os.path.basename(package)):
+                packageTypes.append(packageType)
+
+        if packageTypes:
+            packageTypes = list(sorted(set(packageTypes)))
+
+        if len(packageTypes) < 1:
+            print(_("No installable packages found."))
+            print(_("Please launch this script again with flag -sp=<path>."))
+            sys.exit(0)
+
+        # Create menu with package types
+        if len(packageTypes) > 2:
+            chosenPackageType = menu(_("Which package are you interested in?"),
+                                     packageTypes, _("None"))
+        else:
+            chosenPackageType = packageTypes[0]
+
+        chosenPackages = []
+        if packages and chosenPackageType != "None":
+            for package, packageType, _version in packages:
+                if packageType == chosenPackageType:
+                    chosenPackages.append(package)
+
+        if len(chosenPackages) > 1:
+            chosenPackage = menu(
+                _("Which package do you want to install?"), chosenPackages, _("None"))
+        else:
+            chosenPackage = chosenPackages[0]
+
+        if silent:
+            if conf.installDesktopShortcut is not None:
+                installDesktopShortcut = conf.installDesktopShortcut
+            if conf.useSystemDictionaries is not None:
+                useSystemDictionaries = conf.useSystemDictionaries
+            if conf.removeArchive is not None:
+                removeArchive = conf.removeArchive
+
+        if not 'installDesktopShortcut' in vars():
+            installDesktopShortcut = menu(_("Do you want to add a desktop shortcut?"),
+                                          [_("Yes"), _("No")], "")
+        if not 'useSystemDictionaries' in vars():
+            useSystemDictionaries = menu(_("Do you want to use system's dictionaries?"),
+                                         [_("Yes"), _("No")], "")
+        if not 'removeArchive' in vars():
+            removeArchive = menu(_("Do you want to remove tarball/AppImage package "
+                                   "after completing the installation?"),
+                                 [_("Yes"), _("No")], "")
+
+        if profiler is not None and os.path.exists(chosenPackage):
+            profiler.info["Package"] = "{} ({} bytes)".format(
+                os.path.basename(chosenPackage), os.path.getsize(chosenPackage))
+        runProfiled(installcommon.install, chosenPackage, installPath, chosenPackageType,
+                    installDesktopShortcut, useSystemDictionaries,
+                    removeArchive, confFile, printDef,
+                    deduplicateEditions=conf.deduplicateEditions,
+                    progressDef=progressDef, treeCacheSize=conf.treeCacheSize,
+                    recompressPackages=conf.recompressPackages,
+                    extractInclude=conf.extractInclude, extractExclude=conf.extractExclude,
+                    prewarmFiles=conf.prewarmFiles)
+    elif chosenAction == _("Uninstall"):
+        # Detect installed packages
+        packages = []
+        if not os.path.exists(installPath):
+            print(_("The specified path does not exist!"))
+            sys.exit(0)
+        print(_("Detecting installed packages..."))
+        packageTypes = []
+        for entry in os.scandir(installPath):
+            if entry.is_dir() and re.match(r"^waterfox-", entry.name):
+                packageTypes.append(entry.name.replace("waterfox-", "").title())
+        if packageTypes:
+            packageTypes = list(sorted(set(packageTypes)))
+
+        if len(packageTypes) < 1:
+            print(_("No installed packages found."))
+            print(_("Please launch this script again with flag -ip=<path>."))
+            sys.exit(0)
+
+        chosenPackageType = ""
+        if len(packageTypes) > 1:
+            chosenPackageType = menu(
+                _("Which package do you want to uninstall?"), packageTypes, _("None"))
+        else:
+            chosenPackageType = packageTypes[0]
+            print(_("Detected Waterfox {chosenPackageType}.").format(**locals()))
+
+        confirmed = menu(_("Are you sure that you want to uninstall Waterfox {chosenPackageType}?")
+                           .format(**locals()),
+                         [_("Yes"), _("No")], "")
+        if confirmed == "no":
+            sys.exit(0)
+
+        removeConfFile = menu(_("Do you want to remove file with installer settings?"),
+                              [_("Yes"), _("No")], "")
+        runProfiled(installcommon.uninstall,
+                    installPath, chosenPackageType, confFile, removeConfFile, printDef,
+                    progressDef=progressDef)
+    elif chosenAction == _("Quit"):
         sys.exit(0)
 
-    chosenPackageType = ""
-    if len(packageTypes) > 1:
-        chosenPackageType = menu(
-            _("Which package do you want to uninstall?"), packageTypes, _("None"))
-    else:
-        chosenPackageType = packageTypes[0]
-        print(_("Detected Waterfox {chosenPackageType}.").format(**locals()))
 
-    confirmed = menu(_("Are you sure that you want to uninstall Waterfox {chosenPackageType}?")
-                       .format(**locals()),
-                     [_("Yes"), _("No")], "")
-    if confirmed == "no":
+if __name__ == "__main__":
+    # Answer build scripts without parsing arguments and loading modules
+    if sys.argv[1:] in (["-v"], ["--version"]):
+        print(appName + " " + appVersion)
         sys.exit(0)
-
-    removeConfFile = menu(_("Do you want to remove file with installer settings?"),
-                          [_("Yes"), _("No")], "")
-    installcommon.uninstall(
-        installPath, chosenPackageType, confFile, removeConfFile, print)
-elif chosenAction == _("Quit"):
-    sys.exit(0)
+    main()
@@ -11,12 +11,12 @@ import os
 import sys
 import re
 import threading
+import queue
 import gettext
 import locale
 import gi
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gtk, GLib
-import install_waterfox_common as installcommon
 
 
 appName = "GUI installer of Waterfox for Linux"
@@ -51,13 +51,13 @@ class Handler:
             installBtn.show()
             nextBtn.hide()
             progress.hide()
-        mode = modeChooser.get_active_text()
-        if mode == _("Installation"):
-            installBtn.set_label(_("Install"))
-            finalLabel.set_text(_("Click Install to begin the installation or click Close if you want to review or change any settings."))
-        else:
-            installBtn.set_label(_("Uninstall"))
-            finalLabel.set_text(_("Click Uninstall to begin the uninstallation or click Close if you want to review or change any settings."))
+            mode = modeChooser.get_active_text()
+            if mode == _("Installation"):
+                installBtn.set_label(_("Install"))
+                finalLabel.set_text(_("Click Install to begin the installation or click Close if you want to review or change any settings."))
+            else:
+                installBtn.set_label(_("Uninstall"))
+                finalLabel.set_text(_("Click Uninstall to begin the uninstallation or click Close if you want to review or change any settings."))
 
     def on_installBtn_clicked(self, _button):
         cancelBtn.set_sensitive(False)
@@ -91,7 +91,7 @@ class Handler:
         setPackageNames()
 
     def on_installPathField_changed(self, _entry):
-        setPackageNames()
+        setPackageNames(scanner.delay)
 
     def on_fileChooseBtn_clicked(self, _button):
         dialog = Gtk.FileChooserDialog(
@@ -133,6 +133,7 @@ class Handler:
         setPackageNames()
 
     def on_nextBtn_clicked(self, _button):
+        buildPage(window.get_current_page() + 1)
         window.next_page()
 
     def on_backBtn_clicked(self, _button):
@@ -155,33 +156,168 @@ def bool2Str(boolean):
     return boolean
 
 
+class logView:
+    """Append-only log which can be written from any thread.
+
+    Messages are queued and appended to TextBuffer in batches on main loop,
+    oldest lines are dropped when there are more than maxLines.
+    """
+
+    def __init__(self, textView, maxLines=5000, interval=100):
+        self.textView = textView
+        self.buffer = textView.get_buffer()
+        self.endMark = self.buffer.create_mark(None, self.buffer.get_end_iter(), False)
+        self.maxLines = maxLines
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.scheduled = False
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        self.queue.put(text)
+        with self.lock:
+            if self.scheduled:
+                return
+            self.scheduled = True
+        GLib.timeout_add(self.interval, self.flush)
+
+    def flush(self):
+        with self.lock:
+            self.scheduled = False
+        lines = []
+        try:
+            while True:
+                lines.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        if not lines:
+            return False
+        text = "\n".join(lines)
+        if self.buffer.get_char_count():
+            text = "\n" + text
+        self.buffer.insert(self.buffer.get_end_iter(), text)
+        excess = self.buffer.get_line_count() - self.maxLines
+        if excess > 0:
+            self.buffer.delete(self.buffer.get_start_iter(),
+                               self.buffer.get_iter_at_line(excess))
+        self.textView.scroll_mark_onscreen(self.endMark)
+        # Pulsing would fight with fraction of determinate phase
+        if progressFraction is None:
+            progress.pulse()
+        return False
+
+
 def displayMsg(text):
-    GLib.idle_add(progress.pulse)
-    if log.get_text() != "":
-        GLib.idle_add(log.set_text, log.get_text() + "\n" + text)
+    logger.write(text)
+
+
+# Fraction of current phase, None while it isn't known
+progressFraction = None
+
+
+def showProgress(fraction, eta):
+    global progressFraction  # pylint: disable=global-statement
+    progressFraction = fraction
+    if fraction is None:
+        progress.set_text(None)
+        progress.pulse()
+        return
+    progress.set_fraction(fraction)
+    if eta is None:
+        progress.set_text("{:.0%}".format(fraction))
     else:
-        GLib.idle_add(log.set_text, text)
+        progress.set_text(_("{percent:.0%}, about {eta:.0f} s left").format(
+            percent=fraction, eta=eta))
+
 
+def progressMsg(event):
+    # Phase without known size is shown by pulses on log messages
+    if event.fraction is not None or event.type == "phaseStart":
+        GLib.idle_add(showProgress, event.fraction, event.eta)
 
-def setPackageNames():
+
+class packageScanner:
+    """Look for installed packages in worker thread, so slow disks don't freeze UI.
+
+    Requests are debounced, newer request cancels older scans and results
+    are cached per path until mtime of directory changes.
+    """
+
+    def __init__(self, callback, delay=300):
+        self.callback = callback
+        self.delay = delay
+        self.timeoutId = None
+        self.generation = 0
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def request(self, path, delay=None):
+        self.cancel()
+        self.timeoutId = GLib.timeout_add(self.delay if delay is None else delay,
+                                          self.start, path, self.generation)
+
+    def cancel(self):
+        self.generation += 1
+        if self.timeoutId is not None:
+            GLib.source_remove(self.timeoutId)
+            self.timeoutId = None
+
+    def start(self, path, generation):
+        self.timeoutId = None
+        thread = threading.Thread(target=self.scan, args=(path, generation))
+        thread.daemon = True
+        thread.start()
+        return False
+
+    def scan(self, path, generation):
+        packageTypes = []
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with self.lock:
+                cached = self.cache.get(path)
+            if cached is not None and cached[0] == mtime:
+                packageTypes = cached[1]
+            else:
+                for entry in os.scandir(path):
+                    if generation != self.generation:
+                        return
+                    if entry.is_dir() and re.match(r"^waterfox-", entry.name):
+                        packageTypes.append(
+                            entry.name.replace("waterfox-", "").title())
+                packageTypes = sorted(set(packageTypes))
+                with self.lock:
+                    self.cache[path] = (mtime, packageTypes)
+        except OSError:
+            pass
+        if generation == self.generation:
+            GLib.idle_add(self.deliver, packageTypes, generation)
+
+    def deliver(self, packageTypes, generation):
+        # Path could change while result was waiting in main loop
+        if generation == self.generation:
+            self.callback(packageTypes)
+        return False
+
+
+def showPackageNames(packageTypes):
+    packageChooser.remove_all()
+    for i, packageType in enumerate(packageTypes):
+        packageChooser.insert_text(i, packageType)
+    if packageTypes:
+        packageChooser.set_active(0)
+
+
+def setPackageNames(delay=0):
     mode = modeChooser.get_active_text()
+    packageChooser.remove_all()
     if mode == _("Uninstallation"):
-        packageChooser.remove_all()
-        if os.path.exists(installPathField.get_text()):
-            packageTypes = []
-            for entry in os.scandir(installPathField.get_text()):
-                if entry.is_dir() and re.match(r"^waterfox-", entry.name):
-                    packageTypes.append(
-                        entry.name.replace("waterfox-", "").title())
-            if packageTypes:
-                i = 0
-                for packageType in list(sorted(set(packageTypes))):
-                    packageChooser.insert_text(i, packageType)
-                    i += 1
-                packageChooser.set_active(0)
+        scanner.request(installPathField.get_text(), delay)
+    else:
+        scanner.cancel()
 
 
 def finalize():
+    import install_waterfox_common as installcommon  # pylint: disable=import-outside-toplevel
     mode = modeChooser.get_active_text()
     installPath = installPathField.get_text()
     confPath = pj(os.getenv('XDG_CONFIG_HOME',
@@ -193,57 +329,106 @@ def finalize():
         chosenPackage = fileChooseField.get_text()
         packageFile = os.path.basename(chosenPackage)
         if re.match(r"^waterfox-", packageFile):
-            chosenPackageType = str(os.path.splitext(packageFile)[0]).replace("waterfox-", "").capitalize().split(".", 1)[0].split("-", 1)[0]
+            chosenPackageType = installcommon.parsePackageName(packageFile)[0]
         installcommon.install(chosenPackage, installPath, chosenPackageType,
                               bool2Str(createDesktopShortcut.get_active()),
                               bool2Str(systemDictionaries.get_active()),
-                              bool2Str(removePackage.get_active()), confFile, displayMsg)
+                              bool2Str(removePackage.get_active()), confFile, displayMsg,
+                              deduplicateEditions=conf.deduplicateEditions,
+                              progressDef=progressMsg, treeCacheSize=conf.treeCacheSize,
+                              recompressPackages=conf.recompressPackages,
+                              extractInclude=conf.extractInclude,
+                              extractExclude=conf.extractExclude,
+                              prewarmFiles=conf.prewarmFiles)
     else:
         installcommon.uninstall(installPath, packageChooser.get_active_text(), confFile,
-                                bool2Str(removeConf.get_active()), displayMsg)
+                                bool2Str(removeConf.get_active()), displayMsg,
+                                progressDef=progressMsg)
     cancelBtn.set_sensitive(True)
     progress.hide()
 
-scriptPath = os.path.dirname(os.path.realpath(__file__))
-builder = Gtk.Builder()
-builder.add_from_file(pj(scriptPath, "GUI.glade"))
-builder.connect_signals(Handler())
-
-window = builder.get_object("assistant")
-backBtn = builder.get_object("backBtn")
-nextBtn = builder.get_object("nextBtn")
-cancelBtn = builder.get_object("cancelBtn")
-installBtn = builder.get_object("installBtn")
-firstPage = builder.get_object("page1")
-modeChooser = builder.get_object("modeChooser")
-fileChooseLabel = builder.get_object("fileChooseLabel")
-fileChooseField = builder.get_object("fileChooseField")
-fileChooseFB = builder.get_object("fileChooseFB")
-installTasks = builder.get_object("installTasks")
-uninstallTasks = builder.get_object("uninstallTasks")
-installPathField = builder.get_object("installPathField")
-createDesktopShortcut = builder.get_object("createDesktopShortcut")
-systemDictionaries = builder.get_object("systemDictionaries")
-removePackage = builder.get_object("removePackage")
-removeConf = builder.get_object("removeConf")
-packageLabel = builder.get_object("packageLabel")
-packageChooser = builder.get_object("packageChooser")
-finalLabel = builder.get_object("finalLabel")
-log = builder.get_object("log")
-progress = builder.get_object("progress")
-
-conf = installcommon.settings()
-installPathField.set_text(conf.installPath)
-if hasattr(conf, "installDesktopShortcut"):
-    createDesktopShortcut.set_active(str2Bool(conf.installDesktopShortcut))
-if hasattr(conf, "useSystemDictionaries"):
-    systemDictionaries.set_active(str2Bool(conf.useSystemDictionaries))
-if hasattr(conf, "removeArchive"):
-    removePackage.set_active(str2Bool(conf.removeArchive))
-
-window.show_all()
-widgetsToHide = [uninstallTasks, packageLabel, packageChooser]
-for widget in widgetsToHide:
-    widget.hide()
-
-Gtk.main()
+
+def buildOptionsPage():
+    """Build page with mode and options, settings are read only now"""
+    # pylint: disable=global-statement,import-outside-toplevel
+    global modeChooser, fileChooseLabel, fileChooseField, fileChooseFB, installTasks, \
+        uninstallTasks, installPathField, createDesktopShortcut, systemDictionaries, \
+        removePackage, removeConf, packageLabel, packageChooser, scanner, conf
+    import install_waterfox_common as installcommon
+    builder.add_objects_from_file(gladePath, ["page2"])
+    modeChooser = builder.get_object("modeChooser")
+    fileChooseLabel = builder.get_object("fileChooseLabel")
+    fileChooseField = builder.get_object("fileChooseField")
+    fileChooseFB = builder.get_object("fileChooseFB")
+    installTasks = builder.get_object("installTasks")
+    uninstallTasks = builder.get_object("uninstallTasks")
+    installPathField = builder.get_object("installPathField")
+    createDesktopShortcut = builder.get_object("createDesktopShortcut")
+    systemDictionaries = builder.get_object("systemDictionaries")
+    removePackage = builder.get_object("removePackage")
+    removeConf = builder.get_object("removeConf")
+    packageLabel = builder.get_object("packageLabel")
+    packageChooser = builder.get_object("packageChooser")
+    builder.connect_signals(Handler())
+
+    scanner = packageScanner(showPackageNames)
+    conf = installcommon.settings()
+    installPathField.set_text(conf.installPath)
+    if hasattr(conf, "installDesktopShortcut"):
+        createDesktopShortcut.set_active(str2Bool(conf.installDesktopShortcut))
+    if hasattr(conf, "useSystemDictionaries"):
+        systemDictionaries.set_active(str2Bool(conf.useSystemDictionaries))
+    if hasattr(conf, "removeArchive"):
+        removePackage.set_active(str2Bool(conf.removeArchive))
+
+    page = builder.get_object("page2")
+    page.show_all()
+    for widget in [uninstallTasks, packageLabel, packageChooser]:
+        widget.hide()
+    return page
+
+
+def buildFinalPage():
+    # pylint: disable=global-statement
+    global finalLabel, logger, progress
+    builder.add_objects_from_file(gladePath, ["page3"])
+    finalLabel = builder.get_object("finalLabel")
+    logger = logView(builder.get_object("log"))
+    progress = builder.get_object("progress")
+    builder.connect_signals(Handler())
+    page = builder.get_object("page3")
+    page.show_all()
+    return page
+
+
+def buildPage(index):
+    """Add pages of assistant up to index, they are built when they are needed"""
+    pageBuilders = [None, buildOptionsPage, buildFinalPage]
+    while window.get_n_pages() <= index < len(pageBuilders):
+        page = pageBuilders[window.get_n_pages()]()
+        window.append_page(page)
+        window.set_page_type(page, Gtk.AssistantPageType.CUSTOM)
+        window.set_page_complete(page, True)
+
+
+def main():
+    # pylint: disable=global-statement
+    global builder, gladePath, window, backBtn, nextBtn, cancelBtn, installBtn
+    scriptPath = os.path.dirname(os.path.realpath(__file__))
+    gladePath = pj(scriptPath, "GUI.glade")
+    builder = Gtk.Builder()
+    builder.add_objects_from_file(gladePath, ["assistant"])
+    builder.connect_signals(Handler())
+
+    window = builder.get_object("assistant")
+    backBtn = builder.get_object("backBtn")
+    nextBtn = builder.get_object("nextBtn")
+    cancelBtn = builder.get_object("cancelBtn")
+    installBtn = builder.get_object("installBtn")
+
+    window.show_all()
+    Gtk.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""
+Parallel bzip2 decoder for installer scripts for Waterfox
+Depends: Python 3.5+
+
+Every bzip2 block starts with a 48-bit magic number and carries its own CRC,
+so blocks can be cut out of the stream (they aren't byte aligned), wrapped
+into standalone single-block streams and decoded by stdlib bz2 in a pool of
+processes, or threads if installer runs more of them. Decoded blocks are
+returned in original order.
+
+MIT License
+
+Copyright (c) 2022 hawkeye116477
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import os
+import sys
+import bz2
+import mmap
+import threading
+import itertools
+import contextlib
+import collections
+import multiprocessing
+import concurrent.futures
+
+BLOCK_MAGIC = 0x314159265359
+EOS_MAGIC = 0x177245385090
+MAGIC_MASK = (1 << 48) - 1
+
+
+def cpuCount():
+    """Return number of CPUs usable by this process"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def findMagic(data, magic):
+    """Return bit positions of 48-bit magic number in data"""
+    positions = []
+    for shift in range(8):
+        # Magic starting at given bit of a byte, inside 7-byte window
+        window = (magic << (8 - shift)).to_bytes(7, "big")
+        first = 0 if shift == 0 else 1
+        needle = window[first:6]
+        found = data.find(needle)
+        while found != -1:
+            start = found - first
+            if start >= 0:
+                chunk = bytes(data[start:start + 7]).ljust(7, b"\0")
+                value = (int.from_bytes(chunk, "big") >> (8 - shift)) & MAGIC_MASK
+                if value == magic:
+                    positions.append(start * 8 + shift)
+            found = data.find(needle, found + 1)
+    return sorted(set(positions))
+
+
+def readBits(data, start, end):
+    """Return bits [start, end) of data as an integer"""
+    startByte = start // 8
+    endByte = (end + 7) // 8
+    value = int.from_bytes(data[startByte:endByte], "big")
+    value >>= endByte * 8 - end
+    return value & ((1 << (end - start)) - 1)
+
+
+def findBlocks(data):
+    """Split bzip2 file into (level, startBit, endBit) of all blocks"""
+    blockPositions = findMagic(data, BLOCK_MAGIC)
+    eosPositions = findMagic(data, EOS_MAGIC)
+    blocks = []
+    streamStart = 0
+    while data[streamStart:streamStart + 3] == b"BZh":
+        level = data[streamStart + 3:streamStart + 4]
+        firstBit = (streamStart + 4) * 8
+        streamEnd = None
+        for pos in eosPositions:
+            if pos >= firstBit:
+                streamEnd = pos
+                break
+        if streamEnd is None:
+            raise OSError("Compressed bzip2 file ended before the end-of-stream marker was reached")
+        starts = [pos for pos in blockPositions if firstBit <= pos < streamEnd]
+        for idx, start in enumerate(starts):
+            end = starts[idx + 1] if idx + 1 < len(starts) else streamEnd
+            blocks.append((level, start, end))
+        # Stream CRC follows end-of-stream marker, then padding to full byte
+        streamStart = (streamEnd + 48 + 32 + 7) // 8
+    if not blocks and streamStart == 0:
+        raise OSError("Invalid data stream")
+    return blocks
+
+
+def decodeBlock(level, chunk, startBit, endBit):
+    """Decode single block, bit offsets are relative to chunk"""
+    bits = endBit - startBit
+    blockValue = readBits(chunk, startBit, endBit)
+    # Stream CRC of single-block stream is equal to block CRC
+    blockCrc = (blockValue >> (bits - 80)) & 0xFFFFFFFF
+    value = (blockValue << 48 | EOS_MAGIC) << 32 | blockCrc
+    bits += 80
+    padding = -bits % 8
+    value <<= padding
+    stream = b"BZh" + level + value.to_bytes((bits + padding) // 8, "big")
+    return bz2.decompress(stream)
+
+
+def blockArguments(data, blocks):
+    """Return arguments of decodeBlock() decoding one or more adjacent
+    blocks as a single one"""
+    level = blocks[0][0]
+    start = blocks[0][1]
+    end = blocks[-1][2]
+    startByte = start // 8
+    chunk = bytes(data[startByte:(end + 7) // 8])
+    return level, chunk, start - startByte * 8, end - startByte * 8
+
+
+def orderedFutures(executor, jobs, limit):
+    """Submit jobs, (key, function, arguments) tuples, to executor and
+    yield (key, future) in order of jobs, with at most limit of them
+    submitted ahead. Futures not yielded yet are cancelled on close()."""
+    jobs = iter(jobs)
+    pending = collections.deque()
+    try:
+        while True:
+            for key, function, arguments in itertools.islice(jobs, limit - len(pending)):
+                pending.append((key, executor.submit(function, *arguments)))
+            if not pending:
+                return
+            yield pending.popleft()
+    finally:
+        for _key, future in pending:
+            future.cancel()
+
+
+def blockExecutor(workers):
+    """Return pool for decoding of blocks
+
+    Forked child of process with more threads can deadlock on locks held by
+    them (GUI and fleet installs run installer in threads), such process
+    gets pool of threads, as bz2 releases GIL while decoding.
+    """
+    if threading.active_count() > 1:
+        return concurrent.futures.ThreadPoolExecutor(workers)
+    poolArgs = {}
+    if sys.version_info >= (3, 7):
+        # Other start methods would run main script of installer again
+        poolArgs["mp_context"] = multiprocessing.get_context("fork")
+    return concurrent.futures.ProcessPoolExecutor(workers, **poolArgs)
+
+
+def iterDecodedBlocks(data, workers, firstBlock=0):
+    """Yield decoded blocks with compressed bytes consumed so far and index
+    of their first block, in order"""
+    blocks = findBlocks(data)
+    jobs = (((index, [blocks[index]]), decodeBlock, blockArguments(data, [blocks[index]]))
+            for index in range(firstBlock, len(blocks)))
+    with blockExecutor(workers) as executor, \
+            contextlib.closing(orderedFutures(executor, jobs, workers * 2)) as results:
+        for (groupIndex, group), future in results:
+            try:
+                yield future.result(), (group[-1][2] + 7) // 8, groupIndex
+            except (OSError, ValueError):
+                # Magic number can also appear by chance inside compressed
+                # data, so try again with following blocks glued together
+                decoded = None
+                while decoded is None:
+                    following = next(results, None)
+                    if following is None or following[0][1][0][0] != group[0][0]:
+                        raise
+                    group += following[0][1]
+                    try:
+                        decoded = executor.submit(decodeBlock,
+                                                  *blockArguments(data, group)).result()
+                    except (OSError, ValueError):
+                        decoded = None
+                yield decoded, (group[-1][2] + 7) // 8, groupIndex
+
+
+class parallelBz2Reader:
+    """Read-only file object with data decoded in parallel
+
+    Reading can start at any block returned by resumePoint() earlier,
+    startPosition is then decoded position of that block.
+    """
+
+    # Subclasses for other formats replace generator of decoded blocks
+    decodeBlocks = staticmethod(iterDecodedBlocks)
+
+    def __init__(self, path, workers, digest=None, startBlock=0, startPosition=0):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if digest is not None:
+            # Pages read here stay in page cache for block search
+            digest.update(self.data)
+        self.blocks = self.decodeBlocks(self.data, workers, startBlock)
+        self.buffer = b""
+        self.offset = 0
+        self.bytesRead = 0
+        self.position = startPosition
+        self.decoded = startPosition
+        self.blockStarts = []
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) - self.offset < size:
+            try:
+                block, self.bytesRead, blockIndex = next(self.blocks)
+            except StopIteration:
+                break
+            self.blockStarts.append((blockIndex, self.decoded))
+            self.decoded += len(block)
+            self.buffer = self.buffer[self.offset:] + block
+            self.offset = 0
+        if size < 0:
+            size = len(self.buffer) - self.offset
+        data = self.buffer[self.offset:self.offset + size]
+        self.offset += len(data)
+        self.position += len(data)
+        return data
+
+    def resumePoint(self, position):
+        """Return (block, decoded position of block) to start reading at
+        position again, position mustn't be behind already read data"""
+        while len(self.blockStarts) > 1 and self.blockStarts[1][1] <= position:
+            del self.blockStarts[0]
+        return self.blockStarts[0] if self.blockStarts else None
+
+    def close(self):
+        self.blocks.close()
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+def openBz2(path, workers=None):
+    """Open bzip2 file for reading, decoding it on all available CPUs"""
+    if workers is None:
+        workers = cpuCount()
+    if workers <= 1 or os.path.getsize(path) == 0:
+        return bz2.BZ2File(path)
+    return parallelBz2Reader(path, workers)
@@ -35,17 +35,68 @@ import subprocess
 import configparser
 import re
 import stat
+import fnmatch
 import gettext
+import tarfile
+import tempfile
+import ctypes
+import hashlib
+import json
+import fcntl
+import errno
+import concurrent.futures
+import collections
+import time
+import contextlib
+import threading
 
 pj = os.path.join
 t = gettext.translation('install_waterfox_common', pj(
     sys.path[0], 'locales'), fallback=True)
 _ = t.gettext
 
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+MANIFEST_NAME = ".install_waterfox_manifest.json"
+STORE_NAME = ".install_waterfox_store"
+TRASH_NAME = ".install_waterfox_trash"
+JOURNAL_NAME = "journal"
+CHECKPOINT_INTERVAL = 2.0
+FICLONE = 0x40049409
+CHUNK_SIZE = 1024 * 1024
+TREE_CACHE_SIZE = "1024"
+RECOMPRESSED_ENTRIES = 3
+PACKAGE_RE = re.compile(r"waterfox-*.*(tar\.(?:bz2|xz|zst)|AppImage)$")
+VERSION_RE = re.compile(r"\d+(?:\.\d+)+")
+# Optional components, names can be used in extraction filters
+EXTRACT_COMPONENTS = {
+    "dictionaries": ["dictionaries"],
+    "langpacks": ["browser/extensions/langpack-*", "distribution/extensions/langpack-*"],
+    "crashreporter": ["crashreporter", "crashreporter.ini", "minidump-analyzer",
+                      "Throbber-small.gif"],
+    "updater": ["updater", "updater.ini", "update-settings.ini", "icons/updater.png"],
+}
+# Waterfox doesn't start without these, so filters never skip them
+ESSENTIAL_FILES = ["waterfox*", "*.so", "omni.ja", "browser/omni.ja", "application.ini",
+                   "platform.ini", "dependentlibs.list", "defaults/pref",
+                   "browser/chrome/icons/default"]
+
+# Desktop directories from xdg-user-dir, keyed by HOME and XDG_CONFIG_HOME
+desktopPaths = {}
+desktopPathsLock = threading.Lock()
+# Text of desktop entry template, keyed by its path
+desktopEntryTemplates = {}
+
 
 class settings:
     def __init__(self):
         self.installPath = os.path.expanduser("~/.local/lib")
+        self.deduplicateEditions = "no"
+        self.treeCacheSize = TREE_CACHE_SIZE
+        self.recompressPackages = "no"
+        self.extractInclude = ""
+        self.extractExclude = ""
+        self.prewarmFiles = "no"
         confPath = pj(os.getenv('XDG_CONFIG_HOME',
                                 os.path.expanduser("~/.config")), "install_waterfox")
         confFile = pj(confPath, "settings.conf")
@@ -66,55 +117,1432 @@ class settings:
                     self.useSystemDictionaries = conf["global"]["UseSystemDictionaries"]
                 if conf.has_option("global", "RemoveArchive"):
                     self.removeArchive = conf["global"]["RemoveArchive"]
+                if conf.has_option("global", "DeduplicateEditions"):
+                    self.deduplicateEditions = conf["global"]["DeduplicateEditions"]
+                if conf.has_option("global", "TreeCacheSize"):
+                    self.treeCacheSize = conf["global"]["TreeCacheSize"]
+                if conf.has_option("global", "RecompressPackages"):
+                    self.recompressPackages = conf["global"]["RecompressPackages"]
+                if conf.has_option("global", "ExtractInclude"):
+                    self.extractInclude = conf["global"]["ExtractInclude"]
+                if conf.has_option("global", "ExtractExclude"):
+                    self.extractExclude = conf["global"]["ExtractExclude"]
+                if conf.has_option("global", "PrewarmFiles"):
+                    self.prewarmFiles = conf["global"]["PrewarmFiles"]
 
 
-def install(sourcePath, installPath, chosenPackageType, installDesktopShortcut,
-            useSystemDictionaries, removeArchive, configFilePath, printDef):
-    # Make install directory if not already exist
-    if not os.path.exists(installPath):
-        printDef(_("Making {installPath} directory...").format(**locals()))
-        os.makedirs(installPath)
+progressEvent = collections.namedtuple("progressEvent", [
+    "type", "phase", "bytesRead", "bytesTotal", "bytesWritten", "filesExtracted",
+    "elapsed", "fraction", "eta"])
 
-    # Remove older version
-    lowerChosenPackageType = chosenPackageType.lower()
-    packagePath = pj(installPath, "waterfox-" + lowerChosenPackageType)
-    if os.path.isdir(packagePath):
-        printDef(_("Removing older installed version..."))
-        shutil.rmtree(packagePath)
-
-    # Unpack Waterfox into the install directory
-    printDef(_("Unpackaging {package} into {installPath} directory...")
-             .format(package=os.path.basename(sourcePath), installPath=installPath))
-    tempPath = pj(installPath, "temp")
-    if os.path.exists(tempPath):
-        shutil.rmtree(tempPath)
-    os.makedirs(tempPath)
-    if re.match(r".*\.AppImage$", sourcePath):
+
+class progressTracker:
+    """Send progressEvent about phases of install/uninstall to progressDef"""
+
+    def __init__(self, progressDef=None, interval=0.1, profiler=None):
+        self.progressDef = progressDef
+        self.profiler = profiler
+        self.interval = interval
+        self.phase = None
+        self.startPhase(None)
+
+    def startPhase(self, phase, bytesTotal=None):
+        self.phase = phase
+        self.bytesTotal = bytesTotal
+        self.bytesRead = 0
+        self.bytesWritten = 0
+        self.filesExtracted = 0
+        self.startTime = time.monotonic()
+        self.lastEmit = 0
+        if phase is not None:
+            if self.profiler is not None:
+                self.profiler.startPhase(phase)
+            self.emit("phaseStart")
+
+    def update(self, bytesRead=None, bytesWritten=0, files=0):
+        if bytesRead is not None:
+            self.bytesRead = bytesRead
+        self.bytesWritten += bytesWritten
+        self.filesExtracted += files
+        if time.monotonic() - self.lastEmit >= self.interval:
+            self.emit("progress")
+
+    def endPhase(self):
+        if self.profiler is not None:
+            self.profiler.endPhase()
+        self.emit("phaseEnd")
+        self.phase = None
+
+    def emit(self, eventType):
+        if self.progressDef is None:
+            return
+        now = time.monotonic()
+        self.lastEmit = now
+        elapsed = now - self.startTime
+        fraction = None
+        eta = None
+        if eventType == "phaseEnd":
+            fraction = 1.0
+            eta = 0.0
+        elif self.bytesTotal:
+            fraction = min(self.bytesRead / self.bytesTotal, 1.0)
+            if fraction > 0:
+                eta = elapsed / fraction - elapsed
+        self.progressDef(progressEvent(eventType, self.phase, self.bytesRead, self.bytesTotal,
+                                       self.bytesWritten, self.filesExtracted,
+                                       elapsed, fraction, eta))
+
+
+@contextlib.contextmanager
+def noProfileStep():
+    # contextlib.nullcontext needs Python 3.7
+    yield
+
+
+def profileStep(profiler, name):
+    """Time step of install/uninstall when profiler is given"""
+    if profiler is None:
+        return noProfileStep()
+    return profiler.step(name)
+
+
+def parsePackageName(fileName):
+    """Return (edition, version) of package from its file name"""
+    name = str(os.path.splitext(fileName)[0]).replace("waterfox-", "")
+    edition = name.capitalize().split(".", 1)[0].split("-", 1)[0]
+    version = VERSION_RE.search(name)
+    return edition, version.group(0) if version else ""
+
+
+def packageIndexPath():
+    return pj(os.getenv('XDG_CACHE_HOME', os.path.expanduser("~/.cache")),
+              "install_waterfox", "packages.json")
+
+
+def findPackages(sourcePath, maxDepth=4):
+    """Return list of (path, edition, version) of installable packages.
+    Directories which didn't change since last scan are taken from index."""
+    indexPath = packageIndexPath()
+    try:
+        with open(indexPath, "r", encoding='utf-8') as indexFile:
+            index = json.load(indexFile)
+    except (OSError, ValueError):
+        index = {}
+    changed = False
+    packages = []
+    stack = [(os.path.abspath(sourcePath), 0)]
+    while stack:
+        dirPath, depth = stack.pop()
+        try:
+            dirStat = os.stat(dirPath)
+        except OSError:
+            continue
+        entry = index.get(dirPath)
+        if entry is None or entry["mtime"] != dirStat.st_mtime_ns or \
+                entry["inode"] != dirStat.st_ino:
+            entry = {"mtime": dirStat.st_mtime_ns, "inode": dirStat.st_ino,
+                     "packages": [], "dirs": []}
+            try:
+                for dirEntry in os.scandir(dirPath):
+                    if dirEntry.name.startswith("."):
+                        continue
+                    if dirEntry.is_dir(follow_symlinks=False):
+                        entry["dirs"].append(dirEntry.name)
+                    elif PACKAGE_RE.match(dirEntry.name):
+                        entry["packages"].append(
+                            [dirEntry.name] + list(parsePackageName(dirEntry.name)))
+            except OSError:
+                continue
+            index[dirPath] = entry
+            changed = True
+        for name, edition, version in entry["packages"]:
+            packages.append((pj(dirPath, name), edition, version))
+        if depth < maxDepth:
+            stack += [(pj(dirPath, name), depth + 1) for name in entry["dirs"]]
+    if changed:
+        os.makedirs(os.path.dirname(indexPath), exist_ok=True)
+        with open(indexPath + ".new", "w", encoding='utf-8') as indexFile:
+            json.dump(index, indexFile)
+        os.replace(indexPath + ".new", indexPath)
+    return sorted(packages)
+
+
+def matchesAny(name, patterns):
+    """Check if name or one of its parent directories matches any of patterns"""
+    for pattern in patterns:
+        if fnmatch.fnmatchcase(name, pattern) or \
+                fnmatch.fnmatchcase(name, pattern.rstrip("/") + "/*"):
+            return True
+    return False
+
+
+class extractFilter:
+    """Decide which files of package are left out of installation
+
+    Filters are comma separated patterns relative to package directory or
+    names of EXTRACT_COMPONENTS. Files matching exclude are skipped unless
+    they match include too, essential files are never skipped.
+    """
+
+    def __init__(self, include="", exclude=""):
+        self.include = self.parse(include)
+        self.exclude = self.parse(exclude)
+        self.bytesSkipped = 0
+        self.filesSkipped = 0
+
+    @staticmethod
+    def parse(text):
+        patterns = []
+        for item in re.split(r"[,\s]+", text or ""):
+            if item:
+                patterns += EXTRACT_COMPONENTS.get(item, [item.strip("/")])
+        return patterns
+
+    def key(self):
+        """Return text identifying filters, empty if nothing is skipped"""
+        if not self.exclude:
+            return ""
+        return json.dumps([sorted(self.include), sorted(self.exclude)])
+
+    def cacheKey(self, key):
+        """Return key of tree cache for package key, trees without some
+        files are cached separately"""
+        if not self.key():
+            return key
+        return key + "-" + hashlib.sha256(self.key().encode()).hexdigest()[:16]
+
+    def skips(self, name):
+        """Check if entry should be skipped, name is relative to package directory"""
+        return bool(self.exclude and name and not matchesAny(name, ESSENTIAL_FILES) and
+                    not matchesAny(name, self.include) and matchesAny(name, self.exclude) and
+                    not self.mayInclude(name))
+
+    def mayInclude(self, name):
+        """Check if some include pattern can match file inside directory name"""
+        parts = name.split("/")
+        for pattern in self.include:
+            patternParts = pattern.split("/")
+            if len(patternParts) > len(parts) and all(
+                    fnmatch.fnmatchcase(part, patternPart)
+                    for part, patternPart in zip(parts, patternParts)):
+                return True
+        return False
+
+    def count(self, size):
+        self.bytesSkipped += size
+        self.filesSkipped += 1
+
+    def prune(self, treePath):
+        """Remove skipped files from already extracted tree"""
+        for root, dirs, files in os.walk(treePath, topdown=False):
+            relRoot = os.path.relpath(root, treePath)
+            for name in files:
+                filePath = pj(root, name)
+                if self.skips(os.path.normpath(pj(relRoot, name))):
+                    self.count(os.lstat(filePath).st_size)
+                    os.remove(filePath)
+            for name in dirs:
+                if self.skips(os.path.normpath(pj(relRoot, name))) and \
+                        not os.path.islink(pj(root, name)) and not os.listdir(pj(root, name)):
+                    os.rmdir(pj(root, name))
+
+
+def isSafeMember(member, destPath):
+    """Check that tarball member stays inside destPath when extracted"""
+    if os.path.isabs(member.name) or ".." in member.name.split("/"):
+        return False
+    if not (member.isreg() or member.isdir() or member.issym() or member.islnk()):
+        return False
+    realDestPath = os.path.realpath(destPath)
+    targetPath = os.path.realpath(pj(realDestPath, member.name))
+    if os.path.commonpath([realDestPath, targetPath]) != realDestPath:
+        return False
+    if member.issym() or member.islnk():
+        if os.path.isabs(member.linkname):
+            return False
+        if member.issym():
+            linkPath = pj(os.path.dirname(targetPath), member.linkname)
+        else:
+            linkPath = pj(realDestPath, member.linkname)
+        linkPath = os.path.realpath(linkPath)
+        if os.path.commonpath([realDestPath, linkPath]) != realDestPath:
+            return False
+    return True
+
+
+def readManifest(treePath):
+    """Return manifest of files in installed tree or empty one"""
+    try:
+        with open(pj(treePath, MANIFEST_NAME), "r", encoding='utf-8') as manifestFile:
+            return json.load(manifestFile)
+    except (OSError, ValueError):
+        return {}
+
+
+def writeManifest(treePath, manifest):
+    with open(pj(treePath, MANIFEST_NAME), "w", encoding='utf-8') as manifestFile:
+        json.dump(manifest, manifestFile, sort_keys=True)
+
+
+class deltaUpgrade:
+    """Write only files which changed since installed version"""
+
+    def __init__(self, oldTreePath=None):
+        self.oldTreePath = oldTreePath
+        self.oldManifest = {}
+        if oldTreePath is not None:
+            self.oldManifest = readManifest(oldTreePath)
+        self.manifest = {}
+        self.bytesWritten = 0
+        self.bytesSkipped = 0
+
+    def unchangedFile(self, name, size):
+        """Return path of installed file which may be reused or None"""
+        entry = self.oldManifest.get(name)
+        if entry is None or entry["size"] != size:
+            return None
+        oldPath = pj(self.oldTreePath, name)
+        try:
+            oldStat = os.lstat(oldPath)
+        except OSError:
+            return None
+        # Skip files modified after installation
+        if not stat.S_ISREG(oldStat.st_mode) or oldStat.st_size != size or \
+                int(oldStat.st_mtime) != entry["mtime"]:
+            return None
+        return oldPath
+
+    def extract(self, tar, member, targetPath):
+        """Extract regular file, hard linking it if it's unchanged"""
+        # Name relative to package directory, without top-level "waterfox"
+        name = member.name.partition("/")[2]
+        oldPath = self.unchangedFile(name, member.size) if name else None
+        os.makedirs(os.path.dirname(targetPath), exist_ok=True)
+        source = tar.extractfile(member)
+        digest = hashlib.sha256()
+        oldFile = open(oldPath, "rb") if oldPath else None
+        newFile = None
+        matched = 0
+        try:
+            chunk = source.read(CHUNK_SIZE)
+            while chunk:
+                digest.update(chunk)
+                if newFile is None and oldFile is not None and \
+                        oldFile.read(len(chunk)) == chunk:
+                    matched += len(chunk)
+                else:
+                    if newFile is None:
+                        # Content differs, write it from the beginning
+                        newFile = open(targetPath, "wb")
+                        if matched:
+                            oldFile.seek(0)
+                            newFile.write(oldFile.read(matched))
+                    newFile.write(chunk)
+                chunk = source.read(CHUNK_SIZE)
+        finally:
+            if newFile is not None:
+                newFile.close()
+            if oldFile is not None:
+                oldFile.close()
+
+        if newFile is None and oldPath is not None:
+            try:
+                os.link(oldPath, targetPath)
+                self.bytesSkipped += member.size
+            except OSError:
+                copyFile(oldPath, targetPath, "reflink")
+                self.bytesWritten += member.size
+        else:
+            if newFile is None:
+                open(targetPath, "wb").close()
+            self.bytesWritten += member.size
+        os.chmod(targetPath, member.mode)
+        os.utime(targetPath, (member.mtime, member.mtime))
+        if name:
+            self.manifest[name] = {"size": member.size, "mtime": int(member.mtime),
+                                   "sha256": digest.hexdigest()}
+
+
+def cloneFile(sourcePath, destPath):
+    """Reflink sourcePath to destPath or hard link it, return True for reflink"""
+    try:
+        with open(sourcePath, "rb") as sourceFile, open(destPath, "wb") as destFile:
+            fcntl.ioctl(destFile.fileno(), FICLONE, sourceFile.fileno())
+        return True
+    except OSError:
+        if os.path.exists(destPath):
+            os.remove(destPath)
+    os.link(sourcePath, destPath)
+    return False
+
+
+def dedupTree(treePath, manifest, storePath):
+    """Replace files in tree with clones of objects from shared store"""
+    bytesShared = 0
+    for name, entry in manifest.items():
+        filePath = pj(treePath, name)
+        objectDir = pj(storePath, entry["sha256"][:2])
+        objectPath = pj(objectDir, entry["sha256"][2:])
+        tempPath = filePath + ".dedup"
+        if os.path.isfile(objectPath):
+            fileStat = os.stat(filePath)
+            if cloneFile(objectPath, tempPath):
+                os.chmod(tempPath, fileStat.st_mode)
+                os.utime(tempPath, (fileStat.st_atime, fileStat.st_mtime))
+            os.replace(tempPath, filePath)
+            bytesShared += entry["size"]
+        else:
+            os.makedirs(objectDir, exist_ok=True)
+            cloneFile(filePath, objectPath + ".new")
+            os.replace(objectPath + ".new", objectPath)
+    return bytesShared
+
+
+def copyFileData(sourcePath, destPath):
+    """Copy data of file inside kernel if possible, return method which was used"""
+    with open(sourcePath, "rb") as sourceFile, open(destPath, "wb") as destFile:
+        sourceFd = sourceFile.fileno()
+        destFd = destFile.fileno()
+        size = os.fstat(sourceFd).st_size
+        for method in ("copy_file_range", "sendfile"):
+            if not hasattr(os, method):
+                continue
+            copied = 0
+            try:
+                while copied < size:
+                    count = min(size - copied, 1 << 30)
+                    if method == "copy_file_range":
+                        count = os.copy_file_range(sourceFd, destFd, count)
+                    else:
+                        count = os.sendfile(destFd, sourceFd, None, count)
+                    if count == 0:
+                        break
+                    copied += count
+            except OSError as error:
+                # Not supported between these filesystems, try next way
+                if copied or error.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                                 errno.EOPNOTSUPP, errno.EBADF):
+                    raise
+                continue
+            # File might grow meanwhile, rest is copied below
+            shutil.copyfileobj(sourceFile, destFile, CHUNK_SIZE)
+            return method
+        shutil.copyfileobj(sourceFile, destFile, CHUNK_SIZE)
+    return "copy"
+
+
+def copyFile(sourcePath, destPath, mode):
+    """Copy single file in given mode, return method which was used
+
+    Modes are "reflink" (falls back to copy), "hardlink" (falls back to
+    reflink and copy), "clone" (reflink, then hard link, then copy) and "copy".
+    Copies are made by copy_file_range or sendfile when kernel allows it.
+    """
+    if mode == "hardlink":
+        try:
+            os.link(sourcePath, destPath)
+            return "hardlink"
+        except OSError as error:
+            # Other filesystem or too many links, reflink or copy it
+            if error.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+                raise
+    if mode in ("reflink", "hardlink", "clone"):
+        try:
+            with open(sourcePath, "rb") as sourceFile, open(destPath, "wb") as destFile:
+                fcntl.ioctl(destFile.fileno(), FICLONE, sourceFile.fileno())
+            shutil.copystat(sourcePath, destPath)
+            return "reflink"
+        except OSError:
+            if os.path.exists(destPath):
+                os.remove(destPath)
+    if mode == "clone":
+        try:
+            os.link(sourcePath, destPath)
+            return "hardlink"
+        except OSError as error:
+            if error.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+                raise
+    method = copyFileData(sourcePath, destPath)
+    shutil.copystat(sourcePath, destPath)
+    return method
+
+
+def materializeTree(sourcePath, destPath, mode, workers=8):
+    """Recreate tree from sourcePath in destPath, return counts of methods.
+    Files are copied by pool of threads, as copying doesn't hold GIL."""
+    methods = collections.Counter()
+    directories = [(sourcePath, destPath)]
+    files = []
+    os.mkdir(destPath)
+    for root, dirs, fileNames in os.walk(sourcePath):
+        destRoot = os.path.normpath(pj(destPath, os.path.relpath(root, sourcePath)))
+        for name in dirs + fileNames:
+            entryPath = pj(root, name)
+            if os.path.islink(entryPath):
+                os.symlink(os.readlink(entryPath), pj(destRoot, name))
+            elif os.path.isdir(entryPath):
+                os.mkdir(pj(destRoot, name))
+                directories.append((entryPath, pj(destRoot, name)))
+            else:
+                files.append((entryPath, pj(destRoot, name)))
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        for method in executor.map(lambda paths: copyFile(paths[0], paths[1], mode), files):
+            methods[method] += 1
+    # Read-only directories can be made only after filling them
+    for entryPath, destEntryPath in reversed(directories):
+        shutil.copystat(entryPath, destEntryPath)
+    return methods
+
+
+def moveTree(sourcePath, destPath):
+    """Move file or tree like shutil.move, but when it's on other filesystem,
+    reflink or copy it in kernel by pool of threads"""
+    if os.path.isdir(destPath):
+        destPath = pj(destPath, os.path.basename(sourcePath))
+    try:
+        os.rename(sourcePath, destPath)
+        return
+    except OSError as error:
+        # Other filesystem or other mount of the same one
+        if error.errno != errno.EXDEV:
+            raise
+    if os.path.islink(sourcePath):
+        os.symlink(os.readlink(sourcePath), destPath)
+        os.remove(sourcePath)
+    elif os.path.isdir(sourcePath):
+        materializeTree(sourcePath, destPath, "reflink")
+        removeTree(sourcePath)
+    else:
+        copyFile(sourcePath, destPath, "reflink")
+        os.remove(sourcePath)
+
+
+def collectGarbage(installPath):
+    """Remove objects from shared store which aren't used by any edition"""
+    storePath = pj(installPath, STORE_NAME)
+    if not os.path.isdir(storePath):
+        return
+    referenced = set()
+    for entry in os.scandir(installPath):
+        if entry.is_dir() and re.match(r"^waterfox-", entry.name):
+            referenced.update(fileEntry["sha256"]
+                              for fileEntry in readManifest(entry.path).values())
+    for objectDir in os.scandir(storePath):
+        for objectEntry in os.scandir(objectDir.path):
+            if objectDir.name + objectEntry.name not in referenced:
+                os.remove(objectEntry.path)
+        if not os.listdir(objectDir.path):
+            os.rmdir(objectDir.path)
+    if not os.listdir(storePath):
+        os.rmdir(storePath)
+
+
+def treeCachePath():
+    return pj(os.getenv('XDG_CACHE_HOME', os.path.expanduser("~/.cache")),
+              "install_waterfox", "trees")
+
+
+class treeCache:
+    """Unpacked trees of packages keyed by SHA-256 of package, evicted LRU
+
+    SHA-256 is computed in the same pass which unpacks package and then
+    remembered for its path, size, mtime and inode, so package is never
+    read only to find its key.
+    """
+
+    def __init__(self, maxSize, cachePath=None):
+        self.maxSize = int(maxSize) * 1048576
+        self.cachePath = cachePath or treeCachePath()
+
+    @contextlib.contextmanager
+    def locked(self):
+        os.makedirs(self.cachePath, exist_ok=True)
+        with open(pj(self.cachePath, ".lock"), "w", encoding='utf-8') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            yield
+
+    def readJson(self, name, default):
+        try:
+            with open(pj(self.cachePath, name), "r", encoding='utf-8') as jsonFile:
+                return json.load(jsonFile)
+        except (OSError, ValueError):
+            return default
+
+    def writeJson(self, name, data):
+        os.makedirs(os.path.dirname(pj(self.cachePath, name)), exist_ok=True)
+        with open(pj(self.cachePath, name + ".new"), "w", encoding='utf-8') as jsonFile:
+            json.dump(data, jsonFile)
+        os.replace(pj(self.cachePath, name + ".new"), pj(self.cachePath, name))
+
+    def key(self, sourcePath):
+        """Return SHA-256 of package remembered from its last unpacking,
+        None if file changed since. Removed package is found by its path
+        in cached entries."""
+        sourcePath = os.path.realpath(sourcePath)
+        try:
+            sourceStat = os.stat(sourcePath)
+        except FileNotFoundError:
+            entries = [entry for entry in self.entries() if entry["path"] == sourcePath]
+            if not entries:
+                return None
+            return max(entries, key=lambda entry: entry["lastUsed"])["key"]
+        memo = self.readJson("digests.json", {})
+        if sourcePath in memo and memo[sourcePath][0] == self.fileId(sourceStat):
+            return memo[sourcePath][1]
+        return None
+
+    @staticmethod
+    def fileId(sourceStat):
+        return [sourceStat.st_size, sourceStat.st_mtime_ns, sourceStat.st_ino,
+                sourceStat.st_dev]
+
+    def remember(self, sourcePath, sourceStat, key):
+        """Remember SHA-256 of package computed while it was unpacked,
+        sourceStat is taken before reading it"""
+        sourcePath = os.path.realpath(sourcePath)
+        with self.locked():
+            memo = self.readJson("digests.json", {})
+            memo[sourcePath] = [self.fileId(sourceStat), key]
+            self.writeJson("digests.json", memo)
+
+    def entries(self):
+        """Return list of info dictionaries of cached trees"""
+        entries = []
+        try:
+            dirEntries = list(os.scandir(self.cachePath))
+        except FileNotFoundError:
+            return entries
+        for dirEntry in dirEntries:
+            if dirEntry.is_dir() and not dirEntry.name.startswith("."):
+                info = self.readJson(pj(dirEntry.name, "info.json"), None)
+                if info is not None:
+                    entries.append(info)
+        return entries
+
+    def countLookup(self, hit):
+        stats = self.readJson("stats.json", {"hits": 0, "misses": 0})
+        stats["hits" if hit else "misses"] += 1
+        self.writeJson("stats.json", stats)
+
+    def materialize(self, key, destPath):
+        """Clone cached tree into destPath, return False if it isn't cached"""
+        with self.locked():
+            info = self.readJson(pj(key, "info.json"), None)
+            treePath = pj(self.cachePath, key, "tree")
+            valid = info is not None
+            if valid:
+                # Hard links share data with installed trees, so check that
+                # none of them was changed in place
+                for name, (size, mtime) in info["files"].items():
+                    try:
+                        fileStat = os.lstat(pj(treePath, name))
+                    except OSError:
+                        valid = False
+                        break
+                    if fileStat.st_size != size or fileStat.st_mtime_ns != mtime:
+                        valid = False
+                        break
+            if not valid:
+                if os.path.isdir(pj(self.cachePath, key)):
+                    removeTree(pj(self.cachePath, key))
+                self.countLookup(False)
+                return False
+            try:
+                materializeTree(treePath, destPath, "clone")
+            except OSError:
+                if os.path.isdir(destPath):
+                    removeTree(destPath)
+                self.countLookup(False)
+                return False
+            info["lastUsed"] = time.time()
+            info["hits"] += 1
+            self.writeJson(pj(key, "info.json"), info)
+            self.countLookup(True)
+        return True
+
+    def digests(self, key):
+        """Return {algorithm: hex digest} of package stored with its tree"""
+        return self.readJson(pj(key, "info.json"), {}).get("digests", {})
+
+    def store(self, key, treePath, sourcePath, digests=None):
+        """Clone unpacked tree into cache and evict least recently used trees,
+        digests of package are kept for verification of later installs"""
+        files = {}
+        size = 0
+        for root, _dirs, fileNames in os.walk(treePath):
+            for name in fileNames:
+                fileStat = os.lstat(pj(root, name))
+                if stat.S_ISREG(fileStat.st_mode):
+                    files[os.path.relpath(pj(root, name), treePath)] = [
+                        fileStat.st_size, fileStat.st_mtime_ns]
+                    size += fileStat.st_size
+        if size > self.maxSize:
+            return
+        with self.locked():
+            entryPath = pj(self.cachePath, key)
+            if os.path.isdir(entryPath):
+                removeTree(entryPath)
+            tempPath = tempfile.mkdtemp(prefix=".new-", dir=self.cachePath)
+            try:
+                materializeTree(treePath, pj(tempPath, "tree"), "clone")
+                now = time.time()
+                info = {"key": key, "path": os.path.realpath(sourcePath),
+                        "name": os.path.basename(sourcePath), "size": size,
+                        "created": now, "lastUsed": now, "hits": 0, "files": files,
+                        "digests": digests or {}}
+                with open(pj(tempPath, "info.json"), "w", encoding='utf-8') as infoFile:
+                    json.dump(info, infoFile)
+                os.rename(tempPath, entryPath)
+            except BaseException:
+                removeTree(tempPath)
+                raise
+            self.evict(keep=key)
+
+    def evict(self, keep=None):
+        entries = sorted(self.entries(), key=lambda entry: entry["lastUsed"])
+        total = sum(entry["size"] for entry in entries)
+        for entry in entries:
+            if total <= self.maxSize:
+                break
+            if entry["key"] == keep:
+                continue
+            removeTree(pj(self.cachePath, entry["key"]))
+            total -= entry["size"]
+
+    def stats(self):
+        """Return dictionary with hits, misses, hit rate, size and entries"""
+        stats = self.readJson("stats.json", {"hits": 0, "misses": 0})
+        entries = sorted(self.entries(), key=lambda entry: entry["lastUsed"], reverse=True)
+        lookups = stats["hits"] + stats["misses"]
+        stats.update(hitRate=stats["hits"] / lookups if lookups else 0.0,
+                     size=sum(entry["size"] for entry in entries), maxSize=self.maxSize,
+                     entries=entries)
+        return stats
+
+
+class digestSet:
+    """Pass the same data to several digests"""
+
+    def __init__(self, *digests):
+        self.digests = digests
+
+    def update(self, data):
+        for digest in self.digests:
+            digest.update(data)
+
+
+def combineDigests(*digests):
+    """Return digest updating all given ones, None if none is given"""
+    digests = [digest for digest in digests if digest is not None]
+    if not digests:
+        return None
+    if len(digests) == 1:
+        return digests[0]
+    return digestSet(*digests)
+
+
+class hashingReader:
+    """Pass data read from file to digest on the way"""
+
+    def __init__(self, fileobj, digest=None):
+        self.fileobj = fileobj
+        self.digest = digest
+        self.bytesRead = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.bytesRead += len(data)
+        if self.digest is not None:
+            self.digest.update(data)
+        return data
+
+    def drain(self):
+        """Read rest of file, which decompressor didn't need"""
+        while self.read(CHUNK_SIZE):
+            pass
+
+    def close(self):
+        self.fileobj.close()
+
+
+def readChecksum(sourcePath):
+    """Return (algorithm, checksum) from file next to package or None"""
+    for algorithm in ("sha512", "sha256"):
+        checksumPath = sourcePath + "." + algorithm
+        if not os.path.isfile(checksumPath):
+            continue
+        with open(checksumPath, "r", encoding='utf-8') as checksumFile:
+            lines = [line.split() for line in checksumFile if line.strip()]
+        for line in lines:
+            if len(lines) == 1 or line[-1].lstrip("*") == os.path.basename(sourcePath):
+                return algorithm, line[0].lower()
+    return None
+
+
+def hashFile(path, digest):
+    with open(path, "rb") as fileToHash:
+        hashingReader(fileToHash, digest).drain()
+
+
+class teeReader:
+    """Pass data read from file also to writer"""
+
+    def __init__(self, fileobj, writer):
+        self.fileobj = fileobj
+        self.writer = writer
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.writer.write(data)
+        return data
+
+    def drain(self):
+        """Pass rest of file, which tarfile didn't need, to writer"""
+        while self.read(CHUNK_SIZE):
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+def openTarball(sourcePath, digest=None, resumeAt=None):
+    """Open tarball for decoding, on all CPUs if its format allows it
+
+    Return (fileobj, position, rawFile), reading of parallel decoders
+    continues from block of resumeAt. Decompressor of rawFile (if it's
+    not None) may not read it to the end.
+    """
+    # Modules for unpacking are loaded only when package is unpacked
+    # pylint: disable=import-outside-toplevel
+    import install_waterfox_bz2
+    workers = install_waterfox_bz2.cpuCount()
+    readerClass = None
+    if sourcePath.endswith(".zst"):
+        import install_waterfox_zstd
+        if workers > 1 and install_waterfox_zstd.canDecodeInParallel(sourcePath):
+            readerClass = install_waterfox_zstd.parallelZstdReader
+        else:
+            return install_waterfox_zstd.zstdReader(sourcePath, digest), 0, None
+    elif sourcePath.endswith(".xz") and workers > 1:
+        import install_waterfox_xz
+        if install_waterfox_xz.canDecodeInParallel(sourcePath):
+            readerClass = install_waterfox_xz.parallelXzReader
+    elif sourcePath.endswith(".bz2") and workers > 1:
+        readerClass = install_waterfox_bz2.parallelBz2Reader
+    if readerClass is not None:
+        if resumeAt is not None and resumeAt.get("block") is not None and \
+                resumeAt.get("source", sourcePath) == sourcePath:
+            fileobj = readerClass(sourcePath, workers, digest,
+                                  resumeAt["block"], resumeAt["blockPosition"])
+            fileobj.read(resumeAt["position"] - resumeAt["blockPosition"])
+            return fileobj, resumeAt["position"], None
+        return readerClass(sourcePath, workers, digest), 0, None
+    # Decompressor gets the same buffers as digest
+    rawFile = hashingReader(open(sourcePath, "rb"), digest)
+    if sourcePath.endswith(".bz2"):
+        import bz2
+        return bz2.BZ2File(rawFile), 0, rawFile
+    if sourcePath.endswith(".xz"):
+        import lzma
+        return lzma.LZMAFile(rawFile), 0, rawFile
+    return rawFile, 0, rawFile
+
+
+def unpackTarball(sourcePath, destPath, fileobj=None, delta=None, digest=None,
+                  progress=None, journal=None, tee=None, filters=None):
+    """Unpack tarball in a single pass, writing each member as it arrives
+
+    With journal, extracted members are recorded and resumed journal
+    continues from its last checkpoint. Decoded tarball is also written
+    into tee, if it's given. Members skipped by extractFilter aren't written.
+    """
+    directories = []
+    extractArgs = {}
+    if hasattr(tarfile, "fully_trusted_filter"):
+        # Members are already checked by isSafeMember
+        extractArgs["filter"] = "fully_trusted"
+    mode = "r|"
+    closeFileobj = False
+    rawFile = None
+    base = 0
+    resumeAt = None
+    if journal is not None and journal.resumed:
+        directories += journal.directories
+        if delta is not None:
+            delta.manifest.update(journal.manifest)
+        resumeAt = journal.resumeAt
+    if fileobj is None:
+        closeFileobj = True
+        fileobj, base, rawFile = openTarball(sourcePath, digest, resumeAt)
+        if fileobj is rawFile:
+            # Unknown compression is left to tarfile
+            mode = "r|*"
+    progressSource = rawFile or fileobj
+    if tee is not None:
+        fileobj = teeReader(fileobj, tee)
+    try:
+        with tarfile.open(sourcePath, mode, fileobj=fileobj, bufsize=1024 * 1024) as tar:
+            for member in tar:
+                if journal is not None and member.name in journal.members:
+                    # Extracted before interruption, stream can't skip it
+                    continue
+                if filters is not None and filters.skips(member.name.partition("/")[2]):
+                    if not member.isdir():
+                        filters.count(member.size)
+                    continue
+                bytesWritten = extractMember(tar, member, destPath, directories,
+                                             extractArgs, delta,
+                                             journal is not None and journal.resumed)
+                if progress is not None:
+                    progress.update(getattr(progressSource, "bytesRead", None), bytesWritten, 1)
+                if journal is not None:
+                    journal.memberDone(
+                        member.name,
+                        delta.manifest.get(member.name.partition("/")[2])
+                        if delta is not None and member.isreg() else None,
+                        directories[-1] if member.isdir() else None)
+                    journal.checkpoint(resumePosition(fileobj, base + tar.offset, sourcePath))
+            if journal is not None:
+                journal.checkpoint(resumePosition(fileobj, base + tar.offset, sourcePath),
+                                   force=True)
+        if tee is not None:
+            fileobj.drain()
+        if rawFile is not None:
+            rawFile.drain()
+    finally:
+        if closeFileobj:
+            fileobj.close()
+            if rawFile is not None:
+                rawFile.close()
+
+    directories.sort(reverse=True)
+    for name, mode, mtime in directories:
+        dirPath = pj(destPath, name)
+        os.chmod(dirPath, mode | stat.S_IRWXU)
+        os.utime(dirPath, (mtime, mtime))
+
+
+def resumePosition(fileobj, position, sourcePath=None):
+    """Return where extraction can continue from position of next member,
+    blocks are valid only for decoded sourcePath"""
+    resumeAt = {"position": position, "block": None, "blockPosition": None,
+                "source": sourcePath}
+    if hasattr(fileobj, "resumePoint"):
+        point = fileobj.resumePoint(position)
+        if point is not None:
+            resumeAt["block"], resumeAt["blockPosition"] = point
+    return resumeAt
+
+
+def extractMember(tar, member, destPath, directories, extractArgs, delta=None,
+                  replace=False):
+    """Extract single member of tarball opened in stream mode,
+    return number of bytes written"""
+    if not isSafeMember(member, destPath):
+        raise tarfile.ExtractError(
+            "Refusing to extract unsafe member {}".format(member.name))
+    # Setuid, setgid and sticky bits aren't needed by Waterfox
+    member.mode &= 0o777
+    if member.isdir():
+        # Like extractall, set directory permissions at the end,
+        # so read-only directories don't block their own content
+        directories.append([member.name, member.mode, member.mtime])
+        os.makedirs(pj(destPath, member.name), exist_ok=True)
+        return 0
+    if replace and os.path.lexists(pj(destPath, member.name)):
+        # Could be partially written before interruption
+        os.remove(pj(destPath, member.name))
+    if delta is not None and member.isreg():
+        bytesWritten = delta.bytesWritten
+        delta.extract(tar, member, pj(destPath, member.name))
+        return delta.bytesWritten - bytesWritten
+    tar.extract(member, destPath, **extractArgs)
+    return member.size if member.isreg() else 0
+
+
+def clearDirectory(path):
+    """Remove everything except subdirectories, return their paths"""
+    subDirs = []
+    try:
+        dirFd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    except FileNotFoundError:
+        return subDirs
+    try:
+        for entry in os.scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                subDirs.append(entry.path)
+                continue
+            try:
+                os.unlink(entry.name, dir_fd=dirFd)
+            except FileNotFoundError:
+                pass
+    finally:
+        os.close(dirFd)
+    return subDirs
+
+
+def removeTree(path, workers=8):
+    """Remove directory tree, unlinking files with pool of threads"""
+    if os.path.islink(path) or not os.path.isdir(path):
+        os.remove(path)
+        return
+    directories = [path]
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        pending = [executor.submit(clearDirectory, path)]
+        while pending:
+            for subDir in pending.pop().result():
+                directories.append(subDir)
+                pending.append(executor.submit(clearDirectory, subDir))
+    # Deeper directories are always found later than their parents
+    for directory in reversed(directories):
+        try:
+            os.rmdir(directory)
+        except FileNotFoundError:
+            pass
+
+
+def moveToTrash(path, installPath):
+    """Move tree out of the way at once, it'll be removed by emptyTrash"""
+    trashPath = pj(installPath, TRASH_NAME)
+    while True:
+        os.makedirs(trashPath, exist_ok=True)
+        try:
+            os.rename(path, pj(tempfile.mkdtemp(dir=trashPath), os.path.basename(path)))
+            return
+        except FileNotFoundError:
+            # Trash was emptied by another installer in the meantime
+            if not os.path.lexists(path):
+                raise
+
+
+def emptyTrash(installPath, removeInstallPath=False, wait=False):
+    """Remove trash (also from crashed runs), by default in detached process"""
+    trashPath = pj(installPath, TRASH_NAME)
+    if not wait:
+        command = [sys.executable, os.path.realpath(__file__),
+                   "--empty-trash", installPath]
+        if removeInstallPath:
+            command.append("--remove-install-path")
+        subprocess.Popen(command, start_new_session=True, stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return
+    try:
+        trashFd = lockDirectory(trashPath, blocking=False)
+    except FileNotFoundError:
+        trashFd = -1
+    if trashFd is None:
+        # Another installer is emptying it
+        return
+    if trashFd >= 0:
+        try:
+            for entry in os.scandir(trashPath):
+                removeTree(entry.path)
+            os.rmdir(trashPath)
+        except OSError:
+            # Another installer has just put something in
+            return
+        finally:
+            os.close(trashFd)
+    if removeInstallPath and os.path.isdir(installPath) and not os.listdir(installPath):
+        os.rmdir(installPath)
+
+
+def lockDirectory(path, blocking=True):
+    """Return descriptor holding flock on directory, None if it's busy
+
+    Lock is released by closing descriptor or when process dies.
+    """
+    dirFd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        fcntl.flock(dirFd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(dirFd)
+        return None
+    except BaseException:
+        os.close(dirFd)
+        raise
+    return dirFd
+
+
+@contextlib.contextmanager
+def lockedDirectory(path):
+    """Serialize changes of directory shared by installers of all editions"""
+    dirFd = lockDirectory(path)
+    try:
+        yield
+    finally:
+        os.close(dirFd)
+
+
+def swapDirectories(newPath, path):
+    """Replace path with newPath, return path where the old tree is now"""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError):
+        renameat2 = None
+    if renameat2 is not None:
+        if renameat2(AT_FDCWD, os.fsencode(newPath), AT_FDCWD, os.fsencode(path),
+                     RENAME_EXCHANGE) == 0:
+            return newPath
+    # Kernel or filesystem without RENAME_EXCHANGE, do two quick renames
+    oldPath = newPath + ".old"
+    os.rename(path, oldPath)
+    os.rename(newPath, path)
+    return oldPath
+
+
+def syncFilesystem(path):
+    """Flush filesystem containing path to disk"""
+    try:
+        syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+    except (OSError, AttributeError):
+        os.sync()
+        return
+    dirFd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        if syncfs(dirFd) != 0:
+            os.sync()
+    finally:
+        os.close(dirFd)
+
+
+def packageIdentity(sourcePath):
+    sourceStat = os.stat(sourcePath)
+    return [os.path.abspath(sourcePath), sourceStat.st_size, sourceStat.st_mtime_ns]
+
+
+class installJournal:
+    """Write-ahead log of install kept in staging directory
+
+    Steps and extracted members are appended as JSON lines. Members are
+    written down in checkpoints only after filesystem was synced, together
+    with position in archive where extraction can continue.
+    """
+
+    def __init__(self, stagingPath):
+        self.path = pj(stagingPath, JOURNAL_NAME)
+        self.source = None
+        self.filters = ""
+        self.steps = []
+        self.members = set()
+        self.manifest = {}
+        self.directories = []
+        self.resumeAt = None
+        self.resumed = False
+        self.pending = []
+        self.lastCheckpoint = time.monotonic()
+        self.file = None
+
+    @classmethod
+    def load(cls, stagingPath):
+        """Return journal of interrupted install or None"""
+        journal = cls(stagingPath)
+        try:
+            with open(journal.path, "r", encoding='utf-8') as journalFile:
+                lines = journalFile.read().split("\n")
+        except OSError:
+            return None
+        # Last line could be torn by crash
+        for line in lines[:-1]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record["op"] == "begin":
+                journal.source = record["source"]
+                journal.filters = record.get("filters", "")
+            elif record["op"] == "step":
+                journal.steps.append(record["step"])
+            elif record["op"] == "checkpoint":
+                journal.members.update(record["members"])
+                journal.manifest.update(record["manifest"])
+                journal.directories += record["directories"]
+                journal.resumeAt = record["resumeAt"]
+        journal.resumed = True
+        return journal
+
+    def canResume(self, sourcePath, filtersKey=""):
+        """Same package is installed with the same filters and old version
+        wasn't touched yet"""
+        try:
+            identity = packageIdentity(sourcePath)
+        except OSError:
+            return False
+        if self.source != identity or self.filters != filtersKey or "switching" in self.steps:
+            return False
+        # AppImages are extracted out of order, so only finished extraction counts
+        return "unpacked" in self.steps or re.match(r".*\.tar\.[^.]+$", sourcePath) is not None
+
+    def append(self, record):
+        if self.file is None:
+            self.file = open(self.path, "a", encoding='utf-8')
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def begin(self, sourcePath, filtersKey="", identity=None):
+        self.source = identity or packageIdentity(sourcePath)
+        self.filters = filtersKey
+        self.append({"op": "begin", "source": self.source, "filters": filtersKey})
+
+    def step(self, name):
+        # Everything done before step has to be on disk before it's recorded
+        syncFilesystem(os.path.dirname(self.path))
+        self.steps.append(name)
+        self.append({"op": "step", "step": name})
+
+    def memberDone(self, name, manifestEntry=None, directory=None):
+        self.pending.append((name, manifestEntry, directory))
+
+    def checkpoint(self, resumeAt, force=False):
+        """Record extracted members if interval elapsed, resumeAt is position
+        in archive after them"""
+        if not self.pending or not force and \
+                time.monotonic() - self.lastCheckpoint < CHECKPOINT_INTERVAL:
+            return
+        syncFilesystem(os.path.dirname(self.path))
+        record = {"op": "checkpoint", "members": [], "manifest": {}, "directories": [],
+                  "resumeAt": resumeAt}
+        for name, manifestEntry, directory in self.pending:
+            record["members"].append(name)
+            if manifestEntry is not None:
+                record["manifest"][name.partition("/")[2]] = manifestEntry
+            if directory is not None:
+                record["directories"].append(directory)
+        self.append(record)
+        self.pending = []
+        self.lastCheckpoint = time.monotonic()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def recompressedPath(sourcePath):
+    """Return path of zstd copy of package in cache, keyed by package identity"""
+    key = hashlib.sha256(json.dumps(packageIdentity(sourcePath)).encode()).hexdigest()
+    return pj(os.getenv('XDG_CACHE_HOME', os.path.expanduser("~/.cache")),
+              "install_waterfox", "recompressed", key[:32] + ".tar.zst")
+
+
+def pruneRecompressed(cachePath, keep=RECOMPRESSED_ENTRIES):
+    """Remove all but the newest zstd copies and leftovers of crashed runs"""
+    copies = []
+    for entry in os.scandir(cachePath):
+        entryStat = entry.stat()
+        if entry.name.endswith(".tar.zst"):
+            copies.append((entryStat.st_mtime, entry.path))
+        elif entryStat.st_mtime < time.time() - 86400:
+            copies.append((0, entry.path))
+    for _mtime, path in sorted(copies, reverse=True)[keep:]:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def verifyCachedPackage(sourcePath, cacheKey, printDef, profiler=None, digests=None):
+    """Check package against published checksum before its cached tree is
+    used, return True or raise ValueError when it doesn't match
+
+    digests are verified digests stored with cached tree, package is
+    hashed only for other algorithms and only if it still exists.
+    """
+    checksum = readChecksum(sourcePath)
+    if checksum is None:
+        return True
+    # Cache key is SHA-256 of package
+    digests = dict(digests or {}, sha256=cacheKey)
+    if checksum[0] not in digests and not os.path.exists(sourcePath):
+        # Removed package can't be hashed, cache key was taken from it
+        return True
+    printDef(_("Verifying {package} with {algorithm} checksum...")
+             .format(package=os.path.basename(sourcePath), algorithm=checksum[0]))
+    if checksum[0] in digests:
+        hexDigest = digests[checksum[0]]
+    else:
+        digest = hashlib.new(checksum[0])
+        with profileStep(profiler, "checksum"):
+            hashFile(sourcePath, digest)
+        hexDigest = digest.hexdigest()
+    if hexDigest != checksum[1]:
+        printDef(_("Checksum of {package} doesn't match, installation was rolled back!")
+                 .format(package=os.path.basename(sourcePath)))
+        raise ValueError("{} checksum mismatch".format(checksum[0]))
+    return True
+
+
+def unpackPackage(sourcePath, stagingPath, lowerChosenPackageType, printDef,
+                  installedPackagePath=None, progress=None, profiler=None, journal=None,
+                  recompress=False, filters=None, contentDigest=None, verifiedDigests=None):
+    """Unpack and verify package in staging directory
+
+    Return (unpackPath, newPackagePath, delta), tarball is unpacked into
+    unpackPath and has to be moved into newPackagePath by caller. With
+    recompress, tarball is also recompressed into zstd copy in cache,
+    which is decoded faster by next installations of the same package.
+    Files skipped by extractFilter filters aren't installed. Data of
+    package is passed to contentDigest while it's read for unpacking,
+    verified checksum is put into verifiedDigests dictionary.
+    """
+    if progress is None:
+        progress = progressTracker()
+    unpackPath = pj(stagingPath, "unpack")
+    newPackagePath = pj(stagingPath, "waterfox-" + lowerChosenPackageType)
+    os.makedirs(unpackPath, exist_ok=journal is not None and journal.resumed)
+    delta = None
+    writer = None
+    checksum = readChecksum(sourcePath)
+    digest = None
+    if checksum is not None:
+        printDef(_("Verifying {package} with {algorithm} checksum...")
+                 .format(package=os.path.basename(sourcePath), algorithm=checksum[0]))
+        digest = hashlib.new(checksum[0])
+    sourceDigest = combineDigests(digest, contentDigest)
+    if sourceDigest is not None and re.match(r".*\.AppImage$", sourcePath):
+        # SquashFS is read out of order, so hash it first,
+        # extraction will then read it from page cache
+        with profileStep(profiler, "checksum"):
+            hashFile(sourcePath, sourceDigest)
+    # Modules for unpacking are loaded only when package is unpacked
+    import install_waterfox_squashfs  # pylint: disable=import-outside-toplevel
+    if re.match(r".*\.AppImage$", sourcePath) and \
+            install_waterfox_squashfs.canExtract(sourcePath):
+        def skipEntry(name, inode):
+            if not filters.skips(name):
+                return False
+            if inode["type"] in install_waterfox_squashfs.FILE_TYPES:
+                filters.count(inode["size"])
+            return True
+        install_waterfox_squashfs.extractAppImage(
+            sourcePath, "usr/bin", newPackagePath,
+            onProgress=lambda bytesRead, bytesWritten: progress.update(
+                bytesRead, bytesWritten, 1),
+            skip=skipEntry if filters is not None else None)
+        shutil.move(pj(newPackagePath, "waterfox-" + lowerChosenPackageType),
+                    pj(newPackagePath, "waterfox"))
+    elif re.match(r".*\.AppImage$", sourcePath):
+        # Compression not supported by SquashFS reader
         os.chmod(sourcePath, os.stat(sourcePath).st_mode | stat.S_IEXEC | stat.S_IXUSR |
                  stat.S_IXGRP | stat.S_IXOTH)
-        os.chdir(tempPath)
-        subprocess.run([sourcePath, '--appimage-extract'], check=True)
-        shutil.move("./squashfs-root/usr/bin/waterfox-" + lowerChosenPackageType,
-                    "./squashfs-root/usr/bin/waterfox")
-        oldPackagePath = "./squashfs-root/usr/bin"
+        subprocess.run([os.path.abspath(sourcePath), '--appimage-extract'], check=True,
+                       cwd=unpackPath, stdout=subprocess.DEVNULL)
+        squashfsPath = pj(unpackPath, "squashfs-root")
+        shutil.move(pj(squashfsPath, "usr/bin/waterfox-" + lowerChosenPackageType),
+                    pj(squashfsPath, "usr/bin/waterfox"))
+        oldPackagePath = pj(squashfsPath, "usr/bin")
+        if filters is not None:
+            filters.prune(oldPackagePath)
         for f in os.listdir(oldPackagePath):
-            shutil.move(pj(oldPackagePath, f), "./")
-        shutil.rmtree("./squashfs-root")
-        os.makedirs(packagePath)
+            shutil.move(pj(oldPackagePath, f), unpackPath)
+        shutil.rmtree(squashfsPath)
+        os.makedirs(newPackagePath)
     else:
-        shutil.unpack_archive(sourcePath, tempPath)
+        delta = deltaUpgrade(installedPackagePath
+                             if installedPackagePath and os.path.isdir(installedPackagePath)
+                             else None)
+        tarballPath = sourcePath
+        tarballDigest = sourceDigest
+        copyPath = None
+        if recompress and not sourcePath.endswith(".zst"):
+            import install_waterfox_zstd  # pylint: disable=import-outside-toplevel
+            if install_waterfox_zstd.available():
+                copyPath = recompressedPath(sourcePath)
+        if copyPath is not None and os.path.isfile(copyPath):
+            printDef(_("Using recompressed copy of {package}...")
+                     .format(package=os.path.basename(sourcePath)))
+            os.utime(copyPath)
+            tarballPath = copyPath
+            tarballDigest = None
+            progress.bytesTotal = os.path.getsize(copyPath)
+            if sourceDigest is not None:
+                with profileStep(profiler, "checksum"):
+                    hashFile(sourcePath, sourceDigest)
+        elif copyPath is not None and (journal is None or not journal.resumed):
+            os.makedirs(os.path.dirname(copyPath), exist_ok=True)
+            fd, tempPath = tempfile.mkstemp(prefix=".", suffix=".new",
+                                            dir=os.path.dirname(copyPath))
+            writer = install_waterfox_zstd.zstdWriter(os.fdopen(fd, "wb"))
+        try:
+            unpackTarball(tarballPath, unpackPath, delta=delta, digest=tarballDigest,
+                          progress=progress, journal=journal, tee=writer, filters=filters)
+        except BaseException:
+            if writer is not None:
+                writer.close()
+                os.remove(tempPath)
+            raise
+        printDef(_("Written {written:.1f} MiB, skipped {skipped:.1f} MiB of unchanged files.")
+                 .format(written=delta.bytesWritten / 1048576,
+                         skipped=delta.bytesSkipped / 1048576))
+
+    if checksum is not None and digest.hexdigest() != checksum[1]:
+        if writer is not None:
+            writer.close()
+            os.remove(tempPath)
+        printDef(_("Checksum of {package} doesn't match, installation was rolled back!")
+                 .format(package=os.path.basename(sourcePath)))
+        raise ValueError("{} checksum mismatch".format(checksum[0]))
+    if checksum is not None and verifiedDigests is not None:
+        verifiedDigests[checksum[0]] = checksum[1]
+    if writer is not None:
+        with profileStep(profiler, "recompress"):
+            if writer.finish():
+                os.replace(tempPath, copyPath)
+                pruneRecompressed(os.path.dirname(copyPath))
+            else:
+                os.remove(tempPath)
+                printDef(_("Package couldn't be recompressed: {error}")
+                         .format(error=writer.error))
+    if filters is not None and filters.filesSkipped:
+        printDef(_("Skipped {skipped:.1f} MiB in {files} files excluded by filters.")
+                 .format(skipped=filters.bytesSkipped / 1048576, files=filters.filesSkipped))
+    return unpackPath, newPackagePath, delta
+
+
+def refreshIconCache(iconsPath, printDef, profiler=None):
+    """Update icon-theme.cache, stale cache only hides new icons, so don't fail"""
+    import install_waterfox_iconcache  # pylint: disable=import-outside-toplevel
+    with profileStep(profiler, "icon cache"):
+        try:
+            install_waterfox_iconcache.updateIconCache(iconsPath)
+        except OSError as error:
+            printDef(_("Couldn't refresh icons cache: {error}").format(error=error))
+
+
+def desktopDirectory():
+    """Return desktop directory of user, xdg-user-dir is run once per HOME"""
+    key = (os.path.expanduser("~"), os.getenv('XDG_CONFIG_HOME'))
+    with desktopPathsLock:
+        if key not in desktopPaths:
+            desktopPaths[key] = subprocess.run(['xdg-user-dir', 'DESKTOP'], check=True,
+                                               universal_newlines=True,
+                                               stdout=subprocess.PIPE).stdout.strip()
+        return desktopPaths[key]
 
-    for f in os.listdir(tempPath):
-        shutil.move(pj(tempPath, f), packagePath)
 
-    if os.path.exists(tempPath):
-        shutil.rmtree(tempPath)
+def desktopEntryTemplate():
+    """Return text of desktop entry template, it's read once, so processes
+    which dropped root privileges can use it too"""
+    path = pj(os.path.dirname(os.path.realpath(__file__)), "install_waterfox_desktop_entry")
+    with desktopPathsLock:
+        if path not in desktopEntryTemplates:
+            with open(path, 'r', encoding='utf-8') as desktopEntry:
+                desktopEntryTemplates[path] = desktopEntry.read()
+        return desktopEntryTemplates[path]
 
+
+def integrateDesktop(sourcePath, installPath, chosenPackageType, installDesktopShortcut,
+                     printDef, profiler=None):
+    """Install wrapper, menu entry and icons of installed package into HOME
+
+    Return list of written paths.
+    """
     # Install a wrapper to avoid confusion about binary path
     printDef(_("Creating executable file..."))
+    lowerChosenPackageType = chosenPackageType.lower()
+    createdPaths = []
     binPath = os.path.expanduser("~/.local/bin")
-    if not os.path.exists(binPath):
-        os.makedirs(binPath)
+    os.makedirs(binPath, exist_ok=True)
     wrapperTxt = '''\
 #!/bin/bash
 if [ "$XDG_CURRENT_DESKTOP" == "KDE" ]; then
@@ -125,19 +1553,15 @@ exec {installPath}/waterfox-{lowerChosenPackageType}/waterfox "$@"
     with open(pj(binPath, "waterfox-" + lowerChosenPackageType), "w+", encoding='utf-8') as wrapper:
         wrapper.write(wrapperTxt)
     os.chmod(pj(binPath, "waterfox-" + lowerChosenPackageType), 0o755)
+    createdPaths.append(pj(binPath, "waterfox-" + lowerChosenPackageType))
 
     # Create start menu shortcut
     printDef(_("Generating start menu shortcut..."))
     desktopEntryPath = os.path.expanduser("~/.local/share/applications")
-    if not os.path.exists(desktopEntryPath):
-        os.makedirs(desktopEntryPath)
+    os.makedirs(desktopEntryPath, exist_ok=True)
     desktopEntryPath = pj(desktopEntryPath, "waterfox-" +
                           lowerChosenPackageType + ".desktop")
-    scriptPath = os.path.dirname(os.path.realpath(__file__))
-    shutil.copy(pj(scriptPath, "install_waterfox_desktop_entry"),
-                desktopEntryPath)
-    with open(desktopEntryPath, 'r', encoding='utf-8') as desktopEntry:
-        data = desktopEntry.read()
+    data = desktopEntryTemplate()
     data = data.replace("{lowerChosenPackageType}", lowerChosenPackageType)
     data = data.replace("{chosenPackageType}", chosenPackageType)
     data = data.replace("{binAppPath}", os.path.join(
@@ -152,57 +1576,60 @@ exec {installPath}/waterfox-{lowerChosenPackageType}/waterfox "$@"
     with open(desktopEntryPath, 'w', encoding='utf-8') as desktopEntry:
         desktopEntry.write(data)
     os.chmod(desktopEntryPath, 0o644)
+    createdPaths.append(desktopEntryPath)
 
     # Create symlinks
     sizes = ["16", "22", "24", "32", "48", "128", "256"]
     printDef(_("Creating symlinks to icons..."))
     iconsPath = os.path.expanduser("~/.local/share/icons/hicolor")
     for size in sizes:
-        if not os.path.exists(pj(iconsPath, size + "x" + size, "apps")):
-            os.makedirs(pj(iconsPath, size + "x" + size, "apps"))
+        os.makedirs(pj(iconsPath, size + "x" + size, "apps"), exist_ok=True)
         if not os.path.islink(pj(iconsPath, size + "x" + size,
                                  "apps/waterfox-" + lowerChosenPackageType + ".png")):
-            os.symlink(pj(installPath, "waterfox-" + lowerChosenPackageType,
-                          "browser/chrome/icons/default/default" + size + ".png"),
-                       pj(iconsPath, size + "x" + size, "apps/waterfox-" + lowerChosenPackageType + ".png"))
+            with contextlib.suppress(FileExistsError):
+                os.symlink(pj(installPath, "waterfox-" + lowerChosenPackageType,
+                              "browser/chrome/icons/default/default" + size + ".png"),
+                           pj(iconsPath, size + "x" + size,
+                              "apps/waterfox-" + lowerChosenPackageType + ".png"))
+        createdPaths.append(pj(iconsPath, size + "x" + size,
+                               "apps/waterfox-" + lowerChosenPackageType + ".png"))
 
     # Refresh icons cache
     printDef(_("Refreshing icons cache..."))
-    subprocess.run(["gtk-update-icon-cache", '-q',
-                   '-t', '-f', iconsPath], check=True)
+    refreshIconCache(iconsPath, printDef, profiler)
+    createdPaths.append(pj(iconsPath, "icon-theme.cache"))
 
     # Install optional desktop shortcut
     if installDesktopShortcut == "yes":
-        desktopPath = subprocess.run(['xdg-user-dir', 'DESKTOP'], check=True,
-                                     universal_newlines=True, stdout=subprocess.PIPE).stdout.strip()
+        with profileStep(profiler, "xdg-user-dir"):
+            desktopPath = desktopDirectory()
         printDef(_("Installing desktop shortcut..."))
         if not os.path.islink(pj(desktopPath, "waterfox-" + lowerChosenPackageType + ".desktop")):
             os.symlink(desktopEntryPath,
                        pj(desktopPath, "waterfox-" + lowerChosenPackageType + ".desktop"))
+        createdPaths.append(pj(desktopPath, "waterfox-" + lowerChosenPackageType + ".desktop"))
+    return createdPaths
 
-    # Add vendor default settings
-    if useSystemDictionaries == "yes":
-        printDef(_("Adding path to system's dictionaries..."))
-        dictPath = "/usr/share/myspell"
-        if os.path.exists("/usr/share/hunspell"):
-            dictPath = "/usr/share/hunspell"
-        if not os.path.exists(pj(installPath, "waterfox-" + lowerChosenPackageType,
-                                 "browser/defaults/preferences")):
-            os.makedirs(pj(installPath, "waterfox-" +
-                        lowerChosenPackageType, "browser/defaults/preferences"))
-        with open(pj(installPath, "waterfox-" + lowerChosenPackageType,
-                     "browser/defaults/preferences/spellcheck.js"),
-                  'w+', encoding='utf-8') as spellcheckPref:
-            spellcheckPref.write(
-                'pref("spellchecker.dictionary_path", "{}");'.format(dictPath))
 
-    # Remove installed archive file
-    if removeArchive == "yes":
-        printDef(_("Removing {sourcePath} ...").format(**locals()))
-        os.remove(sourcePath)
+def addSystemDictionaries(packagePath, printDef):
+    """Point Waterfox to system's spellchecking dictionaries"""
+    printDef(_("Adding path to system's dictionaries..."))
+    dictPath = "/usr/share/myspell"
+    if os.path.exists("/usr/share/hunspell"):
+        dictPath = "/usr/share/hunspell"
+    if not os.path.exists(pj(packagePath, "browser/defaults/preferences")):
+        os.makedirs(pj(packagePath, "browser/defaults/preferences"))
+    with open(pj(packagePath, "browser/defaults/preferences/spellcheck.js"),
+              'w+', encoding='utf-8') as spellcheckPref:
+        spellcheckPref.write(
+            'pref("spellchecker.dictionary_path", "{}");'.format(dictPath))
 
-    # Save settings
-    printDef(_("Saving settings..."))
+
+def saveSettings(configFilePath, installPath, installDesktopShortcut,
+                 useSystemDictionaries, removeArchive, deduplicateEditions="no",
+                 treeCacheSize=TREE_CACHE_SIZE, recompressPackages="no", extractInclude="",
+                 extractExclude="", prewarmFiles="no"):
+    """Write choices of user into installer settings file"""
     conf = configparser.ConfigParser()
     conf["global"] = {}
     confG = conf["global"]
@@ -210,12 +1637,226 @@ exec {installPath}/waterfox-{lowerChosenPackageType}/waterfox "$@"
     confG["InstallDesktopShortcut"] = installDesktopShortcut
     confG["UseSystemDictionaries"] = useSystemDictionaries
     confG["RemoveArchive"] = removeArchive
+    confG["DeduplicateEditions"] = deduplicateEditions
+    confG["TreeCacheSize"] = treeCacheSize
+    confG["RecompressPackages"] = recompressPackages
+    confG["ExtractInclude"] = extractInclude
+    confG["ExtractExclude"] = extractExclude
+    confG["PrewarmFiles"] = prewarmFiles
     confDir = pj(os.getenv('XDG_CONFIG_HOME',
                            os.path.expanduser("~/.config")), "install_waterfox")
-    if not os.path.exists(confDir):
-        os.makedirs(confDir)
-    with open(configFilePath, 'w+', encoding='utf-8') as confFile:
-        conf.write(confFile)
+    os.makedirs(confDir, exist_ok=True)
+    # Installers running at once mustn't leave half written file
+    fd, tempPath = tempfile.mkstemp(prefix=".settings-", dir=os.path.dirname(configFilePath))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as confFile:
+            conf.write(confFile)
+        os.chmod(tempPath, 0o644)
+        os.replace(tempPath, configFilePath)
+    except BaseException:
+        os.remove(tempPath)
+        raise
+
+
+def install(sourcePath, installPath, chosenPackageType, installDesktopShortcut,
+            useSystemDictionaries, removeArchive, configFilePath, printDef,
+            deduplicateEditions="no", progressDef=None, profiler=None, treeCacheSize="0",
+            recompressPackages="no", extractInclude="", extractExclude="", prewarmFiles="no"):
+    """Install package as edition chosenPackageType into installPath
+
+    Each call works in its own staging directory and uses only absolute
+    paths, so different editions can be installed from several threads or
+    processes at once. Second install of the same edition into the same
+    installPath fails with EBUSY while the first one is running.
+
+    Files matching extractExclude (and not extractInclude) aren't installed,
+    see extractFilter. Bundled dictionaries are left out when system's
+    dictionaries are used.
+
+    With prewarmFiles, files needed by the first launch are read into page
+    cache by background threads, see install_waterfox_prewarm.
+    """
+    sourcePath = os.path.abspath(sourcePath)
+    installPath = os.path.abspath(installPath)
+    progress = progressTracker(progressDef, profiler=profiler)
+    cache = None
+    if int(treeCacheSize) > 0:
+        cache = treeCache(treeCacheSize)
+    filters = extractFilter(extractInclude, extractExclude + (
+        ",dictionaries" if useSystemDictionaries == "yes" else ""))
+
+    # Make install directory if not already exist
+    if not os.path.exists(installPath):
+        printDef(_("Making {installPath} directory...").format(**locals()))
+        os.makedirs(installPath, exist_ok=True)
+
+    # Unpack Waterfox into staging directory on the same filesystem
+    lowerChosenPackageType = chosenPackageType.lower()
+    packagePath = pj(installPath, "waterfox-" + lowerChosenPackageType)
+    stagingPath = None
+    stagingFd = None
+    journal = None
+    try:
+        with lockedDirectory(installPath):
+            for entry in os.scandir(installPath):
+                if not entry.is_dir() or \
+                        not entry.name.startswith(".waterfox-" + lowerChosenPackageType + "-"):
+                    continue
+                # Staging directory is locked while its installation runs
+                entryFd = lockDirectory(entry.path, blocking=False)
+                if entryFd is None:
+                    printDef(_("Waterfox {chosenPackageType} is already being installed "
+                               "into {installPath}!").format(
+                                   chosenPackageType=chosenPackageType, installPath=installPath))
+                    raise OSError(errno.EBUSY, "Waterfox {} is being installed by another "
+                                  "process".format(chosenPackageType), entry.path)
+                # Staging directory left by interrupted installation
+                previousJournal = installJournal.load(entry.path)
+                if stagingPath is None and previousJournal is not None and \
+                        previousJournal.canResume(sourcePath, filters.key()):
+                    stagingPath, stagingFd = entry.path, entryFd
+                    journal = previousJournal
+                else:
+                    moveToTrash(entry.path, installPath)
+                    os.close(entryFd)
+            if journal is None:
+                stagingPath = tempfile.mkdtemp(
+                    prefix=".waterfox-" + lowerChosenPackageType + "-", dir=installPath)
+                stagingFd = lockDirectory(stagingPath)
+                journal = installJournal(stagingPath)
+    except BaseException:
+        if stagingFd is not None:
+            os.close(stagingFd)
+        raise
+    if journal.resumed:
+        printDef(_("Resuming interrupted installation of {package}...")
+                 .format(package=os.path.basename(sourcePath)))
+    else:
+        printDef(_("Unpackaging {package} into {installPath} directory...")
+                 .format(package=os.path.basename(sourcePath), installPath=installPath))
+    keepStaging = False
+    try:
+        progress.startPhase("unpack", os.path.getsize(sourcePath)
+                            if os.path.exists(sourcePath) else None)
+        cacheKey = None
+        contentDigest = None
+        verifiedDigests = {}
+        if cache is not None and not journal.resumed:
+            with profileStep(profiler, "cache lookup"):
+                cacheKey = cache.key(sourcePath)
+            if cacheKey is None and os.path.exists(sourcePath):
+                # Key is computed while package is unpacked
+                sourceStat = os.stat(sourcePath)
+                contentDigest = hashlib.sha256()
+        if not journal.resumed:
+            # Package removed after it was cached is known only by cache key
+            journal.begin(sourcePath, filters.key(),
+                          None if os.path.exists(sourcePath) or cacheKey is None
+                          else ["cache", cacheKey])
+        newPackagePath = pj(stagingPath, "waterfox-" + lowerChosenPackageType)
+        unpackPath = None
+        delta = None
+        if "unpacked" in journal.steps:
+            if os.path.isdir(pj(stagingPath, "unpack")):
+                unpackPath = pj(stagingPath, "unpack")
+        elif cacheKey is not None and verifyCachedPackage(
+                sourcePath, cacheKey, printDef, profiler,
+                cache.digests(filters.cacheKey(cacheKey))) and \
+                cache.materialize(filters.cacheKey(cacheKey), newPackagePath):
+            printDef(_("Reused unpacked {package} from cache.")
+                     .format(package=os.path.basename(sourcePath)))
+        else:
+            if os.path.lexists(newPackagePath):
+                # Left by interrupted copy from cache
+                removeTree(newPackagePath)
+            unpackPath, newPackagePath, delta = unpackPackage(
+                sourcePath, stagingPath, lowerChosenPackageType, printDef,
+                installedPackagePath=packagePath, progress=progress, profiler=profiler,
+                journal=journal,
+                recompress=recompressPackages == "yes" and removeArchive != "yes",
+                filters=filters, contentDigest=contentDigest,
+                verifiedDigests=verifiedDigests)
+            if contentDigest is not None:
+                cacheKey = contentDigest.hexdigest()
+                cache.remember(sourcePath, sourceStat, cacheKey)
+        if "unpacked" not in journal.steps:
+            journal.step("unpacked")
+        progress.endPhase()
+
+        progress.startPhase("integrate")
+        if unpackPath is not None:
+            with profileStep(profiler, "move unpacked files"):
+                for f in os.listdir(unpackPath):
+                    moveTree(pj(unpackPath, f), newPackagePath)
+            if delta is not None:
+                writeManifest(newPackagePath, delta.manifest)
+            elif journal.manifest:
+                writeManifest(newPackagePath, journal.manifest)
+            if cacheKey is not None:
+                try:
+                    with profileStep(profiler, "cache store"):
+                        cache.store(filters.cacheKey(cacheKey), newPackagePath, sourcePath,
+                                    dict(verifiedDigests, sha256=cacheKey))
+                except OSError as error:
+                    printDef(_("Unpacked package couldn't be cached: {error}")
+                             .format(error=error))
+        manifest = delta.manifest if delta is not None else readManifest(newPackagePath)
+        if manifest and deduplicateEditions == "yes":
+            with profileStep(profiler, "deduplicate"), lockedDirectory(installPath):
+                bytesShared = dedupTree(newPackagePath, manifest,
+                                        pj(installPath, STORE_NAME))
+            printDef(_("Shared {shared:.1f} MiB with other installed editions.")
+                     .format(shared=bytesShared / 1048576))
+
+        # Switch to the new version, then remove older one
+        with profileStep(profiler, "switch"):
+            journal.step("switching")
+            if os.path.isdir(packagePath):
+                swapDirectories(newPackagePath, packagePath)
+                printDef(_("Removing older installed version..."))
+            else:
+                os.rename(newPackagePath, packagePath)
+    except KeyboardInterrupt:
+        # Next run continues from last checkpoint
+        keepStaging = "switching" not in journal.steps
+        raise
+    finally:
+        journal.close()
+        # Older version is in staging directory now
+        if not keepStaging:
+            with profileStep(profiler, "move to trash"):
+                moveToTrash(stagingPath, installPath)
+                emptyTrash(installPath)
+        os.close(stagingFd)
+    with profileStep(profiler, "collect garbage"), lockedDirectory(installPath):
+        collectGarbage(installPath)
+
+    if prewarmFiles == "yes":
+        import install_waterfox_prewarm  # pylint: disable=import-outside-toplevel
+        with profileStep(profiler, "prewarm"):
+            install_waterfox_prewarm.prewarm(packagePath, chosenPackageType, printDef)
+
+    integrateDesktop(sourcePath, installPath, chosenPackageType, installDesktopShortcut,
+                     printDef, profiler)
+
+    # Add vendor default settings
+    if useSystemDictionaries == "yes":
+        addSystemDictionaries(packagePath, printDef)
+
+    progress.endPhase()
+
+    # Remove installed archive file
+    progress.startPhase("finish")
+    if removeArchive == "yes" and os.path.exists(sourcePath):
+        printDef(_("Removing {sourcePath} ...").format(**locals()))
+        os.remove(sourcePath)
+
+    # Save settings
+    printDef(_("Saving settings..."))
+    saveSettings(configFilePath, installPath, installDesktopShortcut,
+                 useSystemDictionaries, removeArchive, deduplicateEditions, treeCacheSize,
+                 recompressPackages, extractInclude, extractExclude, prewarmFiles)
+    progress.endPhase()
 
     # Finish
     printDef("-----------------------------------")
@@ -226,15 +1867,25 @@ exec {installPath}/waterfox-{lowerChosenPackageType}/waterfox "$@"
                      grinningFace=grinningFace))
 
 
-def uninstall(installPath, chosenPackageType, configFilePath, removeConfigFile, printDef):
+def uninstall(installPath, chosenPackageType, configFilePath, removeConfigFile, printDef,
+              progressDef=None, profiler=None):
+    progress = progressTracker(progressDef, profiler=profiler)
+    installPath = os.path.abspath(installPath)
     lowerChosenPackageType = chosenPackageType.lower()
 
     # Remove main app directory
+    progress.startPhase("remove")
     appPath = pj(installPath, "waterfox-" + lowerChosenPackageType)
     printDef(_("Removing {appPath} directory...").format(**locals()))
-    shutil.rmtree(appPath)
+    with profileStep(profiler, "move to trash"):
+        moveToTrash(appPath, installPath)
+    with profileStep(profiler, "collect garbage"), lockedDirectory(installPath):
+        collectGarbage(installPath)
+
+    progress.endPhase()
 
     # Remove executable file
+    progress.startPhase("cleanup")
     binPath = [pj("/usr/bin", "waterfox-" + lowerChosenPackageType),
                os.path.expanduser("~/.local/bin/" + "waterfox-" + lowerChosenPackageType)]
     if os.path.exists(binPath[0]) or os.path.exists(binPath[1]):
@@ -261,8 +1912,8 @@ def uninstall(installPath, chosenPackageType, configFilePath, removeConfigFile,
         os.remove(desktopEntryPath[1])
 
     # Remove desktop shortcut
-    desktopPath = subprocess.run(['xdg-user-dir', 'DESKTOP'], check=True,
-                                 universal_newlines=True, stdout=subprocess.PIPE).stdout.strip()
+    with profileStep(profiler, "xdg-user-dir"):
+        desktopPath = desktopDirectory()
     if os.path.exists(pj(desktopPath, "waterfox-" + lowerChosenPackageType + ".desktop")):
         printDef(_("Removing desktop shortcut..."))
         os.remove(pj(desktopPath, "waterfox-" +
@@ -271,7 +1922,7 @@ def uninstall(installPath, chosenPackageType, configFilePath, removeConfigFile,
     # Remove symlinks to icons
     sizes = ["16", "22", "24", "32", "48", "128", "256"]
     iconsPath = ["/usr/share/icons/hicolor",
-                 "~/.local/share/icons/hicolor"]
+                 os.path.expanduser("~/.local/share/icons/hicolor")]
     for size in sizes:
         fileToRemove = [pj(iconsPath[0], size + "x" + size,
                            "apps/waterfox-" + lowerChosenPackageType + ".png"),
@@ -284,12 +1935,19 @@ def uninstall(installPath, chosenPackageType, configFilePath, removeConfigFile,
         if os.path.islink(fileToRemove[1]):
             printDef(_("Removing {file} ...").format(file=fileToRemove[1]))
             os.remove(fileToRemove[1])
+    if os.path.isdir(iconsPath[1]):
+        printDef(_("Refreshing icons cache..."))
+        refreshIconCache(iconsPath[1], printDef, profiler)
 
     # Remove install directory if empty
-    if not os.listdir(installPath):
+    if not [f for f in os.listdir(installPath) if f != TRASH_NAME]:
         printDef(
             _("Removing empty {installPath} directory...").format(**locals()))
-        os.rmdir(installPath)
+        with profileStep(profiler, "empty trash"):
+            emptyTrash(installPath, removeInstallPath=True)
+    else:
+        with profileStep(profiler, "empty trash"):
+            emptyTrash(installPath)
 
     # Remove config file
     if removeConfigFile == "yes" and os.path.isfile(configFilePath):
@@ -299,9 +1957,14 @@ def uninstall(installPath, chosenPackageType, configFilePath, removeConfigFile,
                                os.path.expanduser("~/.config")), "install_waterfox")
         if not os.listdir(confDir):
             os.rmdir(confDir)
+    progress.endPhase()
 
     # Finish
     printDef("-----------------------------------")
     disappointedFace = "\N{disappointed face}"
     printDef(_("Waterfox {chosenPackageType} has been uninstalled {disappointedFace}.")
              .format(chosenPackageType=chosenPackageType, disappointedFace=disappointedFace))
+
+
+if __name__ == "__main__" and len(sys.argv) > 2 and sys.argv[1] == "--empty-trash":
+    emptyTrash(sys.argv[2], "--remove-install-path" in sys.argv, wait=True)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""
+Provisioning of Waterfox into many home directories at once
+Depends: Python 3.5+
+
+Package is unpacked once into shared staging tree, which is then copied,
+hard linked or reflinked into every home directory by pool of processes.
+Everything in home directory, including wrapper, menu entry, icons and
+settings, is written by child process running as that user, so symlinks
+planted by user can't redirect writes of root. Failure of one user
+doesn't stop others.
+
+MIT License
+
+Copyright (c) 2022 hawkeye116477
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import os
+import sys
+import pwd
+import stat
+import time
+import pickle
+import importlib
+import shutil
+import tempfile
+import collections
+import multiprocessing
+import concurrent.futures
+import install_waterfox_common as installcommon
+
+pj = os.path.join
+pn = os.path.normpath
+_ = installcommon._
+
+FLEET_MODES = ("reflink", "hardlink", "copy")
+
+fleetTarget = collections.namedtuple("fleetTarget", ["name", "homePath", "uid", "gid"])
+fleetResult = collections.namedtuple("fleetResult", [
+    "target", "ok", "error", "elapsed", "methods"])
+
+
+def resolveTarget(entry):
+    """Return fleetTarget for user name or home directory"""
+    if entry.startswith("/"):
+        homePath = pn(entry)
+        homeStat = os.stat(homePath)
+        try:
+            name = pwd.getpwuid(homeStat.st_uid).pw_name
+        except KeyError:
+            name = str(homeStat.st_uid)
+        return fleetTarget(name, homePath, homeStat.st_uid, homeStat.st_gid)
+    user = pwd.getpwnam(entry)
+    return fleetTarget(user.pw_name, user.pw_dir, user.pw_uid, user.pw_gid)
+
+
+def readTargets(listPath):
+    """Return (targets, errors) from file with one user or home per line"""
+    targets = []
+    errors = []
+    with open(listPath, "r", encoding='utf-8') as listFile:
+        for line in listFile:
+            entry = line.split("#", 1)[0].strip()
+            if not entry:
+                continue
+            try:
+                targets.append(resolveTarget(entry))
+            except (KeyError, OSError) as error:
+                errors.append((entry, error))
+    return targets, errors
+
+
+def handOverTree(path, target):
+    """Give tree to target user, hard links stay shared and read-only.
+    Top directory is given last, so user can't change tree meanwhile."""
+    if os.geteuid() == target.uid:
+        return
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in dirs + files:
+            entryPath = pj(root, name)
+            entryStat = os.lstat(entryPath)
+            if stat.S_ISREG(entryStat.st_mode) and entryStat.st_nlink > 1:
+                continue
+            os.lchown(entryPath, target.uid, target.gid)
+        os.lchown(root, target.uid, target.gid)
+
+
+def runAsUser(target, func, *args):
+    """Run func in child process with uid and groups of target user and
+    return its result, so nothing in home is touched with root privileges"""
+    if os.geteuid() == target.uid:
+        return func(*args)
+    readFd, writeFd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.close(readFd)
+            try:
+                os.setgroups(os.getgrouplist(target.name, target.gid))
+            except (KeyError, OSError):
+                os.setgroups([target.gid])
+            os.setresgid(target.gid, target.gid, target.gid)
+            os.setresuid(target.uid, target.uid, target.uid)
+            try:
+                result = (True, func(*args))
+            except Exception as error:  # pylint: disable=broad-except
+                result = (False, "{}: {}".format(type(error).__name__, error))
+            with os.fdopen(writeFd, "wb") as pipe:
+                pickle.dump(result, pipe)
+            status = 0
+        finally:
+            # Don't return into code of parent process
+            os._exit(status)  # pylint: disable=protected-access
+    os.close(writeFd)
+    with os.fdopen(readFd, "rb") as pipe:
+        data = pipe.read()
+    _pid, status = os.waitpid(pid, 0)
+    if not data:
+        raise ChildProcessError("process of user {} failed with status {}".format(
+            target.name, status))
+    ok, result = pickle.loads(data)
+    if not ok:
+        raise RuntimeError(result)
+    return result
+
+
+def installForUser(sourceTreePath, sourcePath, target, chosenPackageType, mode,
+                   installPathTemplate, installDesktopShortcut, useSystemDictionaries):
+    """Put tree into home of target and integrate it, runs as target user.
+    With mode "move" sourceTreePath was already made for this user."""
+    # Process has own environment, so functions using ~ see home of target
+    os.environ["HOME"] = target.homePath
+    os.environ["XDG_CONFIG_HOME"] = pj(target.homePath, ".config")
+    os.environ["USER"] = os.environ["LOGNAME"] = target.name
+
+    installPath = installPathTemplate
+    if installPath.startswith("~"):
+        installPath = target.homePath + installPath[1:]
+    lowerChosenPackageType = chosenPackageType.lower()
+    packagePath = pj(installPath, "waterfox-" + lowerChosenPackageType)
+    os.makedirs(installPath, exist_ok=True)
+
+    methods = collections.Counter()
+    stagingPath = tempfile.mkdtemp(
+        prefix=".waterfox-" + lowerChosenPackageType + "-", dir=installPath)
+    try:
+        newPackagePath = pj(stagingPath, "waterfox-" + lowerChosenPackageType)
+        if mode == "move":
+            installcommon.moveTree(sourceTreePath, newPackagePath)
+        else:
+            methods = installcommon.materializeTree(sourceTreePath, newPackagePath, mode)
+        if os.path.isdir(packagePath):
+            installcommon.swapDirectories(newPackagePath, packagePath)
+        else:
+            os.rename(newPackagePath, packagePath)
+    finally:
+        installcommon.moveToTrash(stagingPath, installPath)
+        installcommon.emptyTrash(installPath, wait=True)
+
+    installcommon.integrateDesktop(
+        sourcePath, installPath, chosenPackageType, installDesktopShortcut,
+        lambda _text: None)
+    configFilePath = pj(os.environ["XDG_CONFIG_HOME"], "install_waterfox", "settings.conf")
+    installcommon.saveSettings(configFilePath, installPath, installDesktopShortcut,
+                               useSystemDictionaries, "no")
+    return methods
+
+
+def provisionUser(sharedPackagePath, sourcePath, target, chosenPackageType, mode,
+                  installPathTemplate, installDesktopShortcut, useSystemDictionaries):
+    """Install shared tree for one user, runs in worker process"""
+    start = time.monotonic()
+    methods = collections.Counter()
+    userStagingPath = None
+    try:
+        sourceTreePath = sharedPackagePath
+        treeMode = mode
+        if mode == "hardlink" and os.geteuid() != target.uid:
+            # Kernel lets only root link files of root (fs.protected_hardlinks),
+            # so links are made in staging directory, which user can't enter
+            # before it's handed over, and then user moves them home
+            userStagingPath = tempfile.mkdtemp(
+                prefix="user-", dir=os.path.dirname(sharedPackagePath))
+            sourceTreePath = pj(userStagingPath, os.path.basename(sharedPackagePath))
+            methods = installcommon.materializeTree(sharedPackagePath, sourceTreePath, mode)
+            handOverTree(userStagingPath, target)
+            treeMode = "move"
+        userMethods = runAsUser(target, installForUser, sourceTreePath, sourcePath, target,
+                                chosenPackageType, treeMode, installPathTemplate,
+                                installDesktopShortcut, useSystemDictionaries)
+        methods.update(userMethods)
+    except Exception as error:  # pylint: disable=broad-except
+        return fleetResult(target, False, "{}: {}".format(type(error).__name__, error),
+                           time.monotonic() - start, methods)
+    finally:
+        if userStagingPath is not None:
+            # Symlink safe removal, user owns this directory now
+            shutil.rmtree(userStagingPath, ignore_errors=True)
+    return fleetResult(target, True, None, time.monotonic() - start, methods)
+
+
+def provision(sourcePath, chosenPackageType, targets, printDef, mode="reflink",
+              installPathTemplate="~/.local/lib", installDesktopShortcut="yes",
+              useSystemDictionaries="no", workers=None, stagingDir=None):
+    """Unpack package once and install it for every target, return results"""
+    lowerChosenPackageType = chosenPackageType.lower()
+    printDef(_("Unpackaging {package} into shared staging directory...")
+             .format(package=os.path.basename(sourcePath)))
+    stagingPath = tempfile.mkdtemp(prefix="waterfox-fleet-", dir=stagingDir)
+    results = []
+    try:
+        # Users read shared tree with their own privileges
+        os.chmod(stagingPath, 0o755)
+        unpackPath, sharedPackagePath, _delta = installcommon.unpackPackage(
+            sourcePath, stagingPath, lowerChosenPackageType, printDef)
+        for f in os.listdir(unpackPath):
+            installcommon.moveTree(pj(unpackPath, f), sharedPackagePath)
+        # Same for everybody, so write it once into shared tree
+        if useSystemDictionaries == "yes":
+            installcommon.addSystemDictionaries(sharedPackagePath, printDef)
+
+        # Users can't read installer files kept in home of root, so forked
+        # workers get them already loaded
+        installcommon.desktopEntryTemplate()
+        importlib.import_module("install_waterfox_iconcache")
+        printDef(_("Installing Waterfox {chosenPackageType} for {count} users...")
+                 .format(chosenPackageType=chosenPackageType, count=len(targets)))
+        poolArgs = {}
+        if sys.version_info >= (3, 7) and sys.platform.startswith("linux"):
+            poolArgs["mp_context"] = multiprocessing.get_context("fork")
+        with concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count(),
+                                                    **poolArgs) as executor:
+            futures = [executor.submit(provisionUser, sharedPackagePath, sourcePath, target,
+                                       chosenPackageType, mode, installPathTemplate,
+                                       installDesktopShortcut, useSystemDictionaries)
+                       for target in targets]
+            for target, future in zip(targets, futures):
+                try:
+                    result = future.result()
+                except Exception as error:  # pylint: disable=broad-except
+                    # Worker process died
+                    result = fleetResult(target, False, "{}: {}".format(
+                        type(error).__name__, error), 0.0, collections.Counter())
+                printDef("{} {} ({:.1f} s)".format(
+                    "OK    " if result.ok else "FAILED", target.name, result.elapsed))
+                results.append(result)
+    finally:
+        installcommon.removeTree(stagingPath)
+    return results
+
+
+def summary(results, skipped=()):
+    """Return text report about provisioned users"""
+    lines = ["-----------------------------------"]
+    failed = [result for result in results if not result.ok]
+    methods = collections.Counter()
+    for result in results:
+        methods.update(result.methods)
+    lines.append(_("Installed for {ok} of {total} users.").format(
+        ok=len(results) - len(failed), total=len(results) + len(skipped)))
+    if methods:
+        lines.append(_("Files: {methods}").format(methods=", ".join(
+            "{} {}".format(count, method) for method, count in methods.most_common())))
+    for entry, error in skipped:
+        lines.append(_("Skipped {user}: {error}").format(user=entry, error=error))
+    for result in failed:
+        lines.append(_("Failed for {user} ({home}): {error}").format(
+            user=result.target.name, home=result.target.homePath, error=result.error))
+    return "\n".join(lines)
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""
+Icon theme cache writer for installer scripts for Waterfox
+Depends: Python 3.5+
+
+Writes icon-theme.cache in format of gtk-update-icon-cache (version 1.0,
+without image data), so installer doesn't need that tool. Theme is walked
+and hash tables are laid out in the same order as that tool does it, so
+cache is the same byte for byte. Cache is only written again when some
+directory of theme changed since it was written.
+
+MIT License
+
+Copyright (c) 2022 hawkeye116477
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import os
+import sys
+import time
+import fcntl
+import struct
+import tempfile
+
+pj = os.path.join
+
+CACHE_NAME = "icon-theme.cache"
+HEADER = struct.Struct(">HHII")
+ICON = struct.Struct(">III")
+IMAGE = struct.Struct(">HHI")
+CARD32 = struct.Struct(">I")
+MAJOR_VERSION = 1
+MINOR_VERSION = 0
+NO_OFFSET = 0xFFFFFFFF
+
+HAS_SUFFIX_XPM = 1
+HAS_SUFFIX_SVG = 2
+HAS_SUFFIX_PNG = 4
+HAS_ICON_FILE = 8
+SUFFIXES = ((b".png", HAS_SUFFIX_PNG), (b".svg", HAS_SUFFIX_SVG),
+            (b".xpm", HAS_SUFFIX_XPM), (b".icon", HAS_ICON_FILE))
+
+# g_spaced_primes_closest() of GLib picks number of hash buckets from these
+SPACED_PRIMES = (11, 19, 37, 73, 109, 163, 251, 367, 557, 823, 1237, 1861, 2777,
+                 4177, 6247, 9371, 14057, 21089, 31627, 47431, 71143, 106721,
+                 160073, 240101, 360163, 540217, 810343, 1215497, 1823231,
+                 2734867, 4102283, 6153409, 9230113, 13845163)
+# Sizes of GHashTable of GLib are powers of two, these primes are used
+# for spreading hashes over them
+PRIME_MOD = (1, 2, 3, 7, 13, 31, 61, 127, 251, 509, 1021, 2039, 4093, 8191, 16381,
+             32749, 65521, 131071, 262139, 524287, 1048573, 2097143, 4194301, 8388593,
+             16777213, 33554393, 67108859, 134217689, 268435399, 536870909, 1073741789,
+             2147483647)
+HASH_TABLE_MIN_SHIFT = 3
+# Timestamps of filesystems come from coarse clock, which lags behind
+# time.time() by up to one tick
+TIMESTAMP_MARGIN = 0.05
+
+
+def iconNameHash(name):
+    """Same hash as icon_name_hash() of GTK, which works on signed chars"""
+    h = 0
+    for i, char in enumerate(name):
+        if char > 127:
+            char -= 256
+        h = char if i == 0 else (h << 5) - h + char
+        h &= 0xFFFFFFFF
+    return h
+
+
+def strHash(string):
+    """Same hash as g_str_hash() of GLib, which works on signed chars"""
+    h = 5381
+    for char in string:
+        if char > 127:
+            char -= 256
+        h = (h * 33 + char) & 0xFFFFFFFF
+    return h
+
+
+class glibHashTable:
+    """Keys of GHashTable of GLib 2.60+, in order of iteration over it
+
+    gtk-update-icon-cache collects icons in such tables and order of
+    iteration decides order of icons in the cache. Only insertions are
+    supported, as the tool doesn't remove anything before iterating.
+    """
+
+    def __init__(self):
+        self.setShift(HASH_TABLE_MIN_SHIFT)
+        self.hashes = [0] * self.size
+        self.keys = [None] * self.size
+        self.nnodes = 0
+
+    def setShift(self, shift):
+        self.size = 1 << shift
+        self.mod = PRIME_MOD[shift]
+        self.mask = self.size - 1
+
+    def hashToIndex(self, hashValue):
+        return (hashValue * 11 & 0xFFFFFFFF) % self.mod
+
+    def insert(self, key):
+        """Add key, return False if it was there already"""
+        # Values 0 and 1 mark unused and removed buckets
+        hashValue = max(strHash(key), 2)
+        index = self.hashToIndex(hashValue)
+        step = 0
+        while self.hashes[index]:
+            if self.hashes[index] == hashValue and self.keys[index] == key:
+                return False
+            step += 1
+            index = (index + step) & self.mask
+        self.hashes[index] = hashValue
+        self.keys[index] = key
+        self.nnodes += 1
+        if self.size <= self.nnodes + self.nnodes // 16:
+            self.resize()
+        return True
+
+    def resize(self):
+        """Rehash in place, like g_hash_table_resize() does"""
+        oldSize = self.size
+        self.setShift(max(int(self.nnodes * 1.333).bit_length(), HASH_TABLE_MIN_SHIFT))
+        self.hashes += [0] * (self.size - oldSize)
+        self.keys += [None] * (self.size - oldSize)
+        relocated = [False] * self.size
+        for i in range(oldSize):
+            nodeHash = self.hashes[i]
+            if not nodeHash or relocated[i]:
+                continue
+            self.hashes[i] = 0
+            key, self.keys[i] = self.keys[i], None
+            while True:
+                index = self.hashToIndex(nodeHash)
+                step = 0
+                while relocated[index]:
+                    step += 1
+                    index = (index + step) & self.mask
+                relocated[index] = True
+                replacedHash = self.hashes[index]
+                self.hashes[index] = nodeHash
+                if not replacedHash:
+                    self.keys[index] = key
+                    break
+                # Evicted entry is moved to its new bucket next
+                nodeHash = replacedHash
+                key, self.keys[index] = self.keys[index], key
+
+    def __iter__(self):
+        return (key for key in self.keys if key is not None)
+
+
+def spacedPrimesClosest(number):
+    for prime in SPACED_PRIMES:
+        if prime > number:
+            return prime
+    return SPACED_PRIMES[-1]
+
+
+def paddedString(string):
+    """NUL terminated string aligned to 4 bytes"""
+    return string + b"\0" * (4 - len(string) % 4)
+
+
+def serializeCache(directories, icons):
+    """Return icon-theme.cache content
+
+    directories is list of paths relative to theme, icons is list of
+    (icon name, list of (directory index, flags)) in order in which
+    gtk-update-icon-cache iterates over them. Layout follows write_file()
+    of that tool, image data isn't included (like its default).
+    """
+    size = spacedPrimesClosest(len(icons) // 3)
+    buckets = [[] for _ in range(size)]
+    for name, images in icons:
+        buckets[iconNameHash(name) % size].insert(0, (name, images))
+
+    out = bytearray(HEADER.size + CARD32.size * (size + 1))
+    CARD32.pack_into(out, HEADER.size, size)
+    bucketOffsets = [NO_OFFSET] * size
+    strings = {}
+    for index, chain in enumerate(buckets):
+        for position, (name, images) in enumerate(chain):
+            offset = len(out)
+            if position == 0:
+                bucketOffsets[index] = offset
+            nextOffset = offset + ICON.size
+            nameOffset = strings.get(name)
+            if nameOffset is None:
+                nameOffset = strings[name] = nextOffset
+                nextOffset += len(paddedString(name))
+            imageListOffset = nextOffset
+            nextOffset += CARD32.size + IMAGE.size * len(images)
+            out += ICON.pack(nextOffset if position < len(chain) - 1 else NO_OFFSET,
+                             nameOffset, imageListOffset)
+            if nameOffset == offset + ICON.size:
+                out += paddedString(name)
+            out += CARD32.pack(len(images))
+            for dirIndex, flags in images:
+                out += IMAGE.pack(dirIndex, flags, 0)
+    struct.pack_into(">{}I".format(size), out, HEADER.size + CARD32.size, *bucketOffsets)
+
+    # Directory names may share strings with icon names
+    dirListOffset = len(out)
+    stringOffset = dirListOffset + CARD32.size * (len(directories) + 1)
+    newStrings = []
+    out += CARD32.pack(len(directories))
+    for directory in directories:
+        if directory not in strings:
+            strings[directory] = stringOffset
+            newStrings.append(directory)
+            stringOffset += len(paddedString(directory))
+        out += CARD32.pack(strings[directory])
+    for directory in newStrings:
+        out += paddedString(directory)
+    HEADER.pack_into(out, 0, MAJOR_VERSION, MINOR_VERSION, HEADER.size, dirListOffset)
+    return bytes(out)
+
+
+def readString(data, offset):
+    return data[offset:data.index(b"\0", offset)]
+
+
+def parseCache(data):
+    """Return (directories, icons) from icon-theme.cache content
+
+    Raise ValueError if content isn't valid cache of version 1.0.
+    """
+    try:
+        major, minor, hashOffset, dirListOffset = HEADER.unpack_from(data, 0)
+        if (major, minor) != (MAJOR_VERSION, MINOR_VERSION):
+            raise ValueError("Unsupported icon cache version {}.{}".format(major, minor))
+        dirCount, = CARD32.unpack_from(data, dirListOffset)
+        directories = [readString(data, offset) for offset in struct.unpack_from(
+            ">{}I".format(dirCount), data, dirListOffset + CARD32.size)]
+        size, = CARD32.unpack_from(data, hashOffset)
+        icons = {}
+        for offset in struct.unpack_from(">{}I".format(size), data, hashOffset + CARD32.size):
+            visited = set()
+            while offset != NO_OFFSET:
+                if offset in visited:
+                    raise ValueError("Loop in icon cache hash chain")
+                visited.add(offset)
+                offset, nameOffset, imageListOffset = ICON.unpack_from(data, offset)
+                imageCount, = CARD32.unpack_from(data, imageListOffset)
+                images = []
+                for i in range(imageCount):
+                    dirIndex, flags, _imageDataOffset = IMAGE.unpack_from(
+                        data, imageListOffset + CARD32.size + i * IMAGE.size)
+                    if dirIndex >= dirCount:
+                        raise ValueError("Wrong directory index in icon cache")
+                    images.append((dirIndex, flags))
+                icons[readString(data, nameOffset)] = images
+    except struct.error as error:
+        raise ValueError("Truncated icon cache") from error
+    return directories, icons
+
+
+def readIconCache(cachePath):
+    with open(cachePath, "rb") as cacheFile:
+        return parseCache(cacheFile.read())
+
+
+def listDirectory(path):
+    """Return DirEntry objects of directory sorted by name"""
+    entries = os.scandir(path)
+    try:
+        return sorted(entries, key=lambda entry: entry.name)
+    finally:
+        # Python 3.5 closes iterator only when it's exhausted
+        if hasattr(entries, "close"):
+            entries.close()
+
+
+class themeScanner:
+    """Walk theme like scan_directory() of gtk-update-icon-cache does
+
+    Entries are visited sorted by name, subdirectories at once when they
+    come. Directory gets its index when first image is found in it, so it
+    isn't listed if it has none. Images of toplevel directory, entries which
+    can't be stat'ed (dangling symlinks) or aren't regular files are left out.
+    """
+
+    def __init__(self, themePath):
+        self.themePath = os.fsencode(themePath)
+        self.directories = []
+        self.files = glibHashTable()
+        self.images = {}
+        # Newest mtime of all directories of theme
+        self.mtime = 0
+
+    def scan(self, directory=b"", ancestors=()):
+        path = pj(self.themePath, directory)
+        try:
+            dirStat = os.stat(path)
+            entries = listDirectory(path)
+        except OSError:
+            return
+        # Symlink to parent directory would make endless loop
+        dirId = (dirStat.st_dev, dirStat.st_ino)
+        if dirId in ancestors:
+            return
+        ancestors += (dirId,)
+        self.mtime = max(self.mtime, dirStat.st_mtime_ns)
+        dirHash = glibHashTable()
+        flags = {}
+        dirIndex = None
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    self.scan(pj(directory, entry.name), ancestors)
+                    continue
+                if not directory or not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            for suffix, flag in SUFFIXES:
+                if entry.name.endswith(suffix):
+                    name = entry.name[:-len(suffix)]
+                    if dirHash.insert(name):
+                        if dirIndex is None:
+                            dirIndex = len(self.directories)
+                            self.directories.append(directory)
+                        flags[name] = 0
+                    flags[name] |= flag
+                    break
+        for name in dirHash:
+            # Icon which has nothing but .icon file is thrown away
+            if flags[name] != HAS_ICON_FILE:
+                self.files.insert(name)
+                self.images.setdefault(name, []).insert(0, (dirIndex, flags[name]))
+
+    def icons(self):
+        return [(name, self.images[name]) for name in self.files]
+
+
+def updateIconCache(themePath, force=False):
+    """Write icon-theme.cache of theme, like gtk-update-icon-cache -t
+
+    Return True if cache was written, False if no directory was modified
+    after it was.
+    """
+    # Installers of several editions may refresh the same theme at once,
+    # writer which listed directories earlier would drop icons of the other
+    themeFd = os.open(themePath, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        fcntl.flock(themeFd, fcntl.LOCK_EX)
+        return writeIconCache(themePath, force)
+    finally:
+        os.close(themeFd)
+
+
+def writeIconCache(themePath, force):
+    cachePath = pj(themePath, CACHE_NAME)
+    # Directory modified during the walk could get the same mtime as cache
+    # written after it, so cache gets time from before the walk
+    cacheTime = int((time.time() - TIMESTAMP_MARGIN) * 1e9)
+    scanner = themeScanner(themePath)
+    scanner.scan()
+    try:
+        cacheMtime = os.stat(cachePath).st_mtime_ns
+        with open(cachePath, "rb") as cacheFile:
+            oldData = cacheFile.read()
+    except OSError:
+        cacheMtime, oldData = None, None
+    # Every directory is compared, one without images isn't in the cache,
+    # but it gets images when edition is installed again
+    if not force and cacheMtime is not None and scanner.mtime <= cacheMtime:
+        return False
+
+    data = serializeCache(scanner.directories, scanner.icons())
+    if data == oldData:
+        os.utime(cachePath, ns=(cacheTime, cacheTime))
+    else:
+        fd, tempPath = tempfile.mkstemp(prefix="." + CACHE_NAME + "-", dir=themePath)
+        try:
+            with os.fdopen(fd, "wb") as cacheFile:
+                cacheFile.write(data)
+            os.chmod(tempPath, 0o644)
+            os.utime(tempPath, ns=(cacheTime, cacheTime))
+            os.replace(tempPath, cachePath)
+        except BaseException:
+            if os.path.exists(tempPath):
+                os.remove(tempPath)
+            raise
+    # GTK ignores cache older than theme directory, which rename just touched
+    themeStat = os.stat(themePath)
+    os.utime(themePath, ns=(themeStat.st_atime_ns, cacheTime))
+    return True
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        updateIconCache(path, force=True)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""
+Prewarming of page cache for the first launch of Waterfox
+Depends: Python 3.5+
+
+Freshly installed files aren't in page cache, so the first launch reads
+libxul.so and omni.ja with random I/O, which is very slow on HDD.
+Files from hot list of edition are read ahead sequentially by background
+daemon threads, as much as fits into available memory, installer doesn't
+wait for them when it exits. Hot list is recorded from one real launch,
+default one is used until then.
+
+MIT License
+
+Copyright (c) 2022 hawkeye116477
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import os
+import json
+import time
+import queue
+import signal
+import tempfile
+import threading
+import subprocess
+import install_waterfox_common as installcommon
+
+pj = os.path.join
+_ = installcommon._
+
+# Files read by every launch, in order of first use
+HOT_FILES = ["waterfox", "waterfox-bin", "dependentlibs.list", "application.ini",
+             "platform.ini", "liblgpllibs.so", "libmozsandbox.so", "libmozgtk.so",
+             "libmozwayland.so", "libnspr4.so", "libplc4.so", "libplds4.so", "libnssutil3.so",
+             "libnss3.so", "libsmime3.so", "libssl3.so", "libmozsqlite3.so", "libxul.so",
+             "omni.ja", "browser/omni.ja", "libsoftokn3.so", "libfreeblpriv3.so",
+             "libmozavutil.so", "libmozavcodec.so"]
+WORKERS = 4
+# Part of available memory which may be filled with prewarmed files
+MEMORY_SHARE = 0.5
+CHUNK_SIZE = 1024 * 1024
+RECORD_SECONDS = 15
+
+
+def hotListPath(chosenPackageType):
+    return pj(os.getenv('XDG_CACHE_HOME', os.path.expanduser("~/.cache")),
+              "install_waterfox", "prewarm", "waterfox-" + chosenPackageType.lower() + ".json")
+
+
+def loadHotList(chosenPackageType):
+    """Return recorded hot list of edition, or default one"""
+    try:
+        with open(hotListPath(chosenPackageType), "r", encoding='utf-8') as hotListFile:
+            return json.load(hotListFile)["files"]
+    except (OSError, ValueError, KeyError):
+        return list(HOT_FILES)
+
+
+def saveHotList(chosenPackageType, hotFiles):
+    path = hotListPath(chosenPackageType)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".new", "w", encoding='utf-8') as hotListFile:
+        json.dump({"files": hotFiles}, hotListFile, indent=1)
+    os.replace(path + ".new", path)
+
+
+def availableMemory():
+    """Return bytes of memory which can be used without swapping"""
+    try:
+        with open("/proc/meminfo", "r", encoding='utf-8') as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def planPrewarm(packagePath, hotFiles, budget):
+    """Return list of (path, size) of hot files which fit into budget"""
+    files = []
+    seen = set()
+    for name in hotFiles:
+        path = os.path.normpath(pj(packagePath, name))
+        if path in seen:
+            continue
+        seen.add(path)
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            continue
+        if not os.path.isfile(path) or size > budget:
+            continue
+        files.append((path, size))
+        budget -= size
+    return files
+
+
+def prewarmFile(path, buffer):
+    """Bring whole file into page cache, return number of bytes read"""
+    bytesRead = 0
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            # Kernel starts large sequential reads at once,
+            # reading below then mostly waits for them
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            bytesRead += count
+    return bytesRead
+
+
+class prewarmer:
+    """Read files into page cache by background threads
+
+    Threads are daemonic, so installer exits as soon as it's done and
+    reading of files which didn't make it in time is dropped.
+    """
+
+    def __init__(self, files, workers=WORKERS):
+        self.bytesTotal = sum(size for _path, size in files)
+        self.bytesRead = 0
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.startTime = time.monotonic()
+        self.endTime = None
+        self.remaining = len(files)
+        # Files are taken in order of first use by Waterfox
+        self.paths = queue.Queue()
+        for path, _size in files:
+            self.paths.put(path)
+        if not files:
+            self.endTime = self.startTime
+            self.finished.set()
+        for _i in range(min(workers, len(files))):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def work(self):
+        buffer = bytearray(CHUNK_SIZE)
+        while True:
+            try:
+                path = self.paths.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                bytesRead = prewarmFile(path, buffer)
+            except OSError:
+                # File could be removed by next update meanwhile
+                bytesRead = 0
+            with self.lock:
+                self.bytesRead += bytesRead
+                self.remaining -= 1
+                if not self.remaining:
+                    self.endTime = time.monotonic()
+                    self.finished.set()
+
+    def done(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        """Wait until files are read, return True if all are"""
+        return self.finished.wait(timeout)
+
+    def elapsed(self):
+        return (self.endTime or time.monotonic()) - self.startTime
+
+
+def prewarm(packagePath, chosenPackageType, printDef, workers=WORKERS,
+            memoryShare=MEMORY_SHARE):
+    """Start reading hot files of installed edition in background,
+    return prewarmer or None if nothing fits into memory"""
+    budget = int(availableMemory() * memoryShare)
+    files = planPrewarm(packagePath, loadHotList(chosenPackageType), budget)
+    if not files:
+        return None
+    warmer = prewarmer(files, workers)
+    printDef(_("Loading {size:.1f} MiB of files needed by first launch in background...")
+             .format(size=warmer.bytesTotal / 1048576))
+    return warmer
+
+
+def processGroupPids(pgid):
+    """Return pids of processes in process group pgid"""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(pj("/proc", entry, "stat"), "r", encoding='utf-8') as stat:
+                # Name in brackets can contain spaces
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[2]) == pgid:
+            pids.append(entry)
+    return pids
+
+
+def collectUsedFiles(pid, rootPath, used):
+    """Add files under rootPath mapped or opened by pid into used dict"""
+    paths = []
+    try:
+        with open(pj("/proc", pid, "maps"), "r", encoding='utf-8',
+                  errors="surrogateescape") as maps:
+            for line in maps:
+                fields = line.split(None, 5)
+                if len(fields) == 6:
+                    paths.append(fields[5].rstrip("\n"))
+        fdPath = pj("/proc", pid, "fd")
+        for fd in os.listdir(fdPath):
+            try:
+                paths.append(os.readlink(pj(fdPath, fd)))
+            except OSError:
+                pass
+    except OSError:
+        return
+    for path in paths:
+        if path.startswith(rootPath + "/"):
+            used.setdefault(os.path.relpath(path, rootPath), None)
+
+
+def recordLaunch(packagePath, seconds=RECORD_SECONDS, interval=0.05, command=None):
+    """Launch Waterfox with temporary profile and return files from
+    packagePath which it maps or opens, in order of first use"""
+    rootPath = os.path.realpath(packagePath)
+    used = {}
+    with tempfile.TemporaryDirectory(prefix="waterfox-prewarm-") as profilePath:
+        if command is None:
+            command = [pj(packagePath, "waterfox"), "--no-remote", "--profile", profilePath,
+                       "about:blank"]
+            if not os.getenv("DISPLAY") and not os.getenv("WAYLAND_DISPLAY"):
+                command.append("--headless")
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL, start_new_session=True)
+        try:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline and process.poll() is None:
+                for pid in processGroupPids(process.pid):
+                    collectUsedFiles(pid, rootPath, used)
+                time.sleep(interval)
+        finally:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+                process.wait(5)
+            except ProcessLookupError:
+                pass
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+    return list(used)
+
+
+def recordHotList(packagePath, chosenPackageType, printDef, seconds=RECORD_SECONDS):
+    """Record hot list of edition from one launch of installed Waterfox"""
+    printDef(_("Launching Waterfox {chosenPackageType} for {seconds} seconds to record "
+               "files needed by first launch...").format(chosenPackageType=chosenPackageType,
+                                                         seconds=seconds))
+    hotFiles = recordLaunch(packagePath, seconds)
+    if hotFiles:
+        saveHotList(chosenPackageType, hotFiles)
+    printDef(_("Recorded {count} files used by Waterfox {chosenPackageType}.")
+             .format(count=len(hotFiles), chosenPackageType=chosenPackageType))
+    return hotFiles
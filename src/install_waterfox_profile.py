@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""
+Profiler of installer scripts for Waterfox
+Depends: Python 3.5+ (counting of operations needs 3.8+)
+
+Times phases and steps of install/uninstall, counts subprocesses and
+filesystem operations through audit hooks and optionally captures cProfile
+and tracemalloc data. Report is plain text, so it can be attached to bug
+reports.
+
+MIT License
+
+Copyright (c) 2022 hawkeye116477
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import os
+import io
+import sys
+import time
+import platform
+import threading
+import contextlib
+import collections
+
+# Audit events counted as filesystem operations
+FS_EVENTS = frozenset(["open", "os.chmod", "os.link", "os.listdir", "os.mkdir", "os.remove",
+                       "os.rename", "os.rmdir", "os.scandir", "os.symlink", "os.truncate",
+                       "os.utime", "shutil.copyfile", "shutil.copytree", "shutil.move",
+                       "shutil.rmtree", "tempfile.mkdtemp"])
+
+# Audit hooks can't be removed, so single hook feeds running profilers
+runningProfilers = []
+hookInstalled = False
+hookLock = threading.Lock()
+
+
+def auditHook(event, args):
+    if not runningProfilers:
+        return
+    if event == "subprocess.Popen" or event in FS_EVENTS:
+        for profiler in runningProfilers:
+            profiler.count(event, args)
+
+
+class profiler:
+    """Measure phases and steps of install/uninstall, count operations"""
+
+    def __init__(self, captureCProfile=False, captureMemory=False):
+        self.captureCProfile = captureCProfile
+        self.captureMemory = captureMemory
+        self.cProfile = None
+        self.memorySnapshot = None
+        self.memoryPeak = 0
+        self.phase = None
+        self.phaseStart = None
+        self.timings = collections.OrderedDict()
+        self.counts = collections.defaultdict(collections.Counter)
+        self.commands = []
+        self.info = collections.OrderedDict()
+        self.startTime = None
+        self.cpuStart = None
+        self.total = None
+        self.cpuTotal = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        global hookInstalled
+        with hookLock:
+            if not hookInstalled and hasattr(sys, "addaudithook"):
+                sys.addaudithook(auditHook)
+                hookInstalled = True
+            runningProfilers.append(self)
+        if self.captureMemory:
+            import tracemalloc
+            tracemalloc.start(10)
+        if self.captureCProfile:
+            import cProfile
+            self.cProfile = cProfile.Profile()
+            self.cProfile.enable()
+        self.startTime = time.perf_counter()
+        self.cpuStart = time.process_time()
+
+    def stop(self):
+        self.total = time.perf_counter() - self.startTime
+        self.cpuTotal = time.process_time() - self.cpuStart
+        if self.cProfile is not None:
+            self.cProfile.disable()
+        if self.captureMemory:
+            import tracemalloc
+            self.memoryPeak = tracemalloc.get_traced_memory()[1]
+            self.memorySnapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        with hookLock:
+            if self in runningProfilers:
+                runningProfilers.remove(self)
+
+    def key(self, name):
+        return name if self.phase is None else self.phase + "/" + name
+
+    def add(self, key, elapsed):
+        with self.lock:
+            calls, total = self.timings.get(key, (0, 0.0))
+            self.timings[key] = (calls + 1, total + elapsed)
+
+    def startPhase(self, phase):
+        self.phase = phase
+        # Keep phase before its steps in report
+        with self.lock:
+            self.timings.setdefault(phase, (0, 0.0))
+        self.phaseStart = time.perf_counter()
+
+    def endPhase(self):
+        if self.phase is not None:
+            phase = self.phase
+            self.phase = None
+            self.add(phase, time.perf_counter() - self.phaseStart)
+
+    @contextlib.contextmanager
+    def step(self, name):
+        """Time block of code as step of current phase"""
+        key = self.key(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(key, time.perf_counter() - start)
+
+    def count(self, event, args):
+        with self.lock:
+            self.counts[self.phase or "-"][event] += 1
+            if event == "subprocess.Popen":
+                command = args[1] if len(args) > 1 else args[0]
+                if not isinstance(command, (str, bytes)):
+                    command = " ".join(str(arg) for arg in command)
+                self.commands.append((self.phase or "-", str(command)))
+
+    def report(self):
+        """Return text report, suitable for attaching to bug report"""
+        out = io.StringIO()
+        out.write("install_waterfox profile\n")
+        out.write("Python {} on {}\n".format(platform.python_version(), platform.platform()))
+        out.write("CPUs: {}\n".format(os.cpu_count()))
+        for name, value in self.info.items():
+            out.write("{}: {}\n".format(name, value))
+        if self.total is not None:
+            out.write("Total: {:.3f} s wall, {:.3f} s CPU\n".format(self.total, self.cpuTotal))
+
+        out.write("\nTimings:\n")
+        for key, (calls, total) in self.timings.items():
+            indent = "  " * (key.count("/") + 1)
+            out.write("{}{:<{width}} {:>9.3f} s{}\n".format(
+                indent, key.rsplit("/", 1)[-1], total,
+                " ({} calls)".format(calls) if calls > 1 else "",
+                width=40 - len(indent)))
+
+        out.write("\nOperations:\n")
+        if not hasattr(sys, "addaudithook"):
+            out.write("  not available (Python 3.8+ is required)\n")
+        for phase, counter in self.counts.items():
+            out.write("  {}:\n".format(phase))
+            for event, number in counter.most_common():
+                out.write("    {:<30} {:>8}\n".format(event, number))
+
+        if self.commands:
+            out.write("\nSubprocesses:\n")
+            for phase, command in self.commands:
+                out.write("  [{}] {}\n".format(phase, command))
+
+        if self.memorySnapshot is not None:
+            out.write("\nMemory: peak {:.1f} MiB traced by Python\n".format(
+                self.memoryPeak / 1048576))
+            for statistic in self.memorySnapshot.statistics("lineno")[:20]:
+                out.write("  {}\n".format(statistic))
+
+        if self.cProfile is not None:
+            import pstats
+            out.write("\nCPU profile (main thread):\n")
+            stats = pstats.Stats(self.cProfile, stream=out)
+            stats.sort_stats("cumulative").print_stats(40)
+        return out.getvalue()
+
+    def writeReport(self, path):
+        with open(path, "w", encoding='utf-8') as reportFile:
+            reportFile.write(self.report())
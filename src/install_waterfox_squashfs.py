@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""
+SquashFS reader for installer scripts for Waterfox
+Depends: Python 3.5+
+
+Extracts files straight from SquashFS image embedded in AppImage,
+so AppImage doesn't need to be executable or run with --appimage-extract.
+Only SquashFS 4.0 with gzip, xz/lzma or zstd compression is supported.
+
+MIT License
+
+Copyright (c) 2022 hawkeye116477
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import os
+import struct
+import zlib
+import lzma
+import threading
+import concurrent.futures
+
+pj = os.path.join
+
+SQUASHFS_MAGIC = b"hsqs"
+SUPERBLOCK = struct.Struct("<IIIIIHHHHHHQQQQQQQQ")
+INODE_HEADER = struct.Struct("<HHHHII")
+NO_FRAGMENT = 0xFFFFFFFF
+UNCOMPRESSED_METADATA = 0x8000
+UNCOMPRESSED_DATA = 0x1000000
+MAX_BLOCK_SIZE = 1024 * 1024
+
+DIR_TYPES = (1, 8)
+FILE_TYPES = (2, 9)
+SYMLINK_TYPES = (3, 10)
+
+
+def zstdDecompressor():
+    """Return zstd decompression function if any zstd module is available"""
+    try:
+        from compression import zstd  # pylint: disable=import-outside-toplevel
+        return zstd.decompress
+    except ImportError:
+        pass
+    try:
+        import zstandard  # pylint: disable=import-outside-toplevel
+        return lambda data: zstandard.ZstdDecompressor().decompress(
+            data, max_output_size=MAX_BLOCK_SIZE)
+    except ImportError:
+        return None
+
+
+def decompressors():
+    """Map SquashFS compression id to function"""
+    result = {1: zlib.decompress, 2: lzma.decompress, 4: lzma.decompress}
+    zstdDecompress = zstdDecompressor()
+    if zstdDecompress is not None:
+        result[6] = zstdDecompress
+    return result
+
+
+def findImageOffset(fd):
+    """Return offset of SquashFS image, which starts right after ELF runtime"""
+    header = os.pread(fd, 64, 0)
+    if header[:4] == SQUASHFS_MAGIC:
+        return 0
+    if header[:4] != b"\x7fELF":
+        raise OSError("Not an AppImage or SquashFS image")
+    endian = "<" if header[5] == 1 else ">"
+    if header[4] == 2:
+        shoff, = struct.unpack(endian + "Q", header[0x28:0x30])
+        shentsize, shnum = struct.unpack(endian + "HH", header[0x3A:0x3E])
+    else:
+        shoff, = struct.unpack(endian + "I", header[0x20:0x24])
+        shentsize, shnum = struct.unpack(endian + "HH", header[0x2E:0x32])
+    offset = shoff + shentsize * shnum
+    if os.pread(fd, 4, offset) != SQUASHFS_MAGIC:
+        raise OSError("SquashFS image not found after ELF runtime")
+    return offset
+
+
+class squashfsImage:
+    """Read-only access to SquashFS image"""
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDONLY)
+        try:
+            self.offset = findImageOffset(self.fd)
+            (_magic, _inodeCount, _mtime, self.blockSize, self.fragmentCount,
+             self.compression, _blockLog, _flags, _idCount, major, _minor,
+             self.rootInode, _bytesUsed, _idTable, _xattrTable, self.inodeTable,
+             self.directoryTable, self.fragmentTable, _exportTable) = SUPERBLOCK.unpack(
+                 os.pread(self.fd, SUPERBLOCK.size, self.offset))
+            if major != 4:
+                raise OSError("Unsupported SquashFS version {}".format(major))
+        except OSError:
+            os.close(self.fd)
+            raise
+        self.decompress = decompressors().get(self.compression)
+        self.metadataCache = {}
+        self.fragments = None
+        self.fragmentCache = {}
+        self.fragmentLock = threading.Lock()
+        self.bytesRead = 0
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+    def isSupported(self):
+        return self.decompress is not None
+
+    def pread(self, size, position):
+        data = os.pread(self.fd, size, self.offset + position)
+        self.bytesRead += len(data)
+        if len(data) != size:
+            raise OSError("Unexpected end of SquashFS image")
+        return data
+
+    def metadataBlock(self, position):
+        """Return decompressed metadata block and position of next one"""
+        if position not in self.metadataCache:
+            header, = struct.unpack("<H", self.pread(2, position))
+            size = header & ~UNCOMPRESSED_METADATA
+            data = self.pread(size, position + 2)
+            if not header & UNCOMPRESSED_METADATA:
+                data = self.decompress(data)
+            self.metadataCache[position] = (data, position + 2 + size)
+        return self.metadataCache[position]
+
+    def readMetadata(self, position, offset, size):
+        """Read metadata spanning blocks, return it and position after it"""
+        chunks = []
+        while size > 0:
+            data, nextPosition = self.metadataBlock(position)
+            chunk = data[offset:offset + size]
+            chunks.append(chunk)
+            size -= len(chunk)
+            offset += len(chunk)
+            if offset >= len(data):
+                position, offset = nextPosition, 0
+        return b"".join(chunks), position, offset
+
+    def readInode(self, reference):
+        """Return dictionary with inode at reference (block << 16 | offset)"""
+        position = self.inodeTable + (reference >> 16)
+        offset = reference & 0xFFFF
+        data, position, offset = self.readMetadata(
+            position, offset, INODE_HEADER.size)
+        inodeType, mode, _uid, _gid, mtime, _number = INODE_HEADER.unpack(data)
+        inode = {"type": inodeType, "mode": mode, "mtime": mtime}
+
+        def read(fmt):
+            nonlocal position, offset
+            size = struct.calcsize(fmt)
+            data, position, offset = self.readMetadata(position, offset, size)
+            return struct.unpack(fmt, data)
+
+        if inodeType == 1:
+            block, _links, size, blockOffset, _parent = read("<IIHHI")
+            inode.update(dirBlock=block, dirOffset=blockOffset, size=size)
+        elif inodeType == 8:
+            _links, size, block, _parent, _indexCount, blockOffset, _xattr = read("<IIIIHHI")
+            inode.update(dirBlock=block, dirOffset=blockOffset, size=size)
+        elif inodeType in FILE_TYPES:
+            if inodeType == 2:
+                start, fragment, fragmentOffset, size = read("<IIII")
+            else:
+                start, size, _sparse, _links, fragment, fragmentOffset, _xattr = read(
+                    "<QQQIIII")
+            count = size // self.blockSize
+            if fragment == NO_FRAGMENT and size % self.blockSize:
+                count += 1
+            inode.update(start=start, size=size, fragment=fragment,
+                         fragmentOffset=fragmentOffset,
+                         blockSizes=read("<{}I".format(count)) if count else ())
+        elif inodeType in SYMLINK_TYPES:
+            _links, targetSize = read("<II")
+            target, position, offset = self.readMetadata(position, offset, targetSize)
+            inode["target"] = os.fsdecode(target)
+        return inode
+
+    def listDirectory(self, inode):
+        """Return list of (name, inode reference) in directory"""
+        entries = []
+        position = self.directoryTable + inode["dirBlock"]
+        offset = inode["dirOffset"]
+        # Size includes 3 bytes for implicit "." and ".." entries
+        remaining = inode["size"] - 3
+        while remaining > 0:
+            data, position, offset = self.readMetadata(position, offset, 12)
+            count, start, _number = struct.unpack("<III", data)
+            remaining -= 12
+            for _i in range(count + 1):
+                data, position, offset = self.readMetadata(position, offset, 8)
+                inodeOffset, _delta, _type, nameSize = struct.unpack("<HhHH", data)
+                name, position, offset = self.readMetadata(
+                    position, offset, nameSize + 1)
+                remaining -= 8 + nameSize + 1
+                entries.append((os.fsdecode(name), start << 16 | inodeOffset))
+        return entries
+
+    def lookup(self, path):
+        """Return inode of path inside image"""
+        inode = self.readInode(self.rootInode)
+        for part in [p for p in path.split("/") if p]:
+            if inode["type"] not in DIR_TYPES:
+                raise FileNotFoundError(path)
+            for name, reference in self.listDirectory(inode):
+                if name == part:
+                    inode = self.readInode(reference)
+                    break
+            else:
+                raise FileNotFoundError(path)
+        return inode
+
+    def readBlock(self, position, sizeWord, expectedSize):
+        """Read and decompress single data block"""
+        size = sizeWord & ~UNCOMPRESSED_DATA
+        if size == 0:
+            return bytes(expectedSize)
+        data = self.pread(size, position)
+        if not sizeWord & UNCOMPRESSED_DATA:
+            data = self.decompress(data)
+        return data
+
+    def fragment(self, index):
+        """Return decompressed fragment block"""
+        with self.fragmentLock:
+            if self.fragments is None:
+                tableCount = (self.fragmentCount + 511) // 512
+                locations = struct.unpack("<{}Q".format(tableCount),
+                                          self.pread(8 * tableCount, self.fragmentTable))
+                self.fragments = []
+                for location in locations:
+                    data, _position = self.metadataBlock(location)
+                    self.fragments += [struct.unpack_from("<QI", data, i)
+                                       for i in range(0, len(data), 16)]
+            if index not in self.fragmentCache:
+                start, sizeWord = self.fragments[index]
+                self.fragmentCache[index] = self.readBlock(
+                    start, sizeWord, self.blockSize)
+            return self.fragmentCache[index]
+
+    def fileBlocks(self, inode):
+        """Return (position, sizeWord, expectedSize) of all data blocks"""
+        blocks = []
+        position = inode["start"]
+        remaining = inode["size"]
+        for sizeWord in inode["blockSizes"]:
+            blocks.append((position, sizeWord, min(remaining, self.blockSize)))
+            position += sizeWord & ~UNCOMPRESSED_DATA
+            remaining -= self.blockSize
+        return blocks
+
+    def extractFile(self, inode, destPath, executor, window):
+        with open(destPath, "wb") as f:
+            pending = []
+            for block in self.fileBlocks(inode):
+                pending.append(executor.submit(self.readBlock, *block))
+                if len(pending) >= window:
+                    f.write(pending.pop(0).result())
+            for future in pending:
+                f.write(future.result())
+            if inode["fragment"] != NO_FRAGMENT:
+                tailSize = inode["size"] % self.blockSize
+                fragmentOffset = inode["fragmentOffset"]
+                f.write(self.fragment(inode["fragment"])[
+                    fragmentOffset:fragmentOffset + tailSize])
+
+    def extract(self, path, destPath, workers=None, onProgress=None, skip=None):
+        """Extract content of directory at path into destPath,
+        onProgress(bytesRead, bytesWritten) is called after each file,
+        entries for which skip(relative path, inode) is True are left out"""
+        if workers is None:
+            workers = os.cpu_count() or 1
+        directories = []
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            stack = [(self.lookup(path), destPath, "")]
+            while stack:
+                inode, targetPath, relPath = stack.pop()
+                if inode["type"] not in DIR_TYPES:
+                    raise NotADirectoryError(path)
+                os.makedirs(targetPath, exist_ok=True)
+                directories.append((targetPath, inode))
+                for name, reference in self.listDirectory(inode):
+                    if "/" in name or name in (".", ".."):
+                        raise OSError("Refusing to extract unsafe entry {}".format(name))
+                    child = self.readInode(reference)
+                    childPath = pj(targetPath, name)
+                    if skip is not None and skip(relPath + name, child):
+                        continue
+                    if child["type"] in DIR_TYPES:
+                        stack.append((child, childPath, relPath + name + "/"))
+                    elif child["type"] in FILE_TYPES:
+                        self.extractFile(child, childPath, executor, workers * 2)
+                        os.chmod(childPath, child["mode"] & 0o777)
+                        os.utime(childPath, (child["mtime"], child["mtime"]))
+                        if onProgress is not None:
+                            onProgress(self.bytesRead, child["size"])
+                    elif child["type"] in SYMLINK_TYPES:
+                        os.symlink(child["target"], childPath)
+        # Set directory permissions after their content was written
+        for targetPath, inode in reversed(directories):
+            os.chmod(targetPath, inode["mode"] & 0o777 | 0o700)
+            os.utime(targetPath, (inode["mtime"], inode["mtime"]))
+
+
+def canExtract(path):
+    """Check if AppImage can be extracted without running it"""
+    try:
+        with squashfsImage(path) as image:
+            return image.isSupported()
+    except (OSError, struct.error):
+        return False
+
+
+def extractAppImage(path, subPath, destPath, workers=None, onProgress=None, skip=None):
+    """Extract content of subPath directory in AppImage into destPath"""
+    with squashfsImage(path) as image:
+        image.extract(subPath, destPath, workers, onProgress, skip)
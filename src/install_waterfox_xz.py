@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""
+Parallel xz decoder for installer scripts for Waterfox
+Depends: Python 3.5+
+
+xz files written by multithreaded xz consist of independent blocks, whose
+sizes are listed in index at the end of each stream. Every block is wrapped
+into standalone single-block stream and decoded by stdlib lzma in a pool of
+threads (lzma releases GIL). Decoded blocks are returned in original order.
+Files with single block have to be decoded sequentially by lzma.
+
+MIT License
+
+Copyright (c) 2022 hawkeye116477
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import lzma
+import mmap
+import zlib
+import contextlib
+import concurrent.futures
+from install_waterfox_bz2 import cpuCount, orderedFutures, parallelBz2Reader
+
+STREAM_MAGIC = b"\xfd7zXZ\x00"
+FOOTER_MAGIC = b"YZ"
+# Blocks are decoded whole into memory, bigger ones would need too much of it
+MAX_BLOCK_SIZE = 256 * 1048576
+
+
+def readVarint(data, pos):
+    """Return (value, position after it) of xz multibyte integer"""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+        if shift > 63:
+            raise OSError("Invalid xz index")
+
+
+def encodeVarint(value):
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def crc32(data):
+    return zlib.crc32(data).to_bytes(4, "little")
+
+
+def paddedSize(size):
+    return (size + 3) & ~3
+
+
+def findBlocks(data):
+    """Return (streamFlags, start, unpaddedSize, uncompressedSize) of all
+    blocks, read from indexes of streams from the last one"""
+    blocks = []
+    end = len(data)
+    while end > 0:
+        # Stream padding
+        while end >= 4 and data[end - 4:end] == b"\0\0\0\0":
+            end -= 4
+        footer = bytes(data[end - 12:end])
+        if end < 32 or footer[10:] != FOOTER_MAGIC or crc32(footer[4:10]) != footer[:4]:
+            raise OSError("Invalid xz stream footer")
+        flags = footer[8:10]
+        indexStart = end - 12 - (int.from_bytes(footer[4:8], "little") + 1) * 4
+        index = bytes(data[max(indexStart, 0):end - 12])
+        if indexStart < 12 or index[0] != 0 or crc32(index[:-4]) != index[-4:]:
+            raise OSError("Invalid xz index")
+        count, pos = readVarint(index, 1)
+        records = []
+        for _i in range(count):
+            unpaddedSize, pos = readVarint(index, pos)
+            uncompressedSize, pos = readVarint(index, pos)
+            records.append((unpaddedSize, uncompressedSize))
+        streamStart = indexStart - sum(paddedSize(record[0]) for record in records) - 12
+        if streamStart < 0 or data[streamStart:streamStart + 6] != STREAM_MAGIC or \
+                data[streamStart + 6:streamStart + 8] != flags:
+            raise OSError("Invalid xz stream header")
+        start = streamStart + 12
+        streamBlocks = []
+        for unpaddedSize, uncompressedSize in records:
+            streamBlocks.append((flags, start, unpaddedSize, uncompressedSize))
+            start += paddedSize(unpaddedSize)
+        blocks[:0] = streamBlocks
+        end = streamStart
+    return blocks
+
+
+def decodeBlock(flags, chunk, unpaddedSize, uncompressedSize):
+    """Decode single block, chunk is block with its padding"""
+    header = STREAM_MAGIC + flags + crc32(flags)
+    index = b"\0" + encodeVarint(1) + encodeVarint(unpaddedSize) + \
+        encodeVarint(uncompressedSize)
+    index += bytes(-len(index) % 4)
+    index += crc32(index)
+    backwardSize = (len(index) // 4 - 1).to_bytes(4, "little")
+    footer = crc32(backwardSize + flags) + backwardSize + flags + FOOTER_MAGIC
+    return lzma.decompress(header + chunk + index + footer, format=lzma.FORMAT_XZ)
+
+
+def canDecodeInParallel(path):
+    """Return True if xz file has more blocks of reasonable size"""
+    try:
+        with open(path, "rb") as xzFile, \
+                mmap.mmap(xzFile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            blocks = findBlocks(data)
+    except (OSError, ValueError, IndexError):
+        # Let lzma report what's wrong
+        return False
+    return len(blocks) > 1 and max(block[3] for block in blocks) <= MAX_BLOCK_SIZE
+
+
+def iterDecodedBlocks(data, workers, firstBlock=0):
+    """Yield decoded xz blocks with compressed bytes consumed so far and
+    index of block, in order"""
+    blocks = findBlocks(data)
+
+    def job(index):
+        flags, start, unpaddedSize, uncompressedSize = blocks[index]
+        end = start + paddedSize(unpaddedSize)
+        return (index, end), decodeBlock, (flags, data[start:end], unpaddedSize,
+                                           uncompressedSize)
+
+    jobs = map(job, range(firstBlock, len(blocks)))
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor, \
+            contextlib.closing(orderedFutures(executor, jobs, workers * 2)) as results:
+        for (blockIndex, end), future in results:
+            yield future.result(), end, blockIndex
+
+
+class parallelXzReader(parallelBz2Reader):
+    """Read-only file object with xz blocks decoded in parallel"""
+
+    decodeBlocks = staticmethod(iterDecodedBlocks)
+
+
+def openXz(path, workers=None):
+    """Open xz file for reading, decoding it on all available CPUs if it
+    has more blocks"""
+    if workers is None:
+        workers = cpuCount()
+    if workers <= 1 or not canDecodeInParallel(path):
+        return lzma.LZMAFile(path)
+    return parallelXzReader(path, workers)
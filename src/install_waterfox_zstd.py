@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""
+zstd decoder and encoder for installer scripts for Waterfox
+Depends: Python 3.5+, for zstd Python 3.14+ or zstd program
+
+zstd frames are independent, so file of more frames is split by walking
+frame and block headers (no decoding is needed) and frames are decoded
+in a pool of threads. zstdWriter writes such files, single frame files are
+decoded sequentially. Stdlib compression.zstd is used when available,
+otherwise zstd program does the work. All frames are streamed through its
+single process then, starting one for every frame would cost more than it saves.
+
+MIT License
+
+Copyright (c) 2022 hawkeye116477
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import os
+import mmap
+import shutil
+import subprocess
+import contextlib
+import collections
+import concurrent.futures
+from install_waterfox_bz2 import cpuCount, orderedFutures, parallelBz2Reader
+try:
+    from compression import zstd as zstdlib
+except ImportError:
+    zstdlib = None
+
+FRAME_MAGIC = 0xFD2FB528
+SKIPPABLE_MAGIC = 0x184D2A50
+SKIPPABLE_MASK = 0xFFFFFFF0
+# Decoded size of frames written by zstdWriter
+FRAME_SIZE = 8 * 1048576
+LEVEL = 3
+# Frames are decoded whole into memory, so decoded size of every frame
+# must be in its header and not bigger than this
+MAX_FRAME_SIZE = 64 * 1048576
+
+
+def zstdCommand():
+    return shutil.which("zstd")
+
+
+def available():
+    """Return True if zstd files can be decoded and written"""
+    return zstdlib is not None or zstdCommand() is not None
+
+
+def runZstd(arguments, data):
+    command = zstdCommand()
+    if command is None:
+        raise OSError("zstd isn't supported, Python 3.14+ or zstd program is needed")
+    result = subprocess.run([command, "-q", "-c"] + arguments, input=data,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    if result.returncode != 0:
+        raise OSError(result.stderr.decode(errors="replace").strip() or "zstd failed")
+    return result.stdout
+
+
+def compressFrame(data, level=LEVEL):
+    if zstdlib is not None:
+        return zstdlib.compress(data, level)
+    # Size known in advance is written into frame header like stdlib does
+    return runZstd(["-%d" % level, "--stream-size=%d" % len(data)], data)
+
+
+def decompressFrame(frame):
+    return zstdlib.decompress(frame)
+
+
+def frameContentSize(data, pos):
+    """Return decoded size from header of zstd frame starting at pos,
+    None if header doesn't have it"""
+    descriptor = data[pos + 4]
+    singleSegment = descriptor >> 5 & 1
+    sizeLength = (singleSegment, 2, 4, 8)[descriptor >> 6]
+    if not sizeLength:
+        return None
+    pos += 5 + (1 - singleSegment) + (0, 1, 2, 4)[descriptor & 3]
+    size = int.from_bytes(data[pos:pos + sizeLength], "little")
+    # Two byte field is offset, so it doesn't overlap with one byte one
+    return size + 256 if sizeLength == 2 else size
+
+
+def frameEnd(data, pos):
+    """Return end of zstd or skippable frame starting at pos"""
+    if len(data) - pos < 8:
+        raise OSError("Compressed file ended before the end-of-stream marker was reached")
+    magic = int.from_bytes(data[pos:pos + 4], "little")
+    if magic & SKIPPABLE_MASK == SKIPPABLE_MAGIC:
+        return pos + 8 + int.from_bytes(data[pos + 4:pos + 8], "little")
+    if magic != FRAME_MAGIC:
+        raise OSError("Unknown zstd frame descriptor")
+    descriptor = data[pos + 4]
+    singleSegment = descriptor >> 5 & 1
+    pos += 5 + (1 - singleSegment) + (0, 1, 2, 4)[descriptor & 3] + \
+        (singleSegment, 2, 4, 8)[descriptor >> 6]
+    while True:
+        if pos + 3 > len(data):
+            raise OSError("Compressed file ended before the end-of-stream marker was reached")
+        header = int.from_bytes(data[pos:pos + 3], "little")
+        blockType = header >> 1 & 3
+        if blockType == 3:
+            raise OSError("Corrupted zstd block detected")
+        # RLE block stores only one byte
+        pos += 3 + (1 if blockType == 1 else header >> 3)
+        if header & 1:
+            break
+    # Content checksum
+    return pos + 4 * (descriptor >> 2 & 1)
+
+
+def findFrames(data):
+    """Return (start, end) of all zstd frames, skippable ones are left out"""
+    frames = []
+    pos = 0
+    while pos < len(data):
+        end = frameEnd(data, pos)
+        if end > len(data):
+            raise OSError("Compressed file ended before the end-of-stream marker was reached")
+        if int.from_bytes(data[pos:pos + 4], "little") == FRAME_MAGIC:
+            frames.append((pos, end))
+        pos = end
+    return frames
+
+
+def canDecodeInParallel(path):
+    """Return True if zstd file has more frames with known decoded size,
+    which isn't too big, and they can be decoded in this process"""
+    if zstdlib is None:
+        return False
+    try:
+        with open(path, "rb") as zstdFile, \
+                mmap.mmap(zstdFile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            frames = findFrames(data)
+            sizes = [frameContentSize(data, start) for start, _end in frames]
+    except (OSError, ValueError, IndexError):
+        # Let sequential decoder report what's wrong
+        return False
+    return len(frames) > 1 and all(size is not None and size <= MAX_FRAME_SIZE
+                                   for size in sizes)
+
+
+def iterDecodedFrames(data, workers, firstFrame=0):
+    """Yield decoded zstd frames with compressed bytes consumed so far and
+    index of frame, in order"""
+    frames = findFrames(data)
+    jobs = (((index, end), decompressFrame, (data[start:end],))
+            for index, (start, end) in enumerate(frames) if index >= firstFrame)
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor, \
+            contextlib.closing(orderedFutures(executor, jobs, workers * 2)) as results:
+        for (frameIndex, end), future in results:
+            yield future.result(), end, frameIndex
+
+
+class parallelZstdReader(parallelBz2Reader):
+    """Read-only file object with zstd frames decoded in parallel"""
+
+    decodeBlocks = staticmethod(iterDecodedFrames)
+
+
+class zstdReader:
+    """Read-only file object decoding zstd file in one thread"""
+
+    def __init__(self, path, digest=None):
+        self.path = path
+        self.file = open(path, "rb")
+        if digest is not None:
+            for chunk in iter(lambda: self.file.read(1048576), b""):
+                digest.update(chunk)
+            self.file.seek(0)
+        self.process = None
+        if zstdlib is not None:
+            self.stream = zstdlib.ZstdFile(self.file)
+        else:
+            command = zstdCommand()
+            if command is None:
+                self.file.close()
+                raise OSError("zstd isn't supported, Python 3.14+ or zstd program is needed")
+            # Program shares file offset with us, so progress can be seen
+            self.process = subprocess.Popen([command, "-d", "-q", "-c"], stdin=self.file,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL)
+            self.stream = self.process.stdout
+
+    @property
+    def bytesRead(self):
+        return os.lseek(self.file.fileno(), 0, os.SEEK_CUR)
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        if not data and size != 0 and self.process is not None and self.process.wait() != 0:
+            raise OSError("zstd couldn't decode {}".format(self.path))
+        return data
+
+    def close(self):
+        self.stream.close()
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+            self.process.wait()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+
+def openZstd(path, workers=None):
+    """Open zstd file for reading, decoding it on all available CPUs if it
+    has more frames"""
+    if workers is None:
+        workers = cpuCount()
+    if workers > 1 and canDecodeInParallel(path):
+        return parallelZstdReader(path, workers)
+    return zstdReader(path)
+
+
+class zstdWriter:
+    """Write-only file object, which compresses data into independent frames
+    in a pool of threads, so it can be decoded in parallel again.
+
+    Failure doesn't raise from write(), it's kept in error and finish()
+    returns False, so installation goes on without compressed copy.
+    """
+
+    def __init__(self, fileobj, level=LEVEL, workers=None, frameSize=FRAME_SIZE):
+        self.file = fileobj
+        self.level = level
+        self.workers = workers or cpuCount()
+        self.frameSize = frameSize
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+        self.pending = collections.deque()
+        self.buffer = []
+        self.buffered = 0
+        self.error = None
+
+    def write(self, data):
+        if self.error is None and data:
+            self.buffer.append(bytes(data))
+            self.buffered += len(data)
+            if self.buffered >= self.frameSize:
+                self.submit()
+        return len(data)
+
+    def submit(self, wait=False):
+        try:
+            if self.buffered:
+                self.pending.append(self.executor.submit(
+                    compressFrame, b"".join(self.buffer), self.level))
+                self.buffer = []
+                self.buffered = 0
+            while self.pending and (wait or self.pending[0].done() or self.full()):
+                self.file.write(self.pending.popleft().result())
+        except OSError as error:
+            self.error = error
+            self.buffer = []
+            self.buffered = 0
+
+    def full(self):
+        return len(self.pending) > self.workers * 2
+
+    def finish(self):
+        """Write rest of data, return True if compressed file is complete"""
+        if self.error is None:
+            self.submit(wait=True)
+        self.close()
+        return self.error is None
+
+    def close(self):
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown()
+        try:
+            self.file.close()
+        except OSError as error:
+            if self.error is None:
+                self.error = error
@@ -0,0 +1,107 @@
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Helpers shared by tests, src is put on sys.path here"""
+import os
+import sys
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+
+pj = os.path.join
+pn = os.path.normpath
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+src_path = pn(pj(script_path, "..", "src"))
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+TREE_FILES = {
+    "waterfox": b"#!/bin/sh\nexit 0\n",
+    "libxul.so": b"\x7fELF" + bytes(4096),
+    "omni.ja": b"PK" + bytes(2048),
+    "application.ini": b"[App]\nName=Waterfox\n",
+    "browser/omni.ja": b"PK" + bytes(1024),
+    "browser/chrome/icons/default/default16.png": b"\x89PNG" + bytes(64),
+    "browser/chrome/icons/default/default48.png": b"\x89PNG" + bytes(256),
+    "dictionaries/en-US.dic": b"1\nhello\n",
+}
+
+
+def makeTree(rootPath, files=None):
+    for name, data in (files or TREE_FILES).items():
+        os.makedirs(os.path.dirname(pj(rootPath, name)), exist_ok=True)
+        with open(pj(rootPath, name), "wb") as f:
+            f.write(data)
+    os.chmod(pj(rootPath, "waterfox"), 0o755)
+
+
+def makePackage(dirPath, name="waterfox-G5.1.tar.bz2", files=None):
+    """Write tarball with small Waterfox-like tree, return its path"""
+    treePath = tempfile.mkdtemp(dir=dirPath)
+    makeTree(pj(treePath, "waterfox"), files)
+    packagePath = pj(dirPath, name)
+    with tarfile.open(packagePath, "w:bz2") as tar:
+        tar.add(pj(treePath, "waterfox"), arcname="waterfox")
+    shutil.rmtree(treePath)
+    return packagePath
+
+
+def readTree(rootPath):
+    """Return {relative path: content} of regular files in tree"""
+    tree = {}
+    for root, _dirs, files in os.walk(rootPath):
+        for name in files:
+            path = pj(root, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                with open(path, "rb") as f:
+                    tree[os.path.relpath(path, rootPath)] = f.read()
+    return tree
+
+
+class tempDirTestCase(unittest.TestCase):
+    """Test case with temporary directory in tempPath"""
+
+    def setUp(self):
+        self.tempPath = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Trash can still be emptied by detached process
+        shutil.rmtree(self.tempPath, ignore_errors=True)
+
+
+class homeTestCase(tempDirTestCase):
+    """Test case with temporary HOME, config and cache directories"""
+
+    def setUp(self):
+        super().setUp()
+        self.homePath = pj(self.tempPath, "home")
+        os.makedirs(self.homePath)
+        self.oldEnviron = dict(os.environ)
+        os.environ["HOME"] = self.homePath
+        os.environ["XDG_CONFIG_HOME"] = pj(self.homePath, ".config")
+        os.environ["XDG_CACHE_HOME"] = pj(self.homePath, ".cache")
+        self.installPath = pj(self.homePath, ".local", "lib")
+        self.configPath = pj(self.homePath, ".config", "install_waterfox", "settings.conf")
+        self.messages = []
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.oldEnviron)
+        super().tearDown()
+
+    def install(self, packagePath, edition="G", **kwargs):
+        import install_waterfox_common  # pylint: disable=import-outside-toplevel
+        os.makedirs(os.path.dirname(self.configPath), exist_ok=True)
+        install_waterfox_common.install(packagePath, self.installPath, edition, "no", "no",
+                                        "no", self.configPath, self.messages.append,
+                                        **kwargs)
+
+    def uninstall(self, edition="G"):
+        import install_waterfox_common  # pylint: disable=import-outside-toplevel
+        # xdg-user-dir may be missing
+        with mock.patch.object(install_waterfox_common, "desktopDirectory",
+                               return_value=self.homePath):
+            install_waterfox_common.uninstall(self.installPath, edition, self.configPath,
+                                              "no", self.messages.append)
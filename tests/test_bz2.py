@@ -0,0 +1,65 @@
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Tests of parallel bzip2 decoder"""
+import os
+import bz2
+import random
+import threading
+import unittest
+import concurrent.futures
+from unittest import mock
+
+import support
+import install_waterfox_bz2
+
+pj = os.path.join
+
+
+class parallelBz2ReaderTest(support.tempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rnd = random.Random(116477)
+        # Level 1 has 100 kB blocks, so file has several of them
+        self.data = bytes(rnd.randrange(16) for _i in range(500000))
+        self.path = pj(self.tempPath, "data.bz2")
+        with open(self.path, "wb") as f:
+            f.write(bz2.compress(self.data, 1))
+
+    def decode(self):
+        with install_waterfox_bz2.parallelBz2Reader(self.path, 2) as reader:
+            return reader.read()
+
+    def test_blocks_are_decoded_in_order(self):
+        self.assertEqual(self.decode(), self.data)
+
+    def test_block_split_at_false_magic_is_glued_again(self):
+        findBlocks = install_waterfox_bz2.findBlocks
+
+        def findSplitBlocks(data):
+            blocks = findBlocks(data)
+            level, start, end = blocks[1]
+            # As if block magic appeared by chance inside compressed data
+            middle = (start + end) // 2
+            return blocks[:1] + [(level, start, middle), (level, middle, end)] + blocks[2:]
+
+        with mock.patch.object(install_waterfox_bz2, "findBlocks", findSplitBlocks):
+            self.assertEqual(self.decode(), self.data)
+
+    def test_process_with_more_threads_decodes_in_threads(self):
+        results = {}
+
+        def decodeInThread():
+            results["executor"] = install_waterfox_bz2.blockExecutor(2)
+            results["data"] = self.decode()
+
+        thread = threading.Thread(target=decodeInThread)
+        thread.start()
+        thread.join()
+        results["executor"].shutdown()
+        self.assertIsInstance(results["executor"], concurrent.futures.ThreadPoolExecutor)
+        self.assertEqual(results["data"], self.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Tests of several install() calls running at once in one install root"""
+import os
+import errno
+import tempfile
+import threading
+import unittest
+
+import support
+import install_waterfox_common
+
+pj = os.path.join
+
+EDITIONS = ("G", "Classic", "Current")
+
+
+class concurrentInstallTest(support.homeTestCase):
+
+    def makePackages(self):
+        packages = {}
+        for edition in EDITIONS:
+            files = dict(support.TREE_FILES, **{
+                "application.ini": "[App]\nName={}\n".format(edition).encode()})
+            packages[edition] = support.makePackage(
+                self.tempPath, "waterfox-{}-1.0.tar.bz2".format(edition), files)
+        return packages
+
+    def installInThreads(self, jobs):
+        errors = {}
+        barrier = threading.Barrier(len(jobs))
+
+        def run(name, packagePath, edition):
+            barrier.wait()
+            try:
+                self.install(packagePath, edition)
+            except Exception as error:  # pylint: disable=broad-except
+                errors[name] = error
+
+        threads = [threading.Thread(target=run, args=job) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_editions_are_installed_at_once(self):
+        packages = self.makePackages()
+        errors = self.installInThreads([(edition, packages[edition], edition)
+                                        for edition in EDITIONS])
+        self.assertEqual(errors, {})
+        for edition in EDITIONS:
+            tree = support.readTree(pj(self.installPath, "waterfox-" + edition.lower()))
+            self.assertEqual(tree["application.ini"],
+                             "[App]\nName={}\n".format(edition).encode())
+            self.assertEqual(tree["libxul.so"], support.TREE_FILES["libxul.so"])
+            self.assertTrue(os.path.isfile(pj(self.homePath, ".local", "share", "applications",
+                                              "waterfox-{}.desktop".format(edition.lower()))))
+        # Only installed editions and shared directories are left
+        leftovers = [name for name in os.listdir(self.installPath)
+                     if name.startswith(".waterfox-")]
+        self.assertEqual(leftovers, [])
+
+    def test_same_edition_is_refused_while_installing(self):
+        packagePath = self.makePackages()["G"]
+        os.makedirs(self.installPath)
+        stagingPath = tempfile.mkdtemp(prefix=".waterfox-g-", dir=self.installPath)
+        stagingFd = install_waterfox_common.lockDirectory(stagingPath)
+        try:
+            with self.assertRaises(OSError) as context:
+                self.install(packagePath, "G")
+            self.assertEqual(context.exception.errno, errno.EBUSY)
+            # Other editions aren't blocked
+            self.install(self.makePackages()["Classic"], "Classic")
+        finally:
+            os.close(stagingFd)
+        self.assertTrue(os.path.isdir(stagingPath))
+        self.assertFalse(os.path.exists(pj(self.installPath, "waterfox-g")))
+        self.install(packagePath, "G")
+        self.assertTrue(os.path.isdir(pj(self.installPath, "waterfox-g")))
+
+    def test_repeated_install_of_same_edition_in_threads(self):
+        packagePath = self.makePackages()["G"]
+        errors = self.installInThreads([(name, packagePath, "G") for name in ("a", "b")])
+        # Either both ran one after another, or the later one was refused
+        for error in errors.values():
+            self.assertEqual(error.errno, errno.EBUSY)
+        self.assertLess(len(errors), 2)
+        self.assertEqual(support.readTree(pj(self.installPath, "waterfox-g"))["libxul.so"],
+                         support.TREE_FILES["libxul.so"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Tests of fleet provisioning with privileges of users stubbed out"""
+import os
+import unittest
+from unittest import mock
+
+import support
+import install_waterfox_fleet as fleet
+
+pj = os.path.join
+
+
+def fakeRunAsUser(target, func, *args):
+    """Run func in the same process, user "broken" fails like in real child"""
+    if target.name == "broken":
+        raise RuntimeError("PermissionError: [Errno 13] Permission denied")
+    return func(*args)
+
+
+class provisionTest(support.tempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.packagePath = support.makePackage(self.tempPath)
+        self.targets = [fleet.fleetTarget(name, pj(self.tempPath, name), os.getuid(),
+                                          os.getgid())
+                        for name in ("alice", "broken", "bob")]
+        for target in self.targets:
+            os.makedirs(target.homePath)
+
+    def provision(self, mode):
+        messages = []
+        with mock.patch.object(fleet, "runAsUser", fakeRunAsUser):
+            results = fleet.provision(self.packagePath, "G", self.targets, messages.append,
+                                      mode=mode, installDesktopShortcut="no", workers=2,
+                                      stagingDir=self.tempPath)
+        return results, messages
+
+    def test_failed_user_doesnt_stop_others(self):
+        for mode in ("copy", "hardlink"):
+            with self.subTest(mode=mode):
+                results, messages = self.provision(mode)
+                self.assertEqual([result.ok for result in results], [True, False, True])
+                self.assertIn("FAILED broken ({:.1f} s)".format(results[1].elapsed), messages)
+                for target in (self.targets[0], self.targets[2]):
+                    installedPath = pj(target.homePath, ".local", "lib", "waterfox-g")
+                    self.assertEqual(support.readTree(installedPath), support.TREE_FILES)
+                    self.assertTrue(os.path.exists(pj(target.homePath, ".config",
+                                                      "install_waterfox", "settings.conf")))
+                self.assertFalse(os.path.exists(pj(self.targets[1].homePath, ".local")))
+                # Shared staging tree is removed
+                self.assertEqual(sorted(os.listdir(self.tempPath)),
+                                 sorted(["alice", "bob", "broken",
+                                         os.path.basename(self.packagePath)]))
+
+    def test_summary_reports_failed_and_skipped_users(self):
+        results, _messages = self.provision("copy")
+        report = fleet.summary(results, skipped=[("carol", "KeyError: 'carol'")])
+        self.assertIn("Installed for 2 of 4 users.", report)
+        self.assertIn("Skipped carol: KeyError: 'carol'", report)
+        self.assertIn("Failed for broken ({}): RuntimeError: PermissionError: "
+                      "[Errno 13] Permission denied".format(self.targets[1].homePath), report)
+        self.assertIn("{} copy".format(2 * len(support.TREE_FILES)), report)
+
+
+if __name__ == "__main__":
+    unittest.main()
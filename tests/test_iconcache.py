@@ -0,0 +1,160 @@
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Tests of icon-theme.cache writer"""
+import os
+import time
+import ctypes
+import ctypes.util
+import random
+import shutil
+import unittest
+import subprocess
+
+import support
+import install_waterfox_iconcache as iconcache
+
+pj = os.path.join
+
+THEME_FILES = {
+    "index.theme": b"[Icon Theme]\nName=Test\n",
+    "toplevel.png": b"\x89PNG",
+    "48x48/apps/waterfox-g.png": b"\x89PNG",
+    "48x48/apps/waterfox-g.icon": b"[Icon Data]\n",
+    "48x48/apps/waterfox-classic.png": b"\x89PNG",
+    "48x48/apps/notes.txt": b"",
+    "48x48/mimetypes/text-html.xpm": b"/* XPM */",
+    "scalable/apps/waterfox-g.svg": b"<svg/>",
+    "scalable/apps/only-data.icon": b"[Icon Data]\n",
+    "256x256/apps/README": b"",
+}
+
+
+def makeTheme(themePath):
+    for name, data in THEME_FILES.items():
+        os.makedirs(os.path.dirname(pj(themePath, name)), exist_ok=True)
+        with open(pj(themePath, name), "wb") as f:
+            f.write(data)
+    os.makedirs(pj(themePath, "32x32", "apps"))
+    os.makedirs(pj(themePath, "64x64"))
+    os.symlink("missing.png", pj(themePath, "64x64", "dangling.png"))
+    os.symlink("waterfox-g.png", pj(themePath, "48x48", "apps", "waterfox-current.png"))
+
+
+def cacheContent(themePath):
+    """Return {directory: {icon name: flags}} of cache, which doesn't
+    depend on order of directories and hash chains"""
+    directories, icons = iconcache.readIconCache(pj(themePath, iconcache.CACHE_NAME))
+    content = {directory: {} for directory in directories}
+    for name, images in icons.items():
+        for dirIndex, flags in images:
+            content[directories[dirIndex]][name] = flags
+    return content
+
+
+class iconCacheTest(support.tempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.themePath = pj(self.tempPath, "hicolor")
+        makeTheme(self.themePath)
+
+    def test_only_directories_with_images_are_listed(self):
+        iconcache.updateIconCache(self.themePath)
+        content = cacheContent(self.themePath)
+        self.assertEqual(sorted(content), [b"48x48/apps", b"48x48/mimetypes",
+                                           b"scalable/apps"])
+        self.assertEqual(content[b"48x48/apps"], {
+            b"waterfox-g": iconcache.HAS_SUFFIX_PNG | iconcache.HAS_ICON_FILE,
+            b"waterfox-classic": iconcache.HAS_SUFFIX_PNG,
+            b"waterfox-current": iconcache.HAS_SUFFIX_PNG})
+        self.assertEqual(content[b"scalable/apps"], {b"waterfox-g": iconcache.HAS_SUFFIX_SVG})
+
+    def test_new_directory_below_directory_without_images_is_found(self):
+        iconcache.updateIconCache(self.themePath)
+        # Cache written in the same tick as directory would look up to date
+        time.sleep(0.01)
+        os.makedirs(pj(self.themePath, "48x48", "places"))
+        with open(pj(self.themePath, "48x48", "places", "folder.png"), "wb") as f:
+            f.write(b"\x89PNG")
+        self.assertTrue(iconcache.updateIconCache(self.themePath))
+        self.assertEqual(cacheContent(self.themePath)[b"48x48/places"],
+                         {b"folder": iconcache.HAS_SUFFIX_PNG})
+
+    def test_directory_emptied_and_filled_again_is_found(self):
+        appsPath = pj(self.themePath, "48x48", "mimetypes")
+        os.remove(pj(appsPath, "text-html.xpm"))
+        iconcache.updateIconCache(self.themePath)
+        self.assertNotIn(b"48x48/mimetypes", cacheContent(self.themePath))
+        time.sleep(iconcache.TIMESTAMP_MARGIN)
+        with open(pj(appsPath, "text-html.png"), "wb") as f:
+            f.write(b"\x89PNG")
+        self.assertTrue(iconcache.updateIconCache(self.themePath))
+        self.assertEqual(cacheContent(self.themePath)[b"48x48/mimetypes"],
+                         {b"text-html": iconcache.HAS_SUFFIX_PNG})
+
+    def test_unchanged_theme_isnt_written_again(self):
+        iconcache.updateIconCache(self.themePath)
+        time.sleep(iconcache.TIMESTAMP_MARGIN)
+        iconcache.updateIconCache(self.themePath)
+        self.assertFalse(iconcache.updateIconCache(self.themePath))
+
+    @unittest.skipIf(ctypes.util.find_library("glib-2.0") is None, "GLib isn't installed")
+    def test_hash_table_is_iterated_like_glib_one(self):
+        glib = ctypes.CDLL(ctypes.util.find_library("glib-2.0"))
+        glib.g_hash_table_new.restype = ctypes.c_void_p
+        glib.g_hash_table_new.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        glib.g_hash_table_insert.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_void_p]
+        glib.g_hash_table_foreach.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
+        glib.g_hash_table_destroy.argtypes = [ctypes.c_void_p]
+        callbackType = ctypes.CFUNCTYPE(None, ctypes.c_char_p, ctypes.c_void_p, ctypes.c_void_p)
+        rnd = random.Random(116477)
+        for count in (0, 1, 7, 8, 40, 300):
+            names = [bytes(rnd.choice(b"abcdef-_.\xc3\xa9") for _i in range(rnd.randrange(1, 12)))
+                     for _i in range(count)]
+            # Names are kept alive by the list while table refers to them
+            names = list(dict.fromkeys(names))
+            table = glib.g_hash_table_new(ctypes.cast(glib.g_str_hash, ctypes.c_void_p),
+                                          ctypes.cast(glib.g_str_equal, ctypes.c_void_p))
+            ours = iconcache.glibHashTable()
+            for name in names:
+                glib.g_hash_table_insert(table, name, None)
+                ours.insert(name)
+            order = []
+            callback = callbackType(lambda key, _value, _data: order.append(key))
+            glib.g_hash_table_foreach(table, ctypes.cast(callback, ctypes.c_void_p), None)
+            glib.g_hash_table_destroy(table)
+            self.assertEqual(list(ours), order)
+
+    @unittest.skipIf(shutil.which("gtk-update-icon-cache") is None,
+                     "gtk-update-icon-cache isn't installed")
+    def test_cache_is_the_same_as_gtk_one(self):
+        gtkThemePath = pj(self.tempPath, "gtk")
+        shutil.copytree(self.themePath, gtkThemePath, symlinks=True)
+        subprocess.run(["gtk-update-icon-cache", "--quiet", "--ignore-theme-index",
+                        "--force", gtkThemePath], check=True)
+        iconcache.updateIconCache(self.themePath, force=True)
+        self.assertEqual(cacheContent(self.themePath), cacheContent(gtkThemePath))
+        with open(pj(self.themePath, iconcache.CACHE_NAME), "rb") as cacheFile, \
+                open(pj(gtkThemePath, iconcache.CACHE_NAME), "rb") as gtkCacheFile:
+            self.assertEqual(cacheFile.read(), gtkCacheFile.read())
+
+
+class installIconCacheTest(support.homeTestCase):
+
+    def iconCache(self):
+        return cacheContent(pj(self.homePath, ".local", "share", "icons", "hicolor"))
+
+    def test_reinstalled_edition_is_in_cache(self):
+        packagePath = support.makePackage(self.tempPath)
+        self.install(packagePath)
+        self.assertIn(b"waterfox-g", self.iconCache()[b"48x48/apps"])
+        self.uninstall()
+        self.assertNotIn(b"48x48/apps", self.iconCache())
+        self.install(packagePath)
+        # Package has only these sizes, other symlinks are dangling
+        self.assertEqual(sorted(self.iconCache()), [b"16x16/apps", b"48x48/apps"])
+        self.assertIn(b"waterfox-g", self.iconCache()[b"48x48/apps"])
+
+
+if __name__ == "__main__":
+    unittest.main()
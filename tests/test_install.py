@@ -0,0 +1,209 @@
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Tests of install() of unpacked package"""
+import os
+import hashlib
+import unittest
+from unittest import mock
+
+import support
+import install_waterfox_common
+import install_waterfox_zstd
+
+pj = os.path.join
+
+
+class installFromCacheTest(support.homeTestCase):
+
+    def test_removed_package_is_installed_from_cache(self):
+        packagePath = support.makePackage(self.tempPath)
+        self.install(packagePath, treeCacheSize="100")
+        installed = support.readTree(pj(self.installPath, "waterfox-g"))
+        os.remove(packagePath)
+        self.install(packagePath, treeCacheSize="100")
+        self.assertTrue(any("from cache" in message for message in self.messages))
+        self.assertEqual(support.readTree(pj(self.installPath, "waterfox-g")), installed)
+
+
+class deltaUpgradeTest(support.homeTestCase):
+
+    def upgrade(self):
+        files = dict(support.TREE_FILES, **{"application.ini": b"[App]\nVersion=5.2\n"})
+        self.install(support.makePackage(self.tempPath, "waterfox-G5.2.tar.bz2", files))
+        return support.readTree(pj(self.installPath, "waterfox-g"))
+
+    def test_unchanged_files_are_linked_from_installed_version(self):
+        self.install(support.makePackage(self.tempPath))
+        libPath = pj(self.installPath, "waterfox-g", "libxul.so")
+        iniPath = pj(self.installPath, "waterfox-g", "application.ini")
+        libInode = os.stat(libPath).st_ino
+        iniInode = os.stat(iniPath).st_ino
+        self.assertEqual(self.upgrade()["application.ini"], b"[App]\nVersion=5.2\n")
+        self.assertEqual(os.stat(libPath).st_ino, libInode)
+        self.assertNotEqual(os.stat(iniPath).st_ino, iniInode)
+        manifest = install_waterfox_common.readManifest(pj(self.installPath, "waterfox-g"))
+        self.assertEqual(manifest["libxul.so"]["sha256"],
+                         hashlib.sha256(support.TREE_FILES["libxul.so"]).hexdigest())
+
+    def test_file_modified_after_installation_is_written_again(self):
+        self.install(support.makePackage(self.tempPath))
+        libPath = pj(self.installPath, "waterfox-g", "libxul.so")
+        libInode = os.stat(libPath).st_ino
+        with open(libPath, "r+b") as libFile:
+            libFile.write(b"MZ")
+        os.utime(libPath, (0, 0))
+        self.assertEqual(self.upgrade()["libxul.so"], support.TREE_FILES["libxul.so"])
+        self.assertNotEqual(os.stat(libPath).st_ino, libInode)
+
+
+class checksumTest(support.homeTestCase):
+
+    def writeChecksum(self, packagePath, hexDigest=None):
+        if hexDigest is None:
+            with open(packagePath, "rb") as packageFile:
+                hexDigest = hashlib.sha256(packageFile.read()).hexdigest()
+        with open(packagePath + ".sha256", "w", encoding='utf-8') as checksumFile:
+            checksumFile.write("{}  {}\n".format(hexDigest, os.path.basename(packagePath)))
+
+    def recompressedFiles(self):
+        cachePath = os.path.dirname(install_waterfox_common.recompressedPath(
+            pj(self.tempPath, "waterfox-G5.1.tar.bz2")))
+        return os.listdir(cachePath) if os.path.isdir(cachePath) else []
+
+    @unittest.skipUnless(install_waterfox_zstd.available(), "zstd isn't supported")
+    def test_package_is_hashed_while_unpacked_and_recompressed(self):
+        packagePath = support.makePackage(self.tempPath)
+        self.writeChecksum(packagePath)
+        with mock.patch.object(install_waterfox_common, "hashFile",
+                               side_effect=AssertionError("package was hashed separately")):
+            self.install(packagePath, recompressPackages="yes")
+        self.assertEqual(len(self.recompressedFiles()), 1)
+        self.install(packagePath, recompressPackages="yes")
+        self.assertTrue(any("recompressed copy" in message for message in self.messages))
+        self.assertEqual(support.readTree(pj(self.installPath, "waterfox-g")),
+                         dict(support.TREE_FILES, **{
+                             install_waterfox_common.MANIFEST_NAME: mock.ANY}))
+
+    def test_mismatch_rolls_back_installation_and_recompressed_copy(self):
+        self.install(support.makePackage(self.tempPath, "waterfox-G5.0.tar.bz2"))
+        installed = support.readTree(pj(self.installPath, "waterfox-g"))
+        files = dict(support.TREE_FILES, **{"application.ini": b"[App]\nVersion=5.1\n"})
+        packagePath = support.makePackage(self.tempPath, files=files)
+        self.writeChecksum(packagePath, "0" * 64)
+        with self.assertRaises(ValueError):
+            self.install(packagePath, recompressPackages="yes")
+        self.assertTrue(any("rolled back" in message for message in self.messages))
+        self.assertEqual(support.readTree(pj(self.installPath, "waterfox-g")), installed)
+        self.assertEqual(self.recompressedFiles(), [])
+
+
+class extractFilterTest(support.homeTestCase):
+
+    def test_essential_files_are_never_skipped(self):
+        filters = install_waterfox_common.extractFilter(
+            "dictionaries/en-US.*", "browser,*.so,dictionaries,updater")
+        for name, skipped in (("browser/features/screenshots.xpi", True),
+                              ("browser/omni.ja", False),
+                              ("browser/chrome/icons/default/default48.png", False),
+                              ("libxul.so", False),
+                              ("dictionaries", False),
+                              ("dictionaries/en-US.dic", False),
+                              ("dictionaries/pl.dic", True),
+                              ("updater.ini", True),
+                              ("icons/updater.png", True),
+                              ("waterfox", False)):
+            with self.subTest(name=name):
+                self.assertEqual(filters.skips(name), skipped)
+        self.assertFalse(install_waterfox_common.extractFilter("", "").skips("browser"))
+
+    def test_excluded_files_arent_installed(self):
+        files = dict(support.TREE_FILES, **{"browser/features/screenshots.xpi": b"PK"})
+        packagePath = support.makePackage(self.tempPath, files=files)
+        self.install(packagePath, extractExclude="browser,dictionaries,*.so")
+        installed = support.readTree(pj(self.installPath, "waterfox-g"))
+        # Essential files of excluded directory stay
+        self.assertEqual(sorted(name for name in installed
+                                if name != install_waterfox_common.MANIFEST_NAME),
+                         sorted(name for name in support.TREE_FILES
+                                if not name.startswith("dictionaries/")))
+        self.assertTrue(any("Skipped 0.0 MiB in 2 files" in message
+                            for message in self.messages))
+
+    def test_filtered_tree_is_cached_separately(self):
+        packagePath = support.makePackage(self.tempPath)
+        self.install(packagePath, treeCacheSize="100", extractExclude="dictionaries")
+        self.messages = []
+        self.install(packagePath, treeCacheSize="100")
+        self.assertFalse(any("from cache" in message for message in self.messages))
+        self.assertIn("dictionaries/en-US.dic",
+                      support.readTree(pj(self.installPath, "waterfox-g")))
+
+
+class treeCacheTest(support.homeTestCase):
+
+    def writeChecksum(self, packagePath, hexDigest, algorithm="sha256"):
+        with open(packagePath + "." + algorithm, "w", encoding='utf-8') as checksumFile:
+            checksumFile.write("{}  {}\n".format(hexDigest, os.path.basename(packagePath)))
+
+    def test_miss_reads_package_only_for_unpacking(self):
+        packagePath = support.makePackage(self.tempPath)
+        with mock.patch.object(install_waterfox_common, "hashFile",
+                               side_effect=AssertionError("package was hashed separately")):
+            self.install(packagePath, treeCacheSize="100")
+        with open(packagePath, "rb") as packageFile:
+            sha256 = hashlib.sha256(packageFile.read()).hexdigest()
+        self.assertEqual(install_waterfox_common.treeCache("100").key(packagePath), sha256)
+        self.install(packagePath, treeCacheSize="100")
+        self.assertTrue(any("from cache" in message for message in self.messages))
+
+    def test_changed_package_isnt_taken_from_cache(self):
+        packagePath = support.makePackage(self.tempPath)
+        self.install(packagePath, treeCacheSize="100")
+        files = dict(support.TREE_FILES, **{"application.ini": b"[App]\nName=Other\n"})
+        support.makePackage(self.tempPath, files=files)
+        self.messages = []
+        self.install(packagePath, treeCacheSize="100")
+        self.assertFalse(any("from cache" in message for message in self.messages))
+        self.assertEqual(support.readTree(pj(self.installPath, "waterfox-g"))[
+            "application.ini"], b"[App]\nName=Other\n")
+
+    def test_cached_tree_is_verified(self):
+        packagePath = support.makePackage(self.tempPath)
+        with open(packagePath, "rb") as packageFile:
+            sha256 = hashlib.sha256(packageFile.read()).hexdigest()
+        self.writeChecksum(packagePath, sha256)
+        self.install(packagePath, treeCacheSize="100")
+        self.install(packagePath, treeCacheSize="100")
+        self.assertTrue(any("from cache" in message for message in self.messages))
+        self.writeChecksum(packagePath, "0" * 64)
+        self.messages = []
+        with self.assertRaises(ValueError):
+            self.install(packagePath, treeCacheSize="100")
+        self.assertFalse(any("from cache" in message for message in self.messages))
+
+    def test_removed_package_is_verified_with_stored_digest(self):
+        packagePath = support.makePackage(self.tempPath)
+        with open(packagePath, "rb") as packageFile:
+            sha512 = hashlib.sha512(packageFile.read()).hexdigest()
+        self.writeChecksum(packagePath, sha512, "sha512")
+        self.install(packagePath, treeCacheSize="100")
+        os.remove(packagePath)
+        self.install(packagePath, treeCacheSize="100")
+        self.assertTrue(any("from cache" in message for message in self.messages))
+        self.writeChecksum(packagePath, "0" * 128, "sha512")
+        with self.assertRaises(ValueError):
+            self.install(packagePath, treeCacheSize="100")
+
+    def test_removed_package_without_stored_digest_is_installed_from_cache(self):
+        packagePath = support.makePackage(self.tempPath)
+        self.install(packagePath, treeCacheSize="100")
+        # Checksum published after package was cached can't be computed
+        # from removed package, cache key is its SHA-256
+        self.writeChecksum(packagePath, "0" * 128, "sha512")
+        os.remove(packagePath)
+        self.install(packagePath, treeCacheSize="100")
+        self.assertTrue(any("from cache" in message for message in self.messages))
+
+
+if __name__ == "__main__":
+    unittest.main()
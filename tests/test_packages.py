@@ -0,0 +1,74 @@
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Tests of package discovery for --spath"""
+import os
+import unittest
+from unittest import mock
+
+import support
+import install_waterfox_common
+
+pj = os.path.join
+
+
+class findPackagesTest(support.homeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sourcePath = pj(self.tempPath, "downloads")
+        for name in ("waterfox-G5.1.2.tar.bz2", "old/waterfox-classic-2022.11.tar.xz",
+                     "old/notes.txt", ".hidden/waterfox-G4.0.tar.bz2",
+                     "a/b/c/d/e/waterfox-G3.0.tar.bz2"):
+            os.makedirs(os.path.dirname(pj(self.sourcePath, name)), exist_ok=True)
+            open(pj(self.sourcePath, name), "wb").close()
+
+    def find(self):
+        """Return found packages and directories which were scanned"""
+        scanned = []
+        scandir = os.scandir
+
+        def countingScandir(path):
+            scanned.append(os.path.relpath(path, self.sourcePath))
+            return scandir(path)
+
+        with mock.patch.object(install_waterfox_common.os, "scandir", countingScandir):
+            packages = install_waterfox_common.findPackages(self.sourcePath)
+        return [(os.path.relpath(path, self.sourcePath), edition, version)
+                for path, edition, version in packages], sorted(scanned)
+
+    def test_packages_are_found_up_to_max_depth(self):
+        packages, _scanned = self.find()
+        self.assertEqual(packages, [
+            ("old/waterfox-classic-2022.11.tar.xz", "Classic", "2022.11"),
+            ("waterfox-G5.1.2.tar.bz2", "G5", "5.1.2")])
+
+    def test_only_changed_directories_are_scanned_again(self):
+        packages, _scanned = self.find()
+        self.assertEqual(self.find(), (packages, []))
+        open(pj(self.sourcePath, "old", "waterfox-G5.0.tar.bz2"), "wb").close()
+        packages, scanned = self.find()
+        self.assertEqual(scanned, ["old"])
+        self.assertIn(("old/waterfox-G5.0.tar.bz2", "G5", "5.0"), packages)
+        os.remove(pj(self.sourcePath, "waterfox-G5.1.2.tar.bz2"))
+        packages, scanned = self.find()
+        self.assertEqual(scanned, ["."])
+        self.assertNotIn("waterfox-G5.1.2.tar.bz2", [package[0] for package in packages])
+
+    def test_replaced_directory_with_the_same_mtime_is_scanned_again(self):
+        self.find()
+        oldPath = pj(self.sourcePath, "old")
+        oldStat = os.stat(oldPath)
+        sourceStat = os.stat(self.sourcePath)
+        # Old directory is kept, so new one can't get its inode
+        os.rename(oldPath, pj(self.tempPath, "moved"))
+        os.makedirs(oldPath)
+        open(pj(oldPath, "waterfox-G6.0.tar.zst"), "wb").close()
+        os.utime(oldPath, ns=(oldStat.st_atime_ns, oldStat.st_mtime_ns))
+        os.utime(self.sourcePath, ns=(sourceStat.st_atime_ns, sourceStat.st_mtime_ns))
+        packages, scanned = self.find()
+        self.assertIn("old", scanned)
+        self.assertIn(("old/waterfox-G6.0.tar.zst", "G6", "6.0"), packages)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Tests of page cache prewarming"""
+import os
+import sys
+import subprocess
+import unittest
+
+import support
+import install_waterfox_prewarm
+
+pj = os.path.join
+
+
+class prewarmerTest(support.tempDirTestCase):
+
+    def test_files_are_read(self):
+        files = []
+        for name, size in (("libxul.so", 3000000), ("omni.ja", 1000), ("empty", 0)):
+            with open(pj(self.tempPath, name), "wb") as f:
+                f.write(bytes(size))
+            files.append((pj(self.tempPath, name), size))
+        files.append((pj(self.tempPath, "removed"), 10))
+        warmer = install_waterfox_prewarm.prewarmer(files, workers=2)
+        self.assertTrue(warmer.wait(30))
+        self.assertEqual(warmer.bytesRead, 3001000)
+
+    def test_installer_exits_while_files_are_read(self):
+        # Reading of FIFO without writer never finishes
+        fifoPath = pj(self.tempPath, "fifo")
+        os.mkfifo(fifoPath)
+        code = ("import install_waterfox_prewarm\n"
+                "warmer = install_waterfox_prewarm.prewarmer([({!r}, 0)])\n"
+                "assert not warmer.wait(0.1)\n".format(fifoPath))
+        subprocess.run([sys.executable, "-c", code], check=True, timeout=30,
+                       env=dict(os.environ, PYTHONPATH=support.src_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
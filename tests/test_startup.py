@@ -0,0 +1,55 @@
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Tests that entry points don't load modules needed only for installation"""
+import os
+import sys
+import subprocess
+import unittest
+
+import support
+
+pj = os.path.join
+
+HEAVY_MODULES = ["tarfile", "bz2", "lzma", "hashlib", "install_waterfox_common",
+                 "install_waterfox_GUI", "gi"]
+
+
+def importedModules(pythonArgs):
+    """Return names of modules imported by python with pythonArgs"""
+    result = subprocess.run([sys.executable, "-X", "importtime"] + pythonArgs,
+                            cwd=support.src_path, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+class startupImportsTest(unittest.TestCase):
+
+    def test_cli_module_import_is_light(self):
+        loaded = importedModules(["-c", "import install_waterfox_CLI"])
+        self.assertIn("install_waterfox_CLI", loaded)
+        self.assertEqual(sorted(loaded & set(HEAVY_MODULES)), [])
+
+    def test_cli_version_doesnt_parse_arguments(self):
+        loaded = importedModules([pj(support.src_path, "install_waterfox_CLI.py"), "-v"])
+        self.assertEqual(sorted(loaded & set(HEAVY_MODULES + ["argparse"])), [])
+
+    def test_cli_help_doesnt_load_installer(self):
+        loaded = importedModules([pj(support.src_path, "install_waterfox_CLI.py"), "-h"])
+        self.assertIn("argparse", loaded)
+        # argparse needs shutil, which imports bz2 and lzma itself
+        self.assertEqual(sorted(loaded & (set(HEAVY_MODULES) - {"bz2", "lzma"})), [])
+
+    def test_common_module_loads_unpackers_lazily(self):
+        loaded = importedModules(["-c", "import install_waterfox_common"])
+        self.assertEqual(sorted(loaded & {
+            "install_waterfox_bz2", "install_waterfox_xz", "install_waterfox_zstd",
+            "install_waterfox_squashfs", "install_waterfox_iconcache",
+            "install_waterfox_prewarm", "multiprocessing"}), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
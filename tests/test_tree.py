@@ -0,0 +1,188 @@
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Tests of operations on installed trees"""
+import os
+import stat
+import time
+import errno
+import unittest
+from unittest import mock
+
+import support
+import install_waterfox_common
+
+pj = os.path.join
+
+
+class swapDirectoriesTest(support.tempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.oldPath = pj(self.tempPath, "waterfox-g")
+        self.newPath = pj(self.tempPath, "staging")
+        support.makeTree(self.oldPath)
+        support.makeTree(self.newPath, dict(support.TREE_FILES,
+                                            **{"application.ini": b"[App]\nName=New\n"}))
+        self.newTree = support.readTree(self.newPath)
+
+    def test_trees_are_exchanged(self):
+        oldTree = support.readTree(self.oldPath)
+        self.assertEqual(install_waterfox_common.swapDirectories(self.newPath, self.oldPath),
+                         self.newPath)
+        self.assertEqual(support.readTree(self.oldPath), self.newTree)
+        self.assertEqual(support.readTree(self.newPath), oldTree)
+
+    def test_trees_are_renamed_without_rename_exchange(self):
+        with mock.patch.object(install_waterfox_common.ctypes, "CDLL",
+                               side_effect=OSError("no libc")):
+            movedPath = install_waterfox_common.swapDirectories(self.newPath, self.oldPath)
+        self.assertEqual(movedPath, self.newPath + ".old")
+        self.assertEqual(support.readTree(self.oldPath), self.newTree)
+        self.assertFalse(os.path.exists(self.newPath))
+        self.assertEqual(support.readTree(movedPath)["application.ini"],
+                         support.TREE_FILES["application.ini"])
+
+
+class upgradeTest(support.homeTestCase):
+
+    def test_upgrade_without_rename_exchange_leaves_only_new_tree(self):
+        self.install(support.makePackage(self.tempPath))
+        files = dict(support.TREE_FILES, **{"application.ini": b"[App]\nVersion=5.2\n"})
+        packagePath = support.makePackage(self.tempPath, "waterfox-G5.2.tar.bz2", files)
+        with mock.patch.object(install_waterfox_common.ctypes, "CDLL",
+                               side_effect=OSError("no libc")):
+            self.install(packagePath)
+        install_waterfox_common.emptyTrash(self.installPath, wait=True)
+        self.assertEqual(support.readTree(pj(self.installPath, "waterfox-g"))[
+            "application.ini"], b"[App]\nVersion=5.2\n")
+        self.assertEqual(sorted(name for name in os.listdir(self.installPath)
+                                if name.startswith(".waterfox") or "old" in name), [])
+
+
+def failing(error):
+    return mock.Mock(side_effect=OSError(error, os.strerror(error)))
+
+
+class copyEngineTest(support.tempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sourcePath = pj(self.tempPath, "source")
+        support.makeTree(self.sourcePath)
+        self.filePath = pj(self.sourcePath, "libxul.so")
+        self.destPath = pj(self.tempPath, "dest")
+
+    def test_hard_link_across_filesystems_falls_back_to_copy(self):
+        with mock.patch.object(install_waterfox_common.os, "link", failing(errno.EXDEV)):
+            method = install_waterfox_common.copyFile(self.filePath, self.destPath, "hardlink")
+        self.assertIn(method, ("reflink", "copy_file_range", "sendfile", "copy"))
+        self.assertNotEqual(os.stat(self.destPath).st_ino, os.stat(self.filePath).st_ino)
+        with open(self.destPath, "rb") as destFile:
+            self.assertEqual(destFile.read(), support.TREE_FILES["libxul.so"])
+
+    def test_other_hard_link_errors_are_raised(self):
+        with mock.patch.object(install_waterfox_common.os, "link", failing(errno.EACCES)):
+            with self.assertRaises(PermissionError):
+                install_waterfox_common.copyFile(self.filePath, self.destPath, "hardlink")
+
+    def test_unsupported_kernel_copy_falls_back_to_next_way(self):
+        expected = (("sendfile", {"copy_file_range": failing(errno.EXDEV)}),
+                    ("copy", {"copy_file_range": failing(errno.ENOSYS),
+                              "sendfile": failing(errno.EINVAL)}))
+        for method, patches in expected:
+            with self.subTest(method=method), \
+                    mock.patch.multiple(install_waterfox_common.os, **patches):
+                self.assertEqual(install_waterfox_common.copyFileData(
+                    self.filePath, self.destPath), method)
+                with open(self.destPath, "rb") as destFile:
+                    self.assertEqual(destFile.read(), support.TREE_FILES["libxul.so"])
+
+    def test_tree_is_copied_when_it_cant_be_renamed(self):
+        os.symlink("libxul.so", pj(self.sourcePath, "browser", "libxul.so"))
+        os.chmod(pj(self.sourcePath, "browser"), 0o750)
+        with mock.patch.object(install_waterfox_common.os, "rename", failing(errno.EXDEV)):
+            install_waterfox_common.moveTree(self.sourcePath, self.destPath)
+        self.assertFalse(os.path.exists(self.sourcePath))
+        self.assertEqual(support.readTree(self.destPath), support.TREE_FILES)
+        self.assertEqual(os.readlink(pj(self.destPath, "browser", "libxul.so")), "libxul.so")
+        self.assertEqual(stat.S_IMODE(os.stat(pj(self.destPath, "browser")).st_mode), 0o750)
+        self.assertTrue(os.access(pj(self.destPath, "waterfox"), os.X_OK))
+
+
+class trashTest(support.tempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.installPath = pj(self.tempPath, "lib")
+        self.trashPath = pj(self.installPath, install_waterfox_common.TRASH_NAME)
+        self.treePath = pj(self.installPath, "waterfox-g")
+        support.makeTree(self.treePath)
+        os.symlink("libxul.so", pj(self.treePath, "browser", "libxul.so"))
+
+    def test_tree_is_moved_at_once_and_removed_later(self):
+        install_waterfox_common.moveToTrash(self.treePath, self.installPath)
+        self.assertFalse(os.path.exists(self.treePath))
+        self.assertEqual(len(os.listdir(self.trashPath)), 1)
+        install_waterfox_common.emptyTrash(self.installPath, removeInstallPath=True, wait=True)
+        self.assertFalse(os.path.exists(self.installPath))
+
+    def test_trash_is_emptied_by_detached_process(self):
+        install_waterfox_common.moveToTrash(self.treePath, self.installPath)
+        install_waterfox_common.emptyTrash(self.installPath)
+        deadline = time.monotonic() + 30
+        while os.path.exists(self.trashPath) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(os.path.exists(self.trashPath))
+        self.assertTrue(os.path.isdir(self.installPath))
+
+    def test_trash_left_by_crashed_run_is_emptied(self):
+        support.makeTree(pj(self.trashPath, "tmpcrashed", "waterfox-g"))
+        install_waterfox_common.emptyTrash(self.installPath, wait=True)
+        self.assertFalse(os.path.exists(self.trashPath))
+        self.assertEqual(support.readTree(self.treePath), support.TREE_FILES)
+
+    def test_trash_emptied_by_other_installer_is_left_alone(self):
+        install_waterfox_common.moveToTrash(self.treePath, self.installPath)
+        trashFd = install_waterfox_common.lockDirectory(self.trashPath)
+        try:
+            install_waterfox_common.emptyTrash(self.installPath, wait=True)
+        finally:
+            os.close(trashFd)
+        self.assertEqual(len(os.listdir(self.trashPath)), 1)
+
+
+class dedupStoreTest(support.homeTestCase):
+
+    def storeObjects(self):
+        storePath = pj(self.installPath, install_waterfox_common.STORE_NAME)
+        if not os.path.isdir(storePath):
+            return []
+        return sorted(objectDir + name for objectDir in os.listdir(storePath)
+                      for name in os.listdir(pj(storePath, objectDir)))
+
+    def test_editions_share_files_until_uninstalled(self):
+        self.install(support.makePackage(self.tempPath), deduplicateEditions="yes")
+        files = dict(support.TREE_FILES, **{"application.ini": b"[App]\nName=Classic\n"})
+        self.install(support.makePackage(self.tempPath, "waterfox-classic-2022.11.tar.bz2",
+                                         files), "Classic", deduplicateEditions="yes")
+        gPath = pj(self.installPath, "waterfox-g")
+        classicPath = pj(self.installPath, "waterfox-classic")
+        self.assertEqual(os.stat(pj(gPath, "libxul.so")).st_ino,
+                         os.stat(pj(classicPath, "libxul.so")).st_ino)
+        self.assertNotEqual(os.stat(pj(gPath, "application.ini")).st_ino,
+                            os.stat(pj(classicPath, "application.ini")).st_ino)
+        self.assertEqual(len(self.storeObjects()), len(support.TREE_FILES) + 1)
+        self.uninstall()
+        # Objects of G which aren't used by Classic are freed
+        classicManifest = install_waterfox_common.readManifest(classicPath)
+        self.assertEqual(self.storeObjects(), sorted(
+            {entry["sha256"] for entry in classicManifest.values()}))
+        self.assertEqual(support.readTree(classicPath)["application.ini"],
+                         b"[App]\nName=Classic\n")
+        self.uninstall("Classic")
+        self.assertFalse(os.path.exists(pj(self.installPath,
+                                           install_waterfox_common.STORE_NAME)))
+
+
+if __name__ == "__main__":
+    unittest.main()
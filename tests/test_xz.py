@@ -0,0 +1,62 @@
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Tests of xz block splitting"""
+import os
+import lzma
+import random
+import unittest
+
+import support
+import install_waterfox_xz as xz
+
+pj = os.path.join
+
+
+class blockTest(support.tempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rnd = random.Random(116477)
+        self.data = bytes(rnd.randrange(16) for _i in range(300000))
+        # Every stream written by lzma has a single block
+        self.pieces = [self.data[:100000], self.data[100000:250000], self.data[250000:]]
+        self.compressed = lzma.compress(self.pieces[0]) + bytes(8) + \
+            lzma.compress(self.pieces[1], check=lzma.CHECK_SHA256) + \
+            lzma.compress(self.pieces[2], check=lzma.CHECK_NONE)
+        self.path = pj(self.tempPath, "data.xz")
+        with open(self.path, "wb") as f:
+            f.write(self.compressed)
+
+    def test_blocks_of_all_streams_are_found(self):
+        blocks = xz.findBlocks(self.compressed)
+        self.assertEqual([block[3] for block in blocks], [len(piece) for piece in self.pieces])
+        for block, piece in zip(blocks, self.pieces):
+            flags, start, unpaddedSize, uncompressedSize = block
+            chunk = self.compressed[start:start + xz.paddedSize(unpaddedSize)]
+            self.assertEqual(xz.decodeBlock(flags, chunk, unpaddedSize, uncompressedSize),
+                             piece)
+
+    def test_blocks_are_decoded_in_order(self):
+        self.assertTrue(xz.canDecodeInParallel(self.path))
+        with xz.openXz(self.path, 2) as reader:
+            self.assertIsInstance(reader, xz.parallelXzReader)
+            self.assertEqual(reader.read(), self.data)
+
+    def test_single_block_is_decoded_sequentially(self):
+        with open(self.path, "wb") as f:
+            f.write(lzma.compress(self.data))
+        self.assertFalse(xz.canDecodeInParallel(self.path))
+        with xz.openXz(self.path, 2) as reader:
+            self.assertEqual(reader.read(), self.data)
+
+    def test_truncated_file_is_reported(self):
+        for end in (len(self.compressed) - 1, len(self.compressed) - 20, 20):
+            with self.subTest(end=end), self.assertRaises(OSError):
+                xz.findBlocks(self.compressed[:end])
+        with open(self.path, "wb") as f:
+            f.write(self.compressed[:-1])
+        self.assertFalse(xz.canDecodeInParallel(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
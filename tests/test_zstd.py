@@ -0,0 +1,93 @@
+# pylint: disable=C0103
+# pylint: disable=consider-using-f-string
+"""Tests of zstd frame splitting"""
+import io
+import os
+import random
+import unittest
+
+import support
+import install_waterfox_zstd as zstd
+
+pj = os.path.join
+
+
+@unittest.skipUnless(zstd.available(), "zstd isn't supported")
+class frameTest(support.tempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rnd = random.Random(116477)
+        self.data = bytes(rnd.randrange(16) for _i in range(300000))
+
+    def test_frame_header_has_content_size(self):
+        for size in (0, 200, 256, 300, 70000, 300000):
+            frame = zstd.compressFrame(self.data[:size])
+            self.assertEqual(zstd.frameContentSize(frame, 0), size)
+
+    @unittest.skipIf(zstd.zstdCommand() is None, "zstd program isn't installed")
+    def test_frame_without_content_size_isnt_decoded_in_parallel(self):
+        # Program doesn't know size of streamed data without --stream-size
+        frame = zstd.runZstd(["-3"], self.data)
+        self.assertIsNone(zstd.frameContentSize(frame, 0))
+        self.assertEqual(zstd.findFrames(frame), [(0, len(frame))])
+        path = pj(self.tempPath, "data.zst")
+        with open(path, "wb") as f:
+            f.write(frame * 2)
+        self.assertFalse(zstd.canDecodeInParallel(path))
+        with zstd.openZstd(path, 2) as reader:
+            self.assertEqual(reader.read(), self.data * 2)
+
+    @unittest.skipIf(zstd.zstdlib is None, "compression.zstd isn't available")
+    def test_frames_with_content_size_are_decoded_in_parallel(self):
+        path = pj(self.tempPath, "data.zst")
+        with open(path, "wb") as f:
+            f.write(zstd.compressFrame(self.data[:100000]) + zstd.compressFrame(self.data[100000:]))
+        self.assertTrue(zstd.canDecodeInParallel(path))
+        with zstd.openZstd(path, 2) as reader:
+            self.assertEqual(reader.read(), self.data)
+
+    def writeFrames(self, data, frameSize=100000):
+        output = io.BytesIO()
+        output.close = lambda: None
+        writer = zstd.zstdWriter(output, workers=2, frameSize=frameSize)
+        for pos in range(0, len(data), 25000):
+            writer.write(data[pos:pos + 25000])
+        self.assertTrue(writer.finish())
+        return output.getvalue()
+
+    def test_written_file_is_split_into_frames(self):
+        # Zeros are stored in RLE blocks
+        data = self.data + bytes(200000)
+        compressed = self.writeFrames(data)
+        frames = zstd.findFrames(compressed)
+        self.assertEqual(len(frames), 5)
+        self.assertEqual(frames[-1][1], len(compressed))
+        decoded = [zstd.runZstd(["-d"], compressed[start:end]) if zstd.zstdlib is None
+                   else zstd.decompressFrame(compressed[start:end]) for start, end in frames]
+        self.assertEqual(decoded[0], data[:100000])
+        self.assertEqual(b"".join(decoded), data)
+        path = pj(self.tempPath, "data.zst")
+        with open(path, "wb") as f:
+            f.write(compressed)
+        with zstd.openZstd(path, 2) as reader:
+            self.assertEqual(reader.read(), data)
+
+    def test_skippable_frames_are_left_out(self):
+        compressed = self.writeFrames(self.data[:150000])
+        skippable = (zstd.SKIPPABLE_MAGIC + 3).to_bytes(4, "little") + \
+            (5).to_bytes(4, "little") + b"hello"
+        frames = zstd.findFrames(skippable + compressed)
+        self.assertEqual([(start - len(skippable), end - len(skippable))
+                          for start, end in frames], zstd.findFrames(compressed))
+        self.assertEqual(len(frames), 2)
+
+    def test_truncated_file_is_reported(self):
+        compressed = self.writeFrames(self.data[:150000])
+        for end in (len(compressed) - 1, len(compressed) - 100, 6):
+            with self.subTest(end=end), self.assertRaises(OSError):
+                zstd.findFrames(compressed[:end])
+
+
+if __name__ == "__main__":
+    unittest.main()